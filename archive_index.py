@@ -0,0 +1,363 @@
+import argparse
+import calendar
+import glob
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from pipeline import CHUNK_BYTES, DAY, EARTH_RADIUS, Deriver, Validator, haversine, parse, read_chunks
+
+''' Spatiotemporal index of a log archive in one SQLite file. Valid fixes of every ingested log
+    are stored in blocks of BLOCK_SIZE consecutive fixes, an R-tree holds the longitude, latitude
+    and time box of every block, so a query reads only blocks whose box meets the query and
+    filters their fixes with NumPy. Logs are ingested incrementally - archives growing by sync
+    have only the bytes past the indexed offset parsed, rewritten logs are indexed again.
+    Logs hold GPS time of day only, absolute time of the new part is anchored by its last fix
+    being before the file modification time, unless date of the first fix is given '''
+
+INDEX_NAME = "index.sqlite"
+BLOCK_SIZE = 512
+# bytes before indexed offset compared with the file, as in sync
+TAIL_CHECK = 256
+
+FIX_DTYPE = np.dtype([
+    ("time", np.float64),           # UTC seconds since epoch
+    ("gps_long", np.float64),
+    ("gps_lat", np.float64),
+    ("gps_alt", np.float32),
+])
+RESULT_DTYPE = np.dtype(FIX_DTYPE.descr + [("file_id", np.int32)])
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, tag_id TEXT, offset INTEGER, "
+    "tail_crc INTEGER, fixes INTEGER, time_from REAL, time_to REAL, updated TEXT)",
+    "CREATE TABLE IF NOT EXISTS blocks (id INTEGER PRIMARY KEY, file_id INTEGER, count INTEGER, data BLOB)",
+    "CREATE INDEX IF NOT EXISTS blocks_file ON blocks (file_id)",
+]
+BOX_COLUMNS = "id, min_long, max_long, min_lat, max_lat, min_time, max_time"
+
+
+''' UTC seconds since epoch of midnight of YYYY-MM-DD '''
+def parse_date(date):
+    return float(calendar.timegm(time.strptime(date, '%Y-%m-%d')))
+
+
+''' Seconds of day from HH:MM '''
+def parse_hour(value):
+    hours, minutes = value.split(':')
+    return int(hours) * 3600 + int(minutes) * 60
+
+
+def tag_from_file_name(file_name):
+    # harvest names logs <tag>_<yyyymmdd>_<hhmmss>.txt (<tag>_<yyyymmdd>.txt before), sync <tag>.txt
+    return re.sub(r'_\d{8}(_\d{6})?$', '', os.path.splitext(os.path.basename(file_name))[0])
+
+
+''' Offset just past the last complete line at or before size '''
+def last_line_end(file_name, start, size):
+    with open(file_name, 'rb') as f:
+        end = size
+        while end > start:
+            begin = max(start, end - 65536)
+            f.seek(begin)
+            cut = f.read(end - begin).rfind(b'\n')
+            if cut >= 0:
+                return begin + cut + 1
+            end = begin
+    return start
+
+
+def tail_crc(file_name, offset):
+    with open(file_name, 'rb') as f:
+        f.seek(offset - min(offset, TAIL_CHECK))
+        return zlib.crc32(f.read(min(offset, TAIL_CHECK)))
+
+
+''' Mask of times whose time of day is within [tod_from, tod_to), the range wraps past midnight
+    when tod_to < tod_from, e.g. 22:00 - 02:00 '''
+def in_hours(times, tod_from, tod_to, utc_offset=0.0):
+    tod = np.mod(np.asarray(times) + utc_offset * 3600, DAY)
+    if tod_from <= tod_to:
+        return (tod >= tod_from) & (tod < tod_to)
+    return (tod >= tod_from) | (tod < tod_to)
+
+
+''' Mask of time spans [start, end] containing some time of day within [tod_from, tod_to) '''
+def spans_hours(start, end, tod_from, tod_to, utc_offset=0.0):
+    length = np.asarray(end) - np.asarray(start)
+    first = np.mod(np.asarray(start) + utc_offset * 3600, DAY)
+    if tod_to < tod_from:
+        tod_to += DAY
+    mask = length >= DAY
+    for shift in (-DAY, 0.0, DAY):
+        mask |= (first < tod_to + shift) & (first + length >= tod_from + shift)
+    return mask
+
+
+class ArchiveIndex:
+    def __init__(self, path):
+        if os.path.isdir(path):
+            path = os.path.join(path, INDEX_NAME)
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            for statement in SCHEMA:
+                self.db.execute(statement)
+            try:
+                self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS boxes USING rtree(%s)" % BOX_COLUMNS)
+            except sqlite3.OperationalError:
+                # SQLite without R-tree module, same columns in an ordinary table scanned by time
+                self.db.execute("CREATE TABLE IF NOT EXISTS boxes (id INTEGER PRIMARY KEY, min_long REAL, "
+                                "max_long REAL, min_lat REAL, max_lat REAL, min_time REAL, max_time REAL)")
+                self.db.execute("CREATE INDEX IF NOT EXISTS boxes_time ON boxes (max_time, min_time)")
+        self.last_query = {}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def files(self):
+        with self.lock:
+            rows = self.db.execute("SELECT id, path, tag_id, fixes, time_from, time_to, updated FROM files "
+                                   "ORDER BY tag_id, path").fetchall()
+        return [dict(zip(("id", "path", "tag_id", "fixes", "time_from", "time_to", "updated"), row))
+                for row in rows]
+
+    def tags(self):
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT DISTINCT tag_id FROM files ORDER BY tag_id")]
+
+    def remove(self, file_name):
+        with self.lock, self.db:
+            self.remove_file(os.path.abspath(file_name))
+
+    def remove_file(self, path):
+        row = self.db.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return
+        self.db.execute("DELETE FROM boxes WHERE id IN (SELECT id FROM blocks WHERE file_id = ?)", row)
+        self.db.execute("DELETE FROM blocks WHERE file_id = ?", row)
+        self.db.execute("DELETE FROM files WHERE id = ?", row)
+
+    ''' Indexes complete lines of file_name not indexed yet, returns number of new fixes '''
+    def ingest(self, file_name, tag_id=None, date=None):
+        path = os.path.abspath(file_name)
+        size = os.path.getsize(path)
+        mtime = os.path.getmtime(path)
+        with self.lock:
+            row = self.db.execute("SELECT offset, tail_crc FROM files WHERE path = ?", (path,)).fetchone()
+        offset = 0
+        if row is not None:
+            offset = row[0]
+            if offset > size or tail_crc(path, offset) != row[1]:
+                offset = 0
+        end = last_line_end(path, offset, size)
+        if row is not None and end <= offset:
+            return 0
+
+        parts = []
+        for records in Deriver()(Validator()(parse(read_chunks(path, CHUNK_BYTES, offset, end)))):
+            valid = np.isfinite(records["gps_long"]) & np.isfinite(records["time"])
+            fixes = np.empty(int(valid.sum()), dtype=FIX_DTYPE)
+            for field in FIX_DTYPE.names:
+                fixes[field] = records[field][valid]
+            parts.append(fixes)
+        fixes = np.concatenate(parts) if parts else np.empty(0, dtype=FIX_DTYPE)
+
+        if len(fixes):
+            if date is not None:
+                base = parse_date(date)
+            else:
+                # last fix is the latest instant with its time of day before the file was written
+                last = mtime - mtime % DAY + fixes["time"][-1] % DAY
+                if last > mtime:
+                    last -= DAY
+                base = last - fixes["time"][-1]
+            fixes["time"] += base
+
+        with self.lock, self.db:
+            if row is not None and offset == 0:
+                self.remove_file(path)
+                row = None
+            if row is None:
+                self.db.execute("INSERT INTO files (path, tag_id, fixes) VALUES (?, ?, 0)",
+                                (path, tag_id or tag_from_file_name(path)))
+            file_id, = self.db.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+
+            for start in range(0, len(fixes), BLOCK_SIZE):
+                block = fixes[start:start + BLOCK_SIZE]
+                block_id = self.db.execute("INSERT INTO blocks (file_id, count, data) VALUES (?, ?, ?)",
+                                           (file_id, len(block), block.tobytes())).lastrowid
+                self.db.execute("INSERT INTO boxes (%s) VALUES (?, ?, ?, ?, ?, ?, ?)" % BOX_COLUMNS,
+                                (block_id, block["gps_long"].min(), block["gps_long"].max(), block["gps_lat"].min(),
+                                 block["gps_lat"].max(), block["time"].min(), block["time"].max()))
+
+            self.db.execute("UPDATE files SET offset = ?, tail_crc = ?, fixes = fixes + ?, updated = ?, "
+                            "time_from = COALESCE(MIN(time_from, ?), ?, time_from), "
+                            "time_to = COALESCE(MAX(time_to, ?), ?, time_to) WHERE id = ?",
+                            (end, tail_crc(path, end), len(fixes), time.strftime('%Y-%m-%d %H:%M:%S'),
+                             *(2 * [float(fixes["time"].min())] if len(fixes) else [None, None]),
+                             *(2 * [float(fixes["time"].max())] if len(fixes) else [None, None]), file_id))
+        return len(fixes)
+
+    ''' Ingests all logs in archive_dir matching pattern, returns {file: new fixes} '''
+    def ingest_dir(self, archive_dir, pattern="*.txt"):
+        return {file_name: self.ingest(file_name) for file_name in sorted(glob.glob(os.path.join(archive_dir,
+                                                                                                 pattern)))}
+
+    ''' Fixes matching all given filters as RESULT_DTYPE array, sorted by file and time.
+        area     - (min_long, min_lat, max_long, max_lat)
+        center   - (long, lat) with radius [m]
+        time_from, time_to - UTC seconds since epoch
+        hours    - (from, to) seconds of day, wraps past midnight when to < from, shifted to
+                   local time by utc_offset [h]
+        tag_id   - only logs of this tag '''
+    def query(self, area=None, center=None, radius=None, time_from=None, time_to=None, hours=None, utc_offset=0.0,
+              tag_id=None):
+        start_time = time.perf_counter()
+        box = [-180.0, -90.0, 180.0, 90.0] if area is None else list(area)
+        if center is not None:
+            # degrees of latitude spanned by radius, longitude ones get wider towards poles
+            dlat = np.degrees(radius / EARTH_RADIUS)
+            dlong = 180.0 if abs(center[1]) + dlat >= 90 else dlat / np.cos(np.radians(abs(center[1]) + dlat))
+            box = [max(box[0], center[0] - dlong), max(box[1], center[1] - dlat),
+                   min(box[2], center[0] + dlong), min(box[3], center[1] + dlat)]
+        time_range = [-np.inf if time_from is None else time_from, np.inf if time_to is None else time_to]
+
+        sql = "SELECT boxes.id, min_time, max_time FROM boxes"
+        if tag_id is not None:
+            sql += " JOIN blocks ON blocks.id = boxes.id JOIN files ON files.id = blocks.file_id"
+        sql += " WHERE max_long >= ? AND min_long <= ? AND max_lat >= ? AND min_lat <= ? AND max_time >= ? " \
+               "AND min_time <= ?"
+        parameters = [box[0], box[2], box[1], box[3], *time_range]
+        if tag_id is not None:
+            sql += " AND files.tag_id = ?"
+            parameters.append(tag_id)
+
+        with self.lock:
+            candidates = np.array(self.db.execute(sql, parameters).fetchall(), dtype=np.float64).reshape(-1, 3)
+            if hours is not None and len(candidates):
+                candidates = candidates[spans_hours(candidates[:, 1], candidates[:, 2], hours[0], hours[1],
+                                                    utc_offset)]
+            block_ids = [int(block_id) for block_id in candidates[:, 0]]
+            rows = []
+            # bound number of SQL parameters
+            for start in range(0, len(block_ids), 500):
+                chunk = block_ids[start:start + 500]
+                rows += self.db.execute("SELECT file_id, data FROM blocks WHERE id IN (%s)" %
+                                        ",".join("?" * len(chunk)), chunk).fetchall()
+
+        parts = []
+        for file_id, data in rows:
+            fixes = np.frombuffer(data, dtype=FIX_DTYPE)
+            mask = (fixes["gps_long"] >= box[0]) & (fixes["gps_long"] <= box[2]) & \
+                   (fixes["gps_lat"] >= box[1]) & (fixes["gps_lat"] <= box[3]) & \
+                   (fixes["time"] >= time_range[0]) & (fixes["time"] <= time_range[1])
+            if center is not None:
+                mask &= haversine(center[0], center[1], fixes["gps_long"], fixes["gps_lat"]) <= radius
+            if hours is not None:
+                mask &= in_hours(fixes["time"], hours[0], hours[1], utc_offset)
+            selected = fixes[mask]
+            if len(selected):
+                result = np.empty(len(selected), dtype=RESULT_DTYPE)
+                for field in FIX_DTYPE.names:
+                    result[field] = selected[field]
+                result["file_id"] = file_id
+                parts.append(result)
+
+        result = np.concatenate(parts) if parts else np.empty(0, dtype=RESULT_DTYPE)
+        result = result[np.lexsort((result["time"], result["file_id"]))]
+        self.last_query = {"blocks": len(rows), "fixes": len(result), "seconds": time.perf_counter() - start_time}
+        return result
+
+
+def print_files(index):
+    for entry in index.files():
+        time_range = "-"
+        if entry["time_from"] is not None:
+            time_range = "%s - %s" % (time.strftime('%Y-%m-%d %H:%M', time.gmtime(entry["time_from"])),
+                                      time.strftime('%Y-%m-%d %H:%M', time.gmtime(entry["time_to"])))
+        print("%-16s %9d fixes  %s  %s" % (entry["tag_id"], entry["fixes"], time_range, entry["path"]))
+
+
+def cmd_update(index, args):
+    start_time = time.monotonic()
+    if args.files:
+        added = {file_name: index.ingest(file_name, args.tag, args.date) for file_name in args.files}
+    else:
+        added = index.ingest_dir(args.archive, args.pattern)
+    for file_name, count in added.items():
+        if count:
+            print("%-40s %9d new fixes" % (file_name, count))
+    print("Indexed %d new fixes of %d log(s) in %.2f s" % (sum(added.values()), len(added),
+                                                          time.monotonic() - start_time))
+
+
+def cmd_query(index, args):
+    center = tuple(float(value) for value in args.near.split(',')) if args.near else None
+    area = tuple(float(value) for value in args.area.split(',')) if args.area else None
+    hours = tuple(parse_hour(value) for value in args.hours.split('-')) if args.hours else None
+    result = index.query(area, center, args.radius, parse_date(args.date_from) if args.date_from else None,
+                         parse_date(args.date_to) + DAY if args.date_to else None, hours, args.utc_offset, args.tag)
+
+    files = {entry["id"]: entry for entry in index.files()}
+    for file_id in np.unique(result["file_id"]):
+        fixes = result[result["file_id"] == file_id]
+        print("%-16s %9d fixes  %s" % (files[file_id]["tag_id"], len(fixes), files[file_id]["path"]))
+    print("%d fixes from %d block(s) in %.1f ms" % (len(result), index.last_query["blocks"],
+                                                   index.last_query["seconds"] * 1000))
+    if args.csv:
+        with open(args.csv, 'w') as f:
+            f.write("tag_id,time,gps_long,gps_lat,gps_alt\n")
+            for fix in result:
+                f.write("%s,%s,%.6f,%.6f,%.1f\n" % (files[fix["file_id"]]["tag_id"],
+                                                    time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(fix["time"])),
+                                                    fix["gps_long"], fix["gps_lat"], fix["gps_alt"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Spatiotemporal index of downloaded logs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    update = commands.add_parser("update", help="index logs of archive not indexed yet")
+    update.add_argument("archive", help="archive directory, index is kept in it")
+    update.add_argument("files", nargs="*", help="logs to index, all matching --pattern by default")
+    update.add_argument("--pattern", default="*.txt")
+    update.add_argument("--tag", help="tag ID of given files, taken from file name by default")
+    update.add_argument("--date", help="date of the first new fix YYYY-MM-DD, from file time by default")
+    update.set_defaults(func=cmd_update)
+
+    query = commands.add_parser("query", help="fixes within area, distance, dates and hours")
+    query.add_argument("archive")
+    query.add_argument("--near", help="LONG,LAT center of radius search")
+    query.add_argument("--radius", type=float, default=5000.0, help="radius around --near [m]")
+    query.add_argument("--area", help="MIN_LONG,MIN_LAT,MAX_LONG,MAX_LAT")
+    query.add_argument("--from", dest="date_from", help="first day YYYY-MM-DD")
+    query.add_argument("--to", dest="date_to", help="last day YYYY-MM-DD")
+    query.add_argument("--hours", help="time of day range HH:MM-HH:MM, e.g. 22:00-02:00")
+    query.add_argument("--utc-offset", type=float, default=0.0, help="hours of --hours ahead of UTC")
+    query.add_argument("--tag")
+    query.add_argument("--csv", help="write matching fixes to this file")
+    query.set_defaults(func=cmd_query)
+
+    files = commands.add_parser("files", help="list indexed logs")
+    files.add_argument("archive")
+    files.set_defaults(func=lambda index, args: print_files(index))
+    args = parser.parse_args(argv)
+
+    index = ArchiveIndex(args.archive)
+    try:
+        args.func(index, args)
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,274 @@
+import argparse
+import os
+import sys
+import time
+from sys import platform
+
+from usb import UsbConnection
+
+SENSOR_FIELDS = ["baro_alt", "gps_long", "gps_lat", "gps_alt", "gps_time", "gps_fix_time", "gps_time_time"]
+FLAG_NAMES = {1: "ok", 2: "unknown"}
+
+
+def port_name(port):
+    # bare number works the same way as in the UI
+    if port.isdigit():
+        if platform == "win32":
+            return "COM" + port
+        return "/dev/ttyUSB" + port
+    return port
+
+
+def open_connection(args):
+    usb_com = UsbConnection(port_name(args.port), args.baud)
+    usb_com.instrumentation.enabled = bool(args.trace or args.stats)
+    usb_com.replay_speed = args.replay_speed
+    if args.record:
+        from session import SessionRecorder
+        usb_com.recorder = SessionRecorder(args.record, {"port": usb_com.get_port(), "baud": args.baud,
+                                                         "command": args.command})
+    try:
+        usb_com.connect()
+    except Exception as e:
+        stop_recording(usb_com)
+        raise e
+    return usb_com
+
+
+def stop_recording(usb_com):
+    if usb_com.recorder is not None:
+        usb_com.recorder.stop()
+        usb_com.recorder = None
+
+
+def print_progress(received, rate):
+    sys.stderr.write("\r%.1f kB (%.1f kB/s)" % (received / 1000, rate / 1000))
+    sys.stderr.flush()
+
+
+def cmd_connect(usb_com, args):
+    try:
+        tag_id = usb_com.get_tag_id()
+    except Exception:
+        tag_id = ''
+    print("Connected %s %s" % (usb_com.get_port(), tag_id))
+
+
+def cmd_status(usb_com, args):
+    status, sensor_data = usb_com.get_status()
+    print("memory       %.02f %% (%s)" % (status.memory_percent, FLAG_NAMES.get(status.memory_state, "bad")))
+    print("state        %s (%d)" % (status.state_name, status.state))
+    print("gps          %s" % FLAG_NAMES.get(status.gps, "bad"))
+    print("baro         %s" % FLAG_NAMES.get(status.baro, "bad"))
+    print("gps fix      %s" % ("ok" if status.gps_fix else "no fix"))
+    for field, value in zip(SENSOR_FIELDS, sensor_data):
+        print("%-12s %s" % (field, value))
+
+
+def cmd_download(usb_com, args):
+    if args.text:
+        usb_com.dump_mode = 0
+    if args.fast:
+        from link_tuning import fast_link
+        with fast_link(usb_com, usb_com.read_tag_id()) as baud:
+            if not args.quiet:
+                sys.stderr.write("Link %d Bd\n" % baud)
+            usb_com.log_data(args.file, None if args.quiet else print_progress, args.resumable)
+    else:
+        usb_com.log_data(args.file, None if args.quiet else print_progress, args.resumable)
+    if not args.quiet:
+        sys.stderr.write("\n")
+    if args.columnar:
+        import log_store
+        store_dir = args.store or os.path.dirname(os.path.abspath(args.file))
+        print(log_store.save_log_file(args.file, store_dir, usb_com.read_tag_id(), args.columnar, args.recorded))
+
+
+def cmd_sync(usb_com, args):
+    import sync
+    tag_id = usb_com.read_tag_id()
+    result = sync.sync_device(usb_com, args.archive, tag_id, None if args.quiet else print_progress)
+    if not args.quiet:
+        sys.stderr.write("\n")
+    print("%s %d new bytes, %d archived, %s" % (tag_id, result["new_bytes"], result["offset"], result["file"]))
+    if not result["complete"] or not (args.erase or args.yes):
+        return
+    if not args.yes:
+        if input("All memory of %s archived, erase it? [y/N] " % tag_id).lower() != 'y':
+            return
+    sync.erase_archived(usb_com, args.archive, tag_id)
+    print("Erased")
+
+
+def cmd_erase(usb_com, args):
+    if not args.yes:
+        if input("Erase flash memory of %s? [y/N] " % usb_com.get_port()).lower() != 'y':
+            return
+    usb_com.erase_flash_memory()
+    print("Erased")
+
+
+def hour_minute(args):
+    if args.hour is None:
+        now = time.localtime()
+        return now.tm_hour, now.tm_min
+    return args.hour, args.minute
+
+
+def cmd_set_time(usb_com, args):
+    usb_com.set_time(args.hour, args.minute)
+
+
+def cmd_set_clock(usb_com, args):
+    usb_com.set_clock(*hour_minute(args))
+
+
+def cmd_set_altitude(usb_com, args):
+    usb_com.set_altitude(args.altitude)
+
+
+def cmd_live(usb_com, args):
+    print(",".join(["t"] + SENSOR_FIELDS))
+    start_time = time.monotonic()
+    samples = 0
+    while args.count == 0 or samples < args.count:
+        next_time = start_time + samples / args.rate
+        time.sleep(max(0.0, next_time - time.monotonic()))
+        try:
+            sensor_data = usb_com.get_sensor_data()
+        except Exception as e:
+            sys.stderr.write("%s\n" % e)
+        else:
+            print("%.3f,%s" % (time.monotonic() - start_time, ",".join(sensor_data)), flush=True)
+        samples += 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="bat_tracker", description="Bat GPS tag command line interface")
+    parser.add_argument("-p", "--port", default="0", help="serial port or its number (ttyUSB<n> / COM<n>)")
+    parser.add_argument("-b", "--baud", type=int, default=115200)
+    parser.add_argument("--trace", help="write Chrome trace of device commands to this file")
+    parser.add_argument("--stats", help="write command latency statistics as JSON to this file")
+    parser.add_argument("--record", help="record the session to this file, replay it with -p replay:<file>")
+    parser.add_argument("--replay-speed", type=float, default=1.0,
+                        help="replay speed of a recorded session, 0 = answer at once in recorded order")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("connect", help="check connection and show tag ID").set_defaults(func=cmd_connect)
+    commands.add_parser("status", help="memory, device state and sensor data").set_defaults(func=cmd_status)
+
+    download = commands.add_parser("download", help="download logged data")
+    download.add_argument("file")
+    download.add_argument("--resumable", action="store_true", help="CRC checked, resumable download")
+    download.add_argument("--columnar", choices=["npy", "npz", "hdf5", "parquet"],
+                          help="also store decoded columnar copy and add it to index")
+    download.add_argument("--store", help="columnar store directory, defaults to directory of file")
+    download.add_argument("--recorded", help="day of the first logged fix YYYY-MM-DD, dates the columnar index")
+    download.add_argument("--fast", action="store_true", help="download at the fastest reliable baud rate")
+    download.add_argument("--text", action="store_true", help="do not try binary dump mode")
+    download.add_argument("-q", "--quiet", action="store_true")
+    download.set_defaults(func=cmd_download)
+
+    sync = commands.add_parser("sync", help="append memory not archived yet to archive directory")
+    sync.add_argument("archive")
+    sync.add_argument("--erase", action="store_true", help="offer to erase memory once all of it is archived")
+    sync.add_argument("-y", "--yes", action="store_true", help="erase archived memory without asking")
+    sync.add_argument("-q", "--quiet", action="store_true")
+    sync.set_defaults(func=cmd_sync)
+
+    erase = commands.add_parser("erase", help="erase flash memory")
+    erase.add_argument("-y", "--yes", action="store_true", help="do not ask for confirmation")
+    erase.set_defaults(func=cmd_erase)
+
+    set_time = commands.add_parser("set-time", help="set wake up time")
+    set_time.add_argument("hour", type=int)
+    set_time.add_argument("minute", type=int)
+    set_time.set_defaults(func=cmd_set_time)
+
+    set_clock = commands.add_parser("set-clock", help="set device clock, current local time by default")
+    set_clock.add_argument("hour", type=int, nargs="?")
+    set_clock.add_argument("minute", type=int, nargs="?", default=0)
+    set_clock.set_defaults(func=cmd_set_clock)
+
+    set_altitude = commands.add_parser("set-altitude", help="set altitude trigger")
+    set_altitude.add_argument("altitude", type=int)
+    set_altitude.set_defaults(func=cmd_set_altitude)
+
+    live = commands.add_parser("live", help="print sensor data as CSV")
+    live.add_argument("-r", "--rate", type=float, default=1.0, help="samples per second")
+    live.add_argument("-n", "--count", type=int, default=0, help="number of samples, 0 = until interrupted")
+    live.set_defaults(func=cmd_live)
+
+    harvest = commands.add_parser("harvest", help="parallel download from all attached tags", add_help=False)
+    harvest.add_argument("args", nargs=argparse.REMAINDER)
+    harvest.set_defaults(func=None)
+
+    process = commands.add_parser("process", help="process downloaded logs in parallel, export CSV / GPX",
+                                  add_help=False)
+    process.add_argument("args", nargs=argparse.REMAINDER)
+    process.set_defaults(func=None)
+
+    index = commands.add_parser("index", help="spatiotemporal index of an archive: update, query, files",
+                                add_help=False)
+    index.add_argument("args", nargs=argparse.REMAINDER)
+    index.set_defaults(func=None)
+
+    provision = commands.add_parser("provision", help="set clock, wake time and altitude on all attached tags",
+                                    add_help=False)
+    provision.add_argument("args", nargs=argparse.REMAINDER)
+    provision.set_defaults(func=None)
+
+    session = commands.add_parser("session", help="show recorded session, export its sensor samples",
+                                  add_help=False)
+    session.add_argument("args", nargs=argparse.REMAINDER)
+    session.set_defaults(func=None)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == "harvest":
+        import harvest
+        return harvest.main(args.args)
+    if args.command == "process":
+        import pipeline
+        return pipeline.main(args.args)
+    if args.command == "index":
+        import archive_index
+        return archive_index.main(args.args)
+    if args.command == "provision":
+        import provisioning
+        return provisioning.main(args.args)
+    if args.command == "session":
+        import session
+        return session.main(args.args)
+
+    try:
+        usb_com = open_connection(args)
+    except Exception as e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+
+    try:
+        args.func(usb_com, args)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    finally:
+        try:
+            usb_com.disconnect()
+        except Exception as e:
+            sys.stderr.write("%s\n" % e)
+        stop_recording(usb_com)
+        if args.trace:
+            usb_com.instrumentation.export_trace(args.trace)
+        if args.stats:
+            usb_com.instrumentation.export_summary(args.stats)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from usb import UsbConnection  # noqa: E402
+
+STATUS_COMMANDS = {
+    "STATE_MEMORY": "get_memory_state",
+    "STATE_DEVICE": "get_device_state",
+    "READ_SENSOR_DATA": "get_sensor_data",
+    "READ_TAG_ID": "get_tag_id",
+}
+
+
+''' Simulator runs in its own process, so peak RSS below belongs to the host side only '''
+def start_simulator(args):
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "simulator.py"), "--log-size", str(args.log_size),
+                                "--baud", str(args.baud), "--erase-time", "0", "--drop", str(args.drop),
+                                "--corrupt", str(args.corrupt), "--delay", str(args.delay)],
+                               stdout=subprocess.PIPE, text=True)
+    return process, process.stdout.readline().strip()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def round_trips(usb_com, method, count):
+    times = []
+    errors = 0
+    for i in range(count):
+        start = time.perf_counter()
+        try:
+            getattr(usb_com, method)()
+        except Exception:
+            errors += 1
+            continue
+        times.append(time.perf_counter() - start)
+    if not times:
+        return {"errors": errors}
+    return {"median_ms": statistics.median(times) * 1000, "p95_ms": percentile(times, 95) * 1000, "errors": errors}
+
+
+def download(usb_com, resumable):
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "log.txt")
+        start = time.perf_counter()
+        try:
+            usb_com.log_data(file_name, None, resumable)
+        except Exception as e:
+            return {"error": str(e)}
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(file_name)
+    return {"bytes": size, "seconds": elapsed, "MB_per_s": size / elapsed / 1e6}
+
+
+def run(args):
+    process, port = start_simulator(args)
+    try:
+        usb_com = UsbConnection(port, args.baud or 115200)
+        usb_com.connect()
+
+        result = {"log_size": args.log_size, "baud": args.baud, "rtt": {}}
+        for name, method in STATUS_COMMANDS.items():
+            result["rtt"][name] = round_trips(usb_com, method, args.count)
+        result["rtt"]["get_status (pipelined)"] = round_trips(usb_com, "get_status", args.count)
+
+        usb_com.dump_mode = 0
+        result["log_data"] = download(usb_com, False)
+        usb_com.dump_mode = 2
+        result["log_data_binary"] = download(usb_com, False)
+        result["log_data_resumable"] = download(usb_com, True)
+        result["peak_rss_MB"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+        usb_com.disconnect()
+    finally:
+        process.terminate()
+        process.wait()
+    return result
+
+
+def print_result(result):
+    print("log size %d B, baud %s" % (result["log_size"], result["baud"] or "unpaced"))
+    print("round trip times")
+    for name, rtt in result["rtt"].items():
+        if "median_ms" in rtt:
+            print("  %-24s median %7.2f ms  p95 %7.2f ms  errors %d" % (name, rtt["median_ms"], rtt["p95_ms"],
+                                                                      rtt["errors"]))
+        else:
+            print("  %-24s failed, errors %d" % (name, rtt["errors"]))
+    # MB/s of decoded log, binary mode moves less bytes over the link for the same log
+    for name in ("log_data", "log_data_binary", "log_data_resumable"):
+        download_result = result[name]
+        if "error" in download_result:
+            print("%-20s failed: %s" % (name, download_result["error"]))
+        else:
+            print("%-20s %8.3f MB/s (%d B in %.2f s)" % (name, download_result["MB_per_s"], download_result["bytes"],
+                                                        download_result["seconds"]))
+    print("peak RSS             %8.1f MB" % result["peak_rss_MB"])
+
+
+''' Throughput and latency benchmark of UsbConnection against the firmware simulator '''
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UsbConnection link benchmark against simulator.py")
+    parser.add_argument("--log-size", type=int, default=4 * 1024 * 1024, help="size of logged data [B]")
+    parser.add_argument("--baud", type=int, default=0, help="emulated link speed, 0 = unpaced")
+    parser.add_argument("-n", "--count", type=int, default=200, help="round trips per status command")
+    parser.add_argument("--drop", type=float, default=0.0, help="probability of dropped response")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="probability of corrupted response")
+    parser.add_argument("--delay", type=float, default=0.0, help="extra response latency [s]")
+    parser.add_argument("--json", action="store_true", help="print result as JSON")
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print_result(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+UI_SCRIPT = r'''
+import json, sys, time
+start = time.perf_counter()
+from PyQt5 import QtWidgets
+app = QtWidgets.QApplication(sys.argv)
+qt_ready = time.perf_counter()
+import main
+imported = time.perf_counter()
+window = main.MainWindow()
+window.show()
+app.processEvents()
+shown = time.perf_counter()
+print(json.dumps({"qt": qt_ready - start, "import_main": imported - qt_ready,
+                  "window": shown - imported, "total": shown - start}))
+'''
+
+
+def run_ui(env):
+    output = subprocess.run([sys.executable, "-c", UI_SCRIPT], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_cli(env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "bat_tracker.py", "--help"], cwd=ROOT, env=env, check=True,
+                   capture_output=True)
+    return {"cli": time.perf_counter() - start}
+
+
+''' Cold start benchmark, every run is a fresh interpreter. Reports median of each phase in ms '''
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UI and CLI startup benchmark")
+    parser.add_argument("-n", "--runs", type=int, default=10)
+    parser.add_argument("--platform", default="offscreen", help="QT_QPA_PLATFORM, empty for default")
+    parser.add_argument("--json", action="store_true", help="print result as JSON")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    if args.platform:
+        env["QT_QPA_PLATFORM"] = args.platform
+
+    runs = [dict(run_ui(env), **run_cli(env)) for i in range(args.runs)]
+    result = {phase: statistics.median(run[phase] for run in runs) * 1000 for phase in runs[0]}
+
+    if args.json:
+        print(json.dumps(result))
+    else:
+        for phase, ms in result.items():
+            print("%-12s %8.1f ms" % (phase, ms))
+
+
+if __name__ == '__main__':
+    main()
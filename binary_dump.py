@@ -0,0 +1,197 @@
+import re
+import struct
+import zlib
+
+''' Binary memory dump format of READ_MEMORY_BINARY. Device answers $BIN<mode># and sends frames
+    <length:u16><crc32:u32><payload>, little endian, zero length ends the dump. Payload is a
+    sequence of entries, each starting with its type:
+      RECORD - mode 1, log line packed to fixed point integers (RECORD_STRUCT)
+      RAW    - u16 length and bytes of a line that does not pack exactly, e.g. a partial line
+      DELTA  - mode 2, zigzag varint differences of all fields to the previous record
+      REPEAT - mode 2, varint count of records repeating the previous DELTA, stationary tag
+    Delta state starts from zero in every frame, so frames decode independently.
+    Decoded lines are byte for byte the text READ_MEMORY would have sent '''
+
+MODE_PACKED = 1
+MODE_DELTA = 2
+
+RECORD = 1
+RAW = 2
+DELTA = 3
+REPEAT = 4
+
+# baro_alt [cm], gps_long [1e-6 deg], gps_lat [1e-6 deg], gps_alt [dm], gps_time, gps_fix_time, gps_time_time
+RECORD_STRUCT = struct.Struct('<iiiiIHI')
+FRAME_HEADER = struct.Struct('<HI')
+MAX_FRAME = 4096
+ZERO = (0, 0, 0, 0, 0, 0, 0)
+
+LINE_PATTERN = re.compile(rb'(-?\d+),(-?\d+\.\d{6}),(-?\d+\.\d{6}),(-?\d+\.\d),(\d{6}),(\d+),(\d{6})\n')
+
+
+def fixed(value, decimals):
+    scale = 10 ** decimals
+    sign = '-' if value < 0 else ''
+    value = abs(value)
+    return '%s%d.%0*d' % (sign, value // scale, decimals, value % scale)
+
+
+def format_record(values):
+    baro_alt, gps_long, gps_lat, gps_alt, gps_time, gps_fix_time, gps_time_time = values
+    return ('%d,%s,%s,%s,%06d,%d,%06d\n' % (baro_alt, fixed(gps_long, 6), fixed(gps_lat, 6), fixed(gps_alt, 1),
+                                            gps_time, gps_fix_time, gps_time_time)).encode('ascii')
+
+
+''' Fixed point values of a log line, None when the line would not be reproduced exactly '''
+def pack_line(line):
+    match = LINE_PATTERN.fullmatch(line)
+    if match is None:
+        return None
+    values = tuple(int(field.replace(b'.', b'')) for field in match.groups())
+    try:
+        RECORD_STRUCT.pack(*values)
+    except struct.error:
+        return None
+    if format_record(values) != line:
+        return None
+    return values
+
+
+def zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def write_varint(out, value):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, index):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[index]
+        index += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, index
+        shift += 7
+
+
+def frame(payload):
+    return FRAME_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class PayloadEncoder:
+    ''' Builds payload of one frame, add() returns False when the line does not fit into limit '''
+    def __init__(self, mode):
+        self.mode = mode
+        self.payload = bytearray()
+        self.previous = ZERO
+        self.delta = None
+        self.repeats = 0
+
+    def add(self, line, limit=None):
+        values = pack_line(line) if len(line) < 0x10000 else None
+        entry = bytearray()
+        if values is None:
+            entry.append(RAW)
+            entry += struct.pack('<H', len(line)) + line
+        elif self.mode == MODE_PACKED:
+            entry.append(RECORD)
+            entry += RECORD_STRUCT.pack(*values)
+        else:
+            delta = tuple(v - p for v, p in zip(values, self.previous))
+            if delta == self.delta:
+                entry = None
+            else:
+                entry.append(DELTA)
+                for d in delta:
+                    write_varint(entry, zigzag(d))
+
+        # room for pending REPEAT entry is kept as well
+        if limit is not None and len(self.payload) + len(entry or b'') + 12 > limit:
+            return False
+
+        if entry is None:
+            self.repeats += 1
+        else:
+            self.flush_repeats()
+            self.payload += entry
+            self.delta = delta if values is not None and self.mode == MODE_DELTA else None
+        self.previous = values if values is not None else ZERO
+        return True
+
+    def flush_repeats(self):
+        if self.repeats:
+            self.payload.append(REPEAT)
+            write_varint(self.payload, self.repeats)
+            self.repeats = 0
+
+    def finish(self):
+        self.flush_repeats()
+        return bytes(self.payload)
+
+
+''' Reference encoder, the simulator uses it in place of firmware. Returns all frames and the end frame '''
+def encode(memory, mode=MODE_DELTA, max_frame=MAX_FRAME):
+    frames = []
+    encoder = PayloadEncoder(mode)
+    # frame and RAW entry lengths are u16, lines longer than fits a frame are sent in RAW pieces
+    max_frame = min(max_frame, FRAME_HEADER.size + 0xffff)
+    piece_size = max_frame - FRAME_HEADER.size - 3
+    for line in memory.splitlines(keepends=True):
+        for start in range(0, len(line), piece_size):
+            piece = line[start:start + piece_size]
+            if not encoder.add(piece, max_frame - FRAME_HEADER.size):
+                if encoder.payload:
+                    frames.append(frame(encoder.finish()))
+                    encoder = PayloadEncoder(mode)
+                encoder.add(piece)
+    if encoder.payload or encoder.repeats:
+        frames.append(frame(encoder.finish()))
+    frames.append(frame(b''))
+    return b''.join(frames)
+
+
+''' Decodes payload of one frame back to log text '''
+def decode_payload(payload):
+    out = []
+    index = 0
+    previous = ZERO
+    delta = None
+    while index < len(payload):
+        kind = payload[index]
+        index += 1
+        if kind == RECORD:
+            out.append(format_record(RECORD_STRUCT.unpack_from(payload, index)))
+            index += RECORD_STRUCT.size
+        elif kind == RAW:
+            length, = struct.unpack_from('<H', payload, index)
+            out.append(payload[index + 2:index + 2 + length])
+            index += 2 + length
+            previous = ZERO
+            delta = None
+        elif kind == DELTA:
+            delta = []
+            for i in range(7):
+                value, index = read_varint(payload, index)
+                delta.append(unzigzag(value))
+            previous = tuple(p + d for p, d in zip(previous, delta))
+            out.append(format_record(previous))
+        elif kind == REPEAT:
+            count, index = read_varint(payload, index)
+            if delta is None:
+                raise Exception("Invalid binary frame received!")
+            for i in range(count):
+                previous = tuple(p + d for p, d in zip(previous, delta))
+                out.append(format_record(previous))
+        else:
+            raise Exception("Invalid binary frame received!")
+    return b''.join(out)
@@ -0,0 +1,20 @@
+import glob
+import os
+
+from PyQt5 import uic
+
+''' Compiles Qt Designer .ui files to Python modules (ui_<name>.py), so the UI is not parsed
+    from XML on every start. Run after every change of a .ui file '''
+
+
+def build(directory="."):
+    for ui_file in sorted(glob.glob(os.path.join(directory, "*.ui"))):
+        name = os.path.splitext(os.path.basename(ui_file))[0]
+        py_file = os.path.join(directory, "ui_%s.py" % name)
+        with open(py_file, 'w') as f:
+            uic.compileUi(ui_file, f)
+        print("%s -> %s" % (ui_file, py_file))
+
+
+if __name__ == '__main__':
+    build(os.path.dirname(os.path.abspath(__file__)))
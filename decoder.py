@@ -0,0 +1,96 @@
+import numpy as np
+
+# one log record per line, fields in the same order as READ_SENSOR_DATA response
+LOG_FIELDS = ["baro_alt", "gps_long", "gps_lat", "gps_alt", "gps_time", "gps_fix_time", "gps_time_time"]
+
+LOG_DTYPE = np.dtype([
+    ("baro_alt", np.int32),         # barometric altitude [cm]
+    ("gps_long", np.float64),
+    ("gps_lat", np.float64),
+    ("gps_alt", np.float32),
+    ("gps_time", np.float64),       # hhmmss[.ss]
+    ("gps_fix_time", np.float32),
+    ("gps_time_time", np.float64),
+])
+
+COMMA = ord(',')
+NEWLINE = ord('\n')
+
+
+def decode_file(file_name):
+    with open(file_name, 'rb') as f:
+        return decode_bytes(f.read())
+
+
+''' Decodes text log into structured array with LOG_DTYPE columns. Lines with wrong number of
+    fields are skipped. Whole log is parsed at once by NumPy, not line by line '''
+def decode_bytes(data):
+    data = data.replace(b'\r', b'')
+    if not data.endswith(b'\n'):
+        data += b'\n'
+
+    raw = np.frombuffer(data, dtype=np.uint8)
+    line_ends = np.flatnonzero(raw == NEWLINE)
+    line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+
+    commas_per_line = np.add.reduceat(raw == COMMA, line_starts, dtype=np.int32)
+    valid = (commas_per_line == len(LOG_FIELDS) - 1) & (line_ends > line_starts)
+
+    if not valid.all():
+        # keep bytes of valid lines only
+        keep = np.repeat(valid, line_ends - line_starts + 1)
+        data = raw[keep].tobytes()
+
+    records = np.zeros(int(valid.sum()), dtype=LOG_DTYPE)
+    if not len(records):
+        return records
+
+    values = parse_values(data)
+    if values is None or len(values) != len(records) * len(LOG_FIELDS):
+        values = parse_values_slow(data)
+
+    values = values.reshape(-1, len(LOG_FIELDS))
+    for column, field in enumerate(LOG_FIELDS):
+        if np.issubdtype(LOG_DTYPE[field], np.integer):
+            records[field] = np.nan_to_num(values[:, column])
+        else:
+            records[field] = values[:, column]
+    return records
+
+
+def parse_values(data):
+    # empty fields become NaN
+    data = data.replace(b'\n', b',').replace(b',,', b',nan,').replace(b',,', b',nan,')
+    if data.startswith(b','):
+        data = b'nan' + data
+    try:
+        return np.fromstring(data, dtype=np.float64, sep=',')
+    except ValueError:
+        return None
+
+
+def parse_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+''' Fallback for logs with garbage inside fields, unparsable values become NaN '''
+def parse_values_slow(data):
+    values = [parse_float(value) for line in data.split(b'\n') if line for value in line.split(b',')]
+    return np.array(values, dtype=np.float64)
+
+
+''' Seconds of day from hhmmss[.ss] GPS time '''
+def time_of_day(gps_time):
+    gps_time = np.asarray(gps_time, dtype=np.float64)
+    hours = np.floor(gps_time / 10000)
+    minutes = np.floor(gps_time / 100) % 100
+    seconds = gps_time % 100
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def to_arrow(records):
+    import pyarrow as pa
+    return pa.table({field: records[field] for field in records.dtype.names})
@@ -0,0 +1,157 @@
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sys import platform
+
+from usb import UsbConnection, file_tag_id
+
+
+def list_serial_ports():
+    if platform == "linux":
+        return sorted(glob.glob('/dev/ttyUSB*'))
+
+    from serial.tools import list_ports
+    return sorted(port.device for port in list_ports.comports())
+
+
+def probe_device(port, baud_rate):
+    usb_com = UsbConnection(port, baud_rate)
+    try:
+        usb_com.connect()
+    except Exception:
+        return False
+    else:
+        usb_com.ser.close()
+        return True
+
+
+''' Finds ports with attached tag, every port is probed with $01#/$BAT_GPS# handshake in parallel '''
+def discover_devices(baud_rate, ports=None, exclude=()):
+    if ports is None:
+        ports = list_serial_ports()
+    ports = [port for port in ports if port not in exclude]
+    if not ports:
+        return []
+
+    with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+        answered = list(pool.map(lambda port: probe_device(port, baud_rate), ports))
+    return [port for port, ok in zip(ports, answered) if ok]
+
+
+''' <tag>_<yyyymmdd>_<hhmmss>.txt, so that no harvest overwrites an earlier one. Resumable download
+    continues in the file of an interrupted download of the tag '''
+def log_file_name(out_dir, tag_id, resumable=False):
+    tag_id = file_tag_id(tag_id)
+    if resumable:
+        partial = sorted(glob.glob(os.path.join(glob.escape(out_dir), glob.escape(tag_id) + "_*.txt.part")))
+        if partial:
+            return partial[-1][:-len('.part')]
+    return os.path.join(out_dir, "%s_%s.txt" % (tag_id, time.strftime('%Y%m%d_%H%M%S')))
+
+
+''' Downloads log from one tag. Status dicts are reported through status_callback as
+    the device moves through connecting -> downloading -> erasing -> done / failed '''
+def harvest_device(port, baud_rate, out_dir, erase=False, resumable=False, status_callback=None, columnar=None,
+                   fast=False, recorded=None):
+    status = {"port": port, "tag_id": "", "state": "connecting", "file": "",
+              "bytes": 0, "rate": 0.0, "seconds": 0.0, "error": ""}
+
+    def report(**kwargs):
+        status.update(kwargs)
+        if status_callback is not None:
+            status_callback(dict(status))
+
+    def progress(received, rate):
+        report(bytes=received, rate=rate)
+
+    start_time = time.monotonic()
+    usb_com = UsbConnection(port, baud_rate)
+    try:
+        report()
+        usb_com.connect()
+
+        tag_id = usb_com.read_tag_id()
+        file_name = log_file_name(out_dir, tag_id, resumable)
+        report(tag_id=tag_id, file=file_name, state="downloading")
+        if fast:
+            from link_tuning import fast_link
+            with fast_link(usb_com, tag_id):
+                usb_com.log_data(file_name, progress, resumable)
+        else:
+            usb_com.log_data(file_name, progress, resumable)
+        if columnar:
+            import log_store
+            log_store.save_log_file(file_name, out_dir, tag_id, columnar, recorded)
+
+        if erase:
+            report(state="erasing")
+            usb_com.erase_flash_memory()
+
+        usb_com.disconnect()
+    except Exception as e:
+        if usb_com.is_open():
+            usb_com.ser.close()
+        report(state="failed", error=str(e), seconds=time.monotonic() - start_time)
+    else:
+        report(state="done", seconds=time.monotonic() - start_time)
+
+    return status
+
+
+''' Downloads logs from all tags in parallel, one UsbConnection per port '''
+def harvest(ports, baud_rate, out_dir, erase=False, resumable=False, workers=0, status_callback=None,
+            columnar=None, fast=False, recorded=None):
+    if not ports:
+        return []
+    os.makedirs(out_dir, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=workers or len(ports)) as pool:
+        futures = [pool.submit(harvest_device, port, baud_rate, out_dir, erase, resumable, status_callback, columnar,
+                               fast, recorded) for port in ports]
+        return [future.result() for future in futures]
+
+
+def print_status(status):
+    if status["state"] == "downloading":
+        return
+    line = "%-14s %-16s %-11s" % (status["port"], status["tag_id"], status["state"])
+    if status["state"] == "done":
+        line += " %10d B %8.1f kB/s %s" % (status["bytes"], status["rate"] / 1000, status["file"])
+    elif status["state"] == "failed":
+        line += " " + status["error"]
+    print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download logs from all attached bat GPS tags in parallel")
+    parser.add_argument("ports", nargs="*", help="serial ports, attached tags are discovered when omitted")
+    parser.add_argument("-o", "--out-dir", default=".", help="directory for downloaded logs")
+    parser.add_argument("-b", "--baud", type=int, default=115200)
+    parser.add_argument("-w", "--workers", type=int, default=0, help="parallel downloads, 0 = one per port")
+    parser.add_argument("--erase", action="store_true", help="erase flash memory after successful download")
+    parser.add_argument("--resumable", action="store_true", help="CRC checked, resumable download")
+    parser.add_argument("--columnar", choices=["npy", "npz", "hdf5", "parquet"],
+                        help="also store decoded columnar copy and add it to index")
+    parser.add_argument("--fast", action="store_true", help="download at the fastest reliable baud rate")
+    parser.add_argument("--recorded", help="day of the first logged fix YYYY-MM-DD, dates the columnar index")
+    args = parser.parse_args(argv)
+
+    ports = discover_devices(args.baud, args.ports or None)
+    if not ports:
+        print("No device found!")
+        return 1
+    print("Found %d device(s): %s" % (len(ports), ", ".join(ports)))
+
+    start_time = time.monotonic()
+    results = harvest(ports, args.baud, args.out_dir, args.erase, args.resumable, args.workers, print_status,
+                      args.columnar, args.fast, args.recorded)
+    failed = [status for status in results if status["state"] != "done"]
+    print("Harvested %d/%d device(s) in %.1f s" % (len(results) - len(failed), len(results),
+                                                 time.monotonic() - start_time))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
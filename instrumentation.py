@@ -0,0 +1,125 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+''' Protocol instrumentation - latency histograms per command, byte counters, timeouts, retries
+    and lock waits. Everything is skipped while disabled, callers check .enabled first, so the
+    only cost on the hot path is one attribute lookup '''
+
+# histogram buckets [s], powers of two from ~0.1 ms to ~500 s
+BUCKET_BOUNDS = [2.0 ** exponent for exponent in range(-13, 10)]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        index = 0 if value <= 0 else min(len(BUCKET_BOUNDS), max(0, math.ceil(math.log2(value)) + 13))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    ''' Upper bound of the bucket containing given percentile, capped by maximum '''
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        limit = p / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= limit and count:
+                return min(BUCKET_BOUNDS[index], self.max) if index < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "mean": self.total / self.count if self.count else 0.0,
+                "p50": self.percentile(50), "p95": self.percentile(95), "max": self.max,
+                "buckets": {"%.6g" % bound: count for bound, count in zip(BUCKET_BOUNDS + [math.inf], self.counts)
+                            if count}}
+
+
+class Instrumentation:
+    def __init__(self, enabled=False, max_events=100000):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.max_events = max_events
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.latency = {}
+            self.waits = {}
+            self.counters = {}
+            self.events = deque(maxlen=self.max_events)
+
+    def add_bytes_in(self, count):
+        with self.lock:
+            self.bytes_in += count
+
+    def add_bytes_out(self, count):
+        with self.lock:
+            self.bytes_out += count
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def event(self, name, category, start, end, args=None):
+        self.events.append({"name": name, "cat": category, "ph": "X", "pid": os.getpid(),
+                            "tid": threading.get_ident(), "ts": (start - self.start_time) * 1e6,
+                            "dur": (end - start) * 1e6, "args": args or {}})
+
+    @contextmanager
+    def command(self, name):
+        start = time.perf_counter()
+        bytes_in, bytes_out = self.bytes_in, self.bytes_out
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.latency.setdefault(name, Histogram()).add(end - start)
+                if error is not None:
+                    key = "timeout" if "not responding" in error else "error"
+                    self.counters["%s:%s" % (key, name)] = self.counters.get("%s:%s" % (key, name), 0) + 1
+                self.event(name, "command", start, end, {"bytes_in": self.bytes_in - bytes_in,
+                                                         "bytes_out": self.bytes_out - bytes_out,
+                                                         "error": error})
+
+    def record_wait(self, name, start, end):
+        with self.lock:
+            self.waits.setdefault(name, Histogram()).add(end - start)
+            self.event(name, "wait", start, end)
+
+    def summary(self):
+        with self.lock:
+            return {"bytes_in": self.bytes_in, "bytes_out": self.bytes_out, "counters": dict(self.counters),
+                    "latency": {name: histogram.summary() for name, histogram in self.latency.items()},
+                    "waits": {name: histogram.summary() for name, histogram in self.waits.items()}}
+
+    def export_summary(self, file_name):
+        with open(file_name, 'w') as f:
+            json.dump(self.summary(), f, indent=1)
+
+    ''' Trace in Chrome trace event format, open in chrome://tracing or Perfetto '''
+    def export_trace(self, file_name):
+        with self.lock:
+            events = list(self.events)
+        with open(file_name, 'w') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
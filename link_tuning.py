@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+''' Link speed tuning for bulk transfers. Higher rates are probed one by one with SET_BAUD,
+    each verified with the $01# handshake and CRC checked test blocks. The fastest working
+    rate is cached per tag, so the next connection switches straight to it. The same cache
+    keeps whether firmware of the tag has binary dump mode '''
+
+CANDIDATE_RATES = [230400, 460800, 921600, 1000000, 2000000]
+CACHE_FILE = os.path.join(os.path.expanduser("~"), ".bat_tracker", "link.json")
+# tag without binary dump mode is probed again after this time [s], firmware may have been updated
+BINARY_DUMP_RECHECK = 7 * 86400
+
+cache_lock = threading.Lock()
+
+
+def read_cache(cache_file=CACHE_FILE):
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+''' Sets fields of the cache entry of tag_id, None value removes the field '''
+def update_entry(tag_id, cache_file=CACHE_FILE, **fields):
+    with cache_lock:
+        entries = read_cache(cache_file)
+        entry = entries.get(tag_id, {})
+        for key, value in fields.items():
+            if value is None:
+                entry.pop(key, None)
+            else:
+                entry[key] = value
+        if entry:
+            entries[tag_id] = entry
+        else:
+            entries.pop(tag_id, None)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_path = cache_file + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f, indent=1)
+        os.replace(tmp_path, cache_file)
+
+
+def update_cache(tag_id, baud, cache_file=CACHE_FILE):
+    update_entry(tag_id, cache_file, baud=baud, time=time.strftime('%Y-%m-%d %H:%M:%S') if baud else None)
+
+
+''' True / False when binary dump mode of the tag is known, None when it has to be probed '''
+def cached_binary_dump(tag_id, cache_file=CACHE_FILE):
+    entry = read_cache(cache_file).get(tag_id, {})
+    if "binary_dump" not in entry:
+        return None
+    if not entry["binary_dump"] and time.time() - entry.get("binary_dump_time", 0) > BINARY_DUMP_RECHECK:
+        return None
+    return entry["binary_dump"]
+
+
+def update_binary_dump(tag_id, supported, cache_file=CACHE_FILE):
+    update_entry(tag_id, cache_file, binary_dump=supported, binary_dump_time=time.time())
+
+
+''' Switches connection to the fastest reliable rate and returns it. Cached rate is tried
+    first, rates are then probed from the slowest and probing stops at the first failure '''
+def tune_link(usb_com, tag_id, rates=CANDIDATE_RATES, cache_file=CACHE_FILE):
+    base = usb_com.get_baud_rate()
+    cached = read_cache(cache_file).get(tag_id, {})
+    if "baud" in cached:
+        if cached["baud"] == base or usb_com.change_baud_rate(cached["baud"]):
+            return cached["baud"]
+        update_cache(tag_id, None, cache_file)
+
+    best = base
+    for baud in sorted(rate for rate in rates if rate > base):
+        if not usb_com.change_baud_rate(baud):
+            break
+        best = baud
+    update_cache(tag_id, best, cache_file)
+    return best
+
+
+''' Runs the block at the tuned rate and switches back to the previous rate afterwards '''
+@contextmanager
+def fast_link(usb_com, tag_id, rates=CANDIDATE_RATES, cache_file=CACHE_FILE):
+    base = usb_com.get_baud_rate()
+    baud = tune_link(usb_com, tag_id, rates, cache_file)
+    try:
+        yield baud
+    finally:
+        if usb_com.is_open() and usb_com.get_baud_rate() != base:
+            try:
+                usb_com.change_baud_rate(base)
+            except Exception as e:
+                print(e)
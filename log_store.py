@@ -0,0 +1,189 @@
+import datetime
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from decoder import LOG_DTYPE, decode_file, time_of_day
+from usb import file_tag_id
+
+INDEX_NAME = "index.json"
+FORMATS = {"npy": ".npy", "npz": ".npz", "hdf5": ".h5", "parquet": ".parquet"}
+DAY = 86400.0
+
+index_lock = threading.Lock()
+
+
+''' Mask of records with a usable GPS fix '''
+def valid_fixes(records):
+    long = records["gps_long"]
+    lat = records["gps_lat"]
+    return np.isfinite(long) & np.isfinite(lat) & ~((long == 0) & (lat == 0))
+
+
+''' Index entry of records. Log has GPS time of day only, time_of_day is [min, max] hhmmss of the
+    fixes. recorded is [first, last] day YYYY-MM-DD of the fixes, counted from the day of the
+    first fix when it is known, None otherwise '''
+def summary(records, recorded=None):
+    fixes = records[valid_fixes(records)]
+    entry = {"count": int(len(records)), "fixes": int(len(fixes)), "time_of_day": None, "recorded": None,
+             "bbox": None}
+    if len(fixes):
+        entry["time_of_day"] = [float(fixes["gps_time"].min()), float(fixes["gps_time"].max())]
+        entry["bbox"] = [float(fixes["gps_long"].min()), float(fixes["gps_lat"].min()),
+                         float(fixes["gps_long"].max()), float(fixes["gps_lat"].max())]
+        if recorded is not None:
+            t = time_of_day(fixes["gps_time"])
+            # time of day going back by more than half a day is the next day
+            days = int(np.count_nonzero(t[1:] < t[:-1] - DAY / 2))
+            first = datetime.date.fromisoformat(recorded)
+            entry["recorded"] = [first.isoformat(), (first + datetime.timedelta(days=days)).isoformat()]
+    return entry
+
+
+''' Stores decoded log in columnar format and adds it to the store index.
+    npy    - memory mapped on load, fastest
+    npz    - compressed columns, smallest without extra packages
+    hdf5   - compressed, needs h5py
+    parquet - compressed, needs pyarrow
+    recorded is the day of the first fix YYYY-MM-DD when known, the log itself has no dates '''
+def save(records, store_dir, tag_id, fmt="npy", recorded=None):
+    os.makedirs(store_dir, exist_ok=True)
+    downloaded = time.strftime('%Y-%m-%d')
+    name = "%s_%s_%s%s" % (file_tag_id(tag_id), downloaded, time.strftime('%H%M%S'), FORMATS[fmt])
+    path = os.path.join(store_dir, name)
+
+    if fmt == "npy":
+        np.save(path, records)
+    elif fmt == "npz":
+        arrays = {}
+        for field in records.dtype.names:
+            arrays.update(encode_column(field, records[field]))
+        np.savez_compressed(path, **arrays)
+    elif fmt == "hdf5":
+        import h5py
+        with h5py.File(path, 'w') as f:
+            f.create_dataset("records", data=records, compression="gzip", shuffle=True)
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq
+        from decoder import to_arrow
+        pq.write_table(to_arrow(records), path)
+
+    entry = summary(records, recorded)
+    entry.update({"file": name, "tag_id": tag_id, "downloaded": downloaded, "format": fmt})
+    update_index(store_dir, entry)
+    return path
+
+
+def save_log_file(file_name, store_dir, tag_id, fmt="npy", recorded=None):
+    return save(decode_file(file_name), store_dir, tag_id, fmt, recorded)
+
+
+''' Columns are stored as deltas of fixed point integers when no precision is lost,
+    slowly changing positions and times then compress several times better '''
+def encode_column(field, column):
+    arrays = {}
+    if np.issubdtype(column.dtype, np.floating):
+        nan = np.isnan(column)
+        if nan.any():
+            arrays[field + "__nan"] = np.packbits(nan)
+            column = np.where(nan, 0, column).astype(column.dtype)
+        for decimals in range(8):
+            scaled = np.round(column.astype(np.float64) * 10 ** decimals)
+            if np.array_equal((scaled / 10 ** decimals).astype(column.dtype), column):
+                arrays[field + "__decimals"] = np.array(decimals)
+                column = scaled.astype(np.int64)
+                break
+
+    if np.issubdtype(column.dtype, np.integer):
+        column = np.diff(column, prepend=column.dtype.type(0))
+    arrays[field] = column
+    return arrays
+
+
+def decode_column(field, columns, dtype):
+    column = columns[field]
+    if np.issubdtype(column.dtype, np.integer):
+        column = np.cumsum(column, dtype=column.dtype)
+    if field + "__decimals" in columns:
+        column = column / 10 ** int(columns[field + "__decimals"])
+    column = column.astype(dtype)
+    if field + "__nan" in columns:
+        nan = np.unpackbits(columns[field + "__nan"], count=len(column)).astype(bool)
+        column[nan] = np.nan
+    return column
+
+
+''' Loads stored log as structured array, npy files are memory mapped '''
+def load(path, mmap=True):
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode='r' if mmap else None)
+    if path.endswith(".npz"):
+        with np.load(path) as columns:
+            records = np.empty(len(columns[LOG_DTYPE.names[0]]), dtype=LOG_DTYPE)
+            for field in LOG_DTYPE.names:
+                records[field] = decode_column(field, columns, LOG_DTYPE[field])
+            return records
+    if path.endswith(".h5"):
+        import h5py
+        with h5py.File(path, 'r') as f:
+            return f["records"][:]
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+        records = np.empty(table.num_rows, dtype=LOG_DTYPE)
+        for field in LOG_DTYPE.names:
+            records[field] = table.column(field).to_numpy()
+        return records
+    raise Exception("Unknown log store format!")
+
+
+def read_index(store_dir):
+    path = os.path.join(store_dir, INDEX_NAME)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        entries = json.load(f)
+    for entry in entries:
+        # entries written before recorded dates, date was the download date
+        if "date" in entry:
+            entry["downloaded"] = entry.pop("date")
+            entry["time_of_day"] = entry.pop("time_range", None)
+            entry.setdefault("recorded", None)
+    return entries
+
+
+def update_index(store_dir, entry):
+    with index_lock:
+        entries = [e for e in read_index(store_dir) if e["file"] != entry["file"]]
+        entries.append(entry)
+        tmp_path = os.path.join(store_dir, INDEX_NAME + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f, indent=1)
+        os.replace(tmp_path, os.path.join(store_dir, INDEX_NAME))
+
+
+def overlaps(bbox, area):
+    return bbox[0] <= area[2] and bbox[2] >= area[0] and bbox[1] <= area[3] and bbox[3] >= area[1]
+
+
+''' Index entries matching all given filters, log files themselves are not opened.
+    Dates are YYYY-MM-DD strings matched against recorded days, logs saved without a recording
+    day do not match any date filter. Area is (min_long, min_lat, max_long, max_lat) '''
+def query(store_dir, tag_id=None, date_from=None, date_to=None, area=None):
+    result = []
+    for entry in read_index(store_dir):
+        if tag_id is not None and entry["tag_id"] != tag_id:
+            continue
+        if (date_from is not None or date_to is not None) and entry["recorded"] is None:
+            continue
+        if date_from is not None and entry["recorded"][1] < date_from:
+            continue
+        if date_to is not None and entry["recorded"][0] > date_to:
+            continue
+        if area is not None and (entry["bbox"] is None or not overlaps(entry["bbox"], area)):
+            continue
+        result.append(entry)
+    return result
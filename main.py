@@ -1,40 +1,44 @@
-from PyQt5.QtWidgets import *
-from PyQt5.QtCore import *
-from PyQt5.QtGui import *
-from PyQt5 import QtCore, QtGui, QtWidgets, uic
-from PyQt5.Qt import QMutex
-
-import time
-import traceback
+from PyQt5.QtWidgets import QFileDialog, QInputDialog, QMessageBox
+from PyQt5.QtCore import QObject, Qt, QTimer, pyqtSignal
+from PyQt5.QtGui import QColor, QPalette, QPixmap
+from PyQt5 import QtGui, QtWidgets
+
+import os
 import sys
+import threading
 from sys import platform
-from enum import Enum
 
-from usb import UsbConnection
+from scheduler import PRIORITY_BULK, PRIORITY_STATUS, PRIORITY_USER, DeviceScheduler
+from status_cache import StatusCache
+from usb import REPLAY_PREFIX, UsbConnection
 
 qt_creator_file = "mainwindow_bat_gps.ui"
-Ui_MainWindow, QtBaseClass = uic.loadUiType(qt_creator_file)
 
 
-class Worker(QRunnable):
-    def __init__(self, fn, *args, **kwargs):
-        super(Worker, self).__init__()
-        # print("Worker created")
+def load_ui_class():
+    # module precompiled by build_ui.py, .ui XML is parsed at runtime only when it is missing or stale
+    try:
+        if os.path.getmtime("ui_mainwindow_bat_gps.py") >= os.path.getmtime(qt_creator_file):
+            from ui_mainwindow_bat_gps import Ui_MainWindow
+            return Ui_MainWindow
+    except (OSError, ImportError):
+        pass
+    from PyQt5 import uic
+    return uic.loadUiType(qt_creator_file)[0]
 
-        self.fn = fn
-        self.args = args
-        self.kwargs = kwargs
-        self.is_done = False
 
-    def __del__(self):
-        return
+Ui_MainWindow = load_ui_class()
+
 
-    @pyqtSlot()
-    def run(self):
-        self.fn(*self.args, **self.kwargs)
+class DeviceSignals(QObject):
+    # future, result callback, error callback - delivered on the UI thread
+    done = pyqtSignal(object, object, object)
 
-    def done(self):
-        return self.is_done
+
+class DownloadSignals(QObject):
+    progress = pyqtSignal(int, float)
+    finished = pyqtSignal(int, str)
+    error = pyqtSignal(str)
 
 
 class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
@@ -48,23 +52,30 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.usb_com = UsbConnection()
         self.device_connected = False
 
-        # thread pool
-        self.thread_pool = QThreadPool()
-        # self.live_data_worker = Worker(self.read_live_data)
-        # self.live_data_worker.setAutoDelete(False)
-
-        # mutex
-        self.mutex = QMutex()
-
-        # icons
-        self.pixmapBad = QPixmap('icons/cross.png')
-        self.pixmapGood = QPixmap('icons/tick.png')
-        self.pixmapUnknown = QPixmap('icons/question.png')
-        self.pixmapUpdate = QPixmap('icons/arrow-circle.png')
-        self.pixmapFileBrowse = QPixmap('icons/folder-horizontal-open.png')
-
-        self.updateStatePushButton.setIcon(QtGui.QIcon(self.pixmapUpdate))
-        self.fileBrowserPushButton.setIcon(QtGui.QIcon(self.pixmapFileBrowse))
+        # all device calls run on the scheduler thread, results come back through signals
+        self.scheduler = DeviceScheduler("usb", self.usb_com.instrumentation)
+        self.device_signals = DeviceSignals()
+        self.device_signals.done.connect(self.device_call_done)
+
+        # device status - polls inside ttl are answered from cache, widgets change only with status
+        self.status_cache = StatusCache(self.usb_com.get_device_status, ttl=1.0, submit=lambda fn: self.scheduler.submit(
+            fn, priority=PRIORITY_STATUS, key="DEVICE_STATUS"))
+        self.shown_status = None
+        self.archive_dir = None
+        self.status_timer = QTimer(self)
+        self.status_timer.timeout.connect(self.poll_status)
+
+        # log download - runs in thread pool, reports back through signals
+        self.download_signals = DownloadSignals()
+        self.download_signals.progress.connect(self.download_progress)
+        self.download_signals.finished.connect(self.download_finished)
+        self.download_signals.error.connect(self.download_failed)
+        self.process_signals = None
+
+        # icons - state pixmaps are loaded on first use, QIcon loads its file when painted
+        self.pixmaps = {}
+        self.updateStatePushButton.setIcon(QtGui.QIcon('icons/arrow-circle.png'))
+        self.fileBrowserPushButton.setIcon(QtGui.QIcon('icons/folder-horizontal-open.png'))
         self.setWindowIcon(QtGui.QIcon('icons/bat2.png'))
 
         # dialog
@@ -81,6 +92,37 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.setAltPushButton.pressed.connect(self.set_altitude)
         self.updateStatePushButton.pressed.connect(self.update_state_info)
 
+        # Tools menu
+        self.toolsMenu = self.menubar.addMenu("Tools")
+        self.batchHarvestAction = self.toolsMenu.addAction("Batch harvest ...")
+        self.batchHarvestAction.triggered.connect(self.show_batch_harvest)
+        self.provisionAction = self.toolsMenu.addAction("Provision tags ...")
+        self.provisionAction.triggered.connect(self.show_provisioning)
+        self.liveTelemetryAction = self.toolsMenu.addAction("Live telemetry ...")
+        self.liveTelemetryAction.triggered.connect(self.show_live_telemetry)
+        self.trackViewerAction = self.toolsMenu.addAction("Track viewer ...")
+        self.trackViewerAction.triggered.connect(self.show_track_viewer)
+        self.archiveQueryAction = self.toolsMenu.addAction("Archive query ...")
+        self.archiveQueryAction.triggered.connect(self.show_archive_query)
+        self.processLogsAction = self.toolsMenu.addAction("Process logs ...")
+        self.processLogsAction.triggered.connect(self.show_process_logs)
+        self.diagnosticsAction = self.toolsMenu.addAction("Diagnostics ...")
+        self.diagnosticsAction.triggered.connect(self.show_diagnostics)
+        self.fastLinkAction = self.toolsMenu.addAction("Tune link speed for downloads")
+        self.fastLinkAction.setCheckable(True)
+        self.processDownloadsAction = self.toolsMenu.addAction("Process downloads (CSV / GPX)")
+        self.processDownloadsAction.setCheckable(True)
+        self.syncAction = self.toolsMenu.addAction("Sync to archive ...")
+        self.syncAction.triggered.connect(self.sync_archive)
+        self.autoRefreshAction = self.toolsMenu.addAction("Auto refresh device state")
+        self.autoRefreshAction.setCheckable(True)
+        self.autoRefreshAction.toggled.connect(self.set_auto_refresh)
+        self.recordSessionAction = self.toolsMenu.addAction("Record session ...")
+        self.recordSessionAction.setCheckable(True)
+        self.recordSessionAction.toggled.connect(self.set_recording)
+        self.replaySessionAction = self.toolsMenu.addAction("Replay session ...")
+        self.replaySessionAction.triggered.connect(self.replay_session)
+
         # Set combo box items
         self.comPortComboBox.addItem("9600")
         self.comPortComboBox.addItem("14400")
@@ -88,14 +130,60 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.comPortComboBox.addItem("38400")
         self.comPortComboBox.addItem("57600")
         self.comPortComboBox.addItem("115200")
+        self.comPortComboBox.addItem("230400")
+        self.comPortComboBox.addItem("460800")
+        self.comPortComboBox.addItem("921600")
         self.comPortComboBox.setCurrentIndex(5)
 
     def __del__(self):
         return
 
+    def pixmap(self, file_name):
+        if file_name not in self.pixmaps:
+            self.pixmaps[file_name] = QPixmap('icons/' + file_name)
+        return self.pixmaps[file_name]
+
+    @property
+    def pixmapBad(self):
+        return self.pixmap('cross.png')
+
+    @property
+    def pixmapGood(self):
+        return self.pixmap('tick.png')
+
+    @property
+    def pixmapUnknown(self):
+        return self.pixmap('question.png')
+
     def closeEvent(self, event):
         if self.device_connected:
-            self.serial_disconnect()
+            try:
+                self.scheduler.submit(self.usb_com.disconnect).result(timeout=5)
+            except Exception as e:
+                print(e)
+        self.scheduler.stop(timeout=1)
+        self.stop_recording()
+
+    ''' Runs fn(*args) on the scheduler thread, on_result / on_error are then called on the UI thread '''
+    def run_device(self, fn, *args, priority=PRIORITY_USER, key=None, on_result=None, on_error=None):
+        return self.deliver(self.scheduler.submit(fn, *args, priority=priority, key=key), on_result, on_error)
+
+    def deliver(self, future, on_result=None, on_error=None):
+        future.add_done_callback(lambda future: self.device_signals.done.emit(future, on_result, on_error))
+        return future
+
+    def device_call_done(self, future, on_result, on_error):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            (on_error or self.show_device_error)(error)
+        elif on_result is not None:
+            on_result(future.result())
+
+    def show_device_error(self, error):
+        print(error)
+        self.stateLineEdit.setText(str(error))
 
     def browse_files(self):
         options = QFileDialog.Options()
@@ -105,6 +193,90 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         if fileName:
             self.fileBrowserLineEdit.setText(fileName)
 
+    def show_batch_harvest(self):
+        from panels import BatchHarvestDialog
+        # port used by this window is left out of the batch
+        exclude = [self.usb_com.get_port()] if self.device_connected else []
+        dialog = BatchHarvestDialog(self, exclude)
+        dialog.exec()
+
+    def show_provisioning(self):
+        from panels import ProvisionDialog
+        exclude = [self.usb_com.get_port()] if self.device_connected else []
+        dialog = ProvisionDialog(self, exclude, (self.setHourSpinBox.value(), self.setMinuteSpinBox.value()),
+                                 self.setAltSpinBox.value())
+        dialog.exec()
+
+    def show_live_telemetry(self):
+        if not self.device_connected:
+            self.stateLineEdit.setText("Not connected ...")
+            return
+        from panels import LiveTelemetryDialog
+        dialog = LiveTelemetryDialog(self.read_sensor_data, self, self.show_live_data)
+        dialog.exec()
+
+    def show_track_viewer(self):
+        from panels import TrackViewerDialog
+        # last downloaded log is shown right away
+        file_name = self.fileBrowserLineEdit.text()
+        dialog = TrackViewerDialog(self, [file_name] if os.path.isfile(file_name) else [])
+        dialog.exec()
+
+    def show_archive_query(self):
+        from panels import ArchiveQueryDialog
+        dialog = ArchiveQueryDialog(self, self.archive_dir)
+        dialog.exec()
+
+    def show_process_logs(self):
+        from panels import ProcessLogsDialog
+        file_name = self.fileBrowserLineEdit.text()
+        dialog = ProcessLogsDialog(self, [file_name] if os.path.isfile(file_name) else [], self.setAltSpinBox.value())
+        dialog.exec()
+
+    def show_diagnostics(self):
+        from panels import DiagnosticsDialog
+        dialog = DiagnosticsDialog(self.usb_com.instrumentation, self)
+        dialog.exec()
+
+    def set_recording(self, enabled):
+        if not enabled:
+            self.stop_recording()
+            return
+        file_name, _ = QFileDialog.getSaveFileName(self, "Record session", "session.bin",
+                                                   "Sessions (*.bin);;All Files (*)")
+        if not file_name:
+            self.recordSessionAction.setChecked(False)
+            return
+        from session import SessionRecorder
+        self.usb_com.recorder = SessionRecorder(file_name, {"port": self.usb_com.get_port(),
+                                                            "baud": self.usb_com.baud_rate})
+        self.statusbar.showMessage("Recording session to %s" % file_name)
+
+    def stop_recording(self):
+        recorder = self.usb_com.recorder
+        if recorder is not None:
+            self.usb_com.recorder = None
+            recorder.stop()
+            self.statusbar.showMessage("Session recorded, %d records" % recorder.records)
+
+    ''' Connects to a recorded session instead of the serial port '''
+    def replay_session(self):
+        if self.device_connected:
+            self.stateLineEdit.setText("Disconnect first ...")
+            return
+        file_name, _ = QFileDialog.getOpenFileName(self, "Replay session", "", "Sessions (*.bin);;All Files (*)")
+        if not file_name:
+            return
+        speed, ok = QInputDialog.getDouble(self, "Replay session", "Speed (0 = recorded order at once)",
+                                           self.usb_com.replay_speed, 0.0, 100.0, 1)
+        if not ok:
+            return
+        self.usb_com.set_port(REPLAY_PREFIX + file_name)
+        self.usb_com.replay_speed = speed
+
+        self.stateLineEdit.setText("Connecting ...")
+        self.run_device(self.connect_device, on_result=self.show_connected)
+
     def serial_connect(self):
         if platform == "linux":
             port = "/dev/ttyUSB" + self.comPortLineEdit.text()
@@ -118,26 +290,17 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         baud = int(self.comPortComboBox.currentText())
         self.usb_com.set_baud_rate(baud)
 
-        # Try to connect in new thread
         self.stateLineEdit.setText("Connecting ...")
-        worker = Worker(self.connect_device)
-        worker.setAutoDelete(True)
-        self.thread_pool.start(worker)
+        self.run_device(self.connect_device, on_result=self.show_connected)
 
     def serial_disconnect(self):
         if self.device_connected:
-            try:
-                self.mutex.lock()
-                self.usb_com.disconnect()
-                # self.mutex.unlock()
-            except Exception as e:
-                self.mutex.unlock()
-                self.stateLineEdit.setText(str(e))
-            else:
-                self.mutex.unlock()
-                self.stateLineEdit.setText("Disconnected")
+            self.run_device(self.usb_com.disconnect, on_result=lambda result: self.stateLineEdit.setText("Disconnected"))
 
             self.device_connected = False
+            self.autoRefreshAction.setChecked(False)
+            self.status_cache.invalidate()
+            self.shown_status = None
             self.connectButton.setEnabled(True)
             self.comPortLineEdit.setEnabled(True)
             self.comPortComboBox.setEnabled(True)
@@ -148,148 +311,263 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
             self.deviceSetUpGroupBox.setEnabled(False)
             self.liveDataGroupBox.setEnabled(False)
 
+    # runs on scheduler thread
     def connect_device(self):
-        try:
-            self.mutex.lock()
-            self.usb_com.connect()
-            self.mutex.unlock()
-
-            # print("Connected")
-            self.get_memory_state()
-            # print("Got mem state")
-            self.get_device_state()
-            # print("Got dev state")
-
-        except Exception as e:
-            self.mutex.unlock()
-            print(e.__cause__)
-            self.stateLineEdit.setText(str(e))
-        else:
-            # print("Success")
-            self.mutex.unlock()
-            # Set connection status
-            self.device_connected = True
-            self.stateLineEdit.setText("Connected")
-            # Disable connection window
-            self.connectButton.setEnabled(False)
-            self.comPortLineEdit.setEnabled(False)
-            self.comPortComboBox.setEnabled(False)
-            self.stateLineEdit.setEnabled(False)
-            # Enable device setup, status, data
-            self.dataGroupBox.setEnabled(True)
-            self.deviceStateGroupBox.setEnabled(True)
-            self.deviceSetUpGroupBox.setEnabled(True)
-            self.liveDataGroupBox.setEnabled(True)
-            # Start live data thread
-            # self.thread_pool.tryStart(self.live_data_worker)
+        self.usb_com.connect()
+        return self.usb_com.get_device_status()
+
+    def show_connected(self, status):
+        self.status_cache.store(status)
+        self.show_device_status(status)
+
+        # Set connection status
+        self.device_connected = True
+        self.stateLineEdit.setText("Connected")
+        # Disable connection window
+        self.connectButton.setEnabled(False)
+        self.comPortLineEdit.setEnabled(False)
+        self.comPortComboBox.setEnabled(False)
+        self.stateLineEdit.setEnabled(False)
+        # Enable device setup, status, data
+        self.dataGroupBox.setEnabled(True)
+        self.deviceStateGroupBox.setEnabled(True)
+        self.deviceSetUpGroupBox.setEnabled(True)
+        self.liveDataGroupBox.setEnabled(True)
 
     def save_logged_data(self):
+        self.saveDataPushButton.setEnabled(False)
+        self.erasePushButton.setEnabled(False)
+        self.downloadProgressBar.setRange(0, 0)
+        self.statusbar.showMessage("Downloading ...")
+
+        # status polls keep their priority and are served before the download starts
+        self.run_device(self.download_log, self.fileBrowserLineEdit.text(), self.resumeCheckBox.isChecked(),
+                        self.columnarCheckBox.isChecked(), self.fastLinkAction.isChecked(), priority=PRIORITY_BULK)
+
+    # runs on scheduler thread
+    def download_log(self, file_name, resumable, columnar, fast=False):
+        size = 0
         try:
-            self.mutex.lock()
-            self.usb_com.log_data(self.fileBrowserLineEdit.text())
+            # exports and the log store name their files after the tag
+            tag_id = self.usb_com.read_tag_id()
+            if fast:
+                from link_tuning import fast_link
+                with fast_link(self.usb_com, tag_id):
+                    self.usb_com.log_data(file_name, self.download_signals.progress.emit, resumable)
+            else:
+                self.usb_com.log_data(file_name, self.download_signals.progress.emit, resumable)
+            size = os.path.getsize(file_name)
         except Exception as e:
             print(e)
-            self.mutex.unlock()
-            self.show_dialog()
-        else:
-            self.mutex.unlock()
+            self.download_signals.error.emit(str(e))
+            return
 
-    def erase_data(self):
-        if self.confirm_action_dialog():
+        if columnar:
+            try:
+                import log_store
+                log_store.save_log_file(file_name, os.path.dirname(os.path.abspath(file_name)), tag_id, "npz")
+            except Exception as e:
+                print(e)
+                self.download_signals.error.emit(str(e))
+                return
+        self.download_signals.finished.emit(size, tag_id)
+
+    def sync_archive(self):
+        if not self.device_connected:
+            self.stateLineEdit.setText("Not connected ...")
+            return
+        archive_dir = QFileDialog.getExistingDirectory(self, "Archive directory", self.archive_dir or os.getcwd())
+        if not archive_dir:
+            return
+        self.archive_dir = archive_dir
+        self.saveDataPushButton.setEnabled(False)
+        self.erasePushButton.setEnabled(False)
+        self.downloadProgressBar.setRange(0, 0)
+        self.statusbar.showMessage("Syncing ...")
+        self.run_device(self.sync_device, archive_dir, priority=PRIORITY_BULK, on_result=self.sync_finished,
+                        on_error=lambda error: self.download_failed(str(error)))
+
+    # runs on scheduler thread
+    def sync_device(self, archive_dir):
+        import sync
+        tag_id = self.usb_com.read_tag_id()
+        return tag_id, sync.sync_device(self.usb_com, archive_dir, tag_id, self.download_signals.progress.emit)
+
+    def sync_finished(self, result):
+        tag_id, sync_result = result
+        self.downloadProgressBar.setRange(0, 1)
+        self.downloadProgressBar.setValue(1)
+        self.downloadProgressBar.setFormat("%.1f kB new" % (sync_result["new_bytes"] / 1000))
+        self.statusbar.showMessage("Synced %s, %.1f kB archived" % (tag_id, sync_result["offset"] / 1000))
+        if sync_result["new_bytes"]:
+            self.index_log(sync_result["file"], self.archive_dir, tag_id)
+        self.saveDataPushButton.setEnabled(True)
+        self.erasePushButton.setEnabled(True)
+
+        if sync_result["complete"] and sync_result["offset"] > 0:
+            answer = QMessageBox.question(self, "Erase archived memory",
+                                          "All %.1f kB of %s are archived. Erase device memory?" % (
+                                              sync_result["offset"] / 1000, tag_id))
+            if answer == QMessageBox.Yes:
+                import sync
+                self.statusbar.showMessage("Erasing ...")
+                self.run_device(sync.erase_archived, self.usb_com, self.archive_dir, tag_id, priority=PRIORITY_BULK,
+                                on_result=self.erase_finished)
+
+    def download_progress(self, received, rate):
+        self.statusbar.showMessage("Downloading ... %.1f kB (%.1f kB/s)" % (received / 1000, rate / 1000))
+
+    def download_finished(self, size, tag_id):
+        self.downloadProgressBar.setRange(0, 1)
+        self.downloadProgressBar.setValue(1)
+        self.downloadProgressBar.setFormat("%.1f kB saved" % (size / 1000))
+        self.statusbar.showMessage("Download finished")
+        self.saveDataPushButton.setEnabled(True)
+        self.erasePushButton.setEnabled(True)
+        file_name = self.fileBrowserLineEdit.text()
+        # downloads into an indexed archive directory are indexed right away
+        if os.path.exists(os.path.join(os.path.dirname(os.path.abspath(file_name)), "index.sqlite")):
+            self.index_log(file_name, os.path.dirname(os.path.abspath(file_name)))
+        if self.processDownloadsAction.isChecked():
+            self.process_download(file_name, tag_id)
+
+    ''' Adds new part of the log to the spatiotemporal index of archive_dir in background '''
+    def index_log(self, file_name, archive_dir, tag_id=None):
+        def run():
+            import archive_index
             try:
-                self.mutex.lock()
-                self.usb_com.erase_flash_memory()
-                self.mutex.unlock()
-                self.get_memory_state()
+                index = archive_index.ArchiveIndex(archive_dir)
+                try:
+                    index.ingest(file_name, tag_id)
+                finally:
+                    index.close()
             except Exception as e:
-                self.mutex.unlock()
                 print(e)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    ''' Processing pipeline over the saved log, exports are written next to it '''
+    def process_download(self, file_name, tag_id=''):
+        from panels import ProcessSignals
+        import multiprocessing
+        import pipeline
+        if self.process_signals is None:
+            self.process_signals = ProcessSignals()
+            self.process_signals.finished.connect(self.processing_finished)
+        self.statusbar.showMessage("Processing %s ..." % os.path.basename(file_name))
+        args = ([file_name], os.path.dirname(os.path.abspath(file_name)), pipeline.FORMATS, self.setAltSpinBox.value())
+        # logs downloaded to the same file name from other tags keep their exports
+        names = [pipeline.tagged_name(file_name, tag_id)]
+
+        def run():
+            results = []
+            try:
+                # forked worker would inherit locks held by Qt and scheduler threads
+                results = pipeline.process_files(*args, names=names, mp_context=multiprocessing.get_context("spawn"))
+            except Exception as e:
+                print(e)
+            finally:
+                self.process_signals.finished.emit(results)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def processing_finished(self, results):
+        for status in results:
+            if status["state"] == "done":
+                self.statusbar.showMessage("Processed %d records, %d fixes (%d rejected): %s" % (
+                    status["records"], status["fixes"], status["rejected"],
+                    ", ".join(os.path.basename(output) for output in status["outputs"])))
             else:
-                self.mutex.unlock()
+                self.statusbar.showMessage("Processing failed: %s" % status["error"])
+
+    def download_failed(self, error):
+        self.downloadProgressBar.setRange(0, 1)
+        self.downloadProgressBar.setValue(0)
+        self.downloadProgressBar.setFormat("")
+        self.statusbar.showMessage(error)
+        self.saveDataPushButton.setEnabled(True)
+        self.erasePushButton.setEnabled(True)
+        self.show_dialog()
+
+    def erase_data(self):
+        if self.confirm_action_dialog():
+            self.statusbar.showMessage("Erasing ...")
+            self.run_device(self.usb_com.erase_flash_memory, priority=PRIORITY_BULK, on_result=self.erase_finished)
+
+    def erase_finished(self, result):
+        self.statusbar.showMessage("Memory erased")
+        self.status_changed()
 
     def set_time(self):
         hour = self.setHourSpinBox.value()
         minute = self.setMinuteSpinBox.value()
-        self.mutex.lock()
-        self.usb_com.set_time(hour, minute)
-        self.mutex.unlock()
+        self.run_device(self.usb_com.set_time, hour, minute, on_result=self.status_changed)
 
     def set_clock(self):
         hour = self.setClockHourSpinBox.value()
         minute = self.setClockMinuteSpinBox.value()
-        self.mutex.lock()
-        self.usb_com.set_clock(hour, minute)
-        self.mutex.unlock()
+        self.run_device(self.usb_com.set_clock, hour, minute)
 
     def set_altitude(self):
         alt = self.setAltSpinBox.value()
-        self.mutex.lock()
-        self.usb_com.set_altitude(alt)
-        self.mutex.unlock()
-
-    def get_memory_state(self):
-        self.mutex.lock()
-        used_mem, state_mem = self.usb_com.get_memory_state()
-        self.mutex.unlock()
-
-        self.memoryProgressBar.setValue(used_mem/100)
-        self.memoryProgressBar.setFormat("%.02f %%" % (used_mem/100))
-
-        if state_mem == 1:
-            self.memoryStateLabel.setPixmap(self.pixmapGood)
-        elif state_mem == 2:
-            self.memoryStateLabel.setPixmap(self.pixmapUnknown)
-        else:
-            self.memoryStateLabel.setPixmap(self.pixmapBad)
-
-    def get_device_state(self):
-        self.mutex.lock()
-        gps, baro, state, gps_fix = self.usb_com.get_device_state()
-        self.mutex.unlock()
+        self.run_device(self.usb_com.set_altitude, alt, on_result=self.status_changed)
 
-        state_str = str(state)
+    ''' Command changed device state, cached status is stale '''
+    def status_changed(self, result=None):
+        self.status_cache.invalidate()
+        self.refresh_status()
 
-        if gps == 2:
-            self.gpsStateLabel.setPixmap(self.pixmapUnknown)
-        elif gps == 1:
-            self.gpsStateLabel.setPixmap(self.pixmapGood)
-        else:
-            self.gpsStateLabel.setPixmap(self.pixmapBad)
-
-        if baro == 2:
-            self.baroStateLabel.setPixmap(self.pixmapUnknown)
-        elif baro == 1:
-            self.baroStateLabel.setPixmap(self.pixmapGood)
-        else:
-            self.baroStateLabel.setPixmap(self.pixmapBad)
+    def refresh_status(self, max_age=None):
+        self.deliver(self.status_cache.request(max_age), self.show_device_status, print)
 
-        if gps_fix == ord('3'):
-            self.gpsFixStateLabel.setPixmap(self.pixmapGood)
+    def set_auto_refresh(self, enabled):
+        if enabled:
+            self.status_timer.start(200)
         else:
-            self.gpsFixStateLabel.setPixmap(self.pixmapBad)
-
-        if state_str[0] == "0":
-            self.labelDeviceState.setText('WAIT_FIRST_FIX')
-        elif state_str[0] == "1":
-            self.labelDeviceState.setText('WAIT_TIME_SETUP')
-        elif state_str[0] == "2":
-            self.labelDeviceState.setText('WAIT_ALT_SETUP')
-        elif state_str[0] == "3":
-            self.labelDeviceState.setText('SET_SLEEP_MODE')
-        elif state_str[0] == "4":
-            if state_str[1] == "0":
-                self.labelDeviceState.setText('WAIT_ALT_TRIGGER')
-            elif state_str[1] == "1":
-                self.labelDeviceState.setText('WAKE_UP_GPS')
-            elif state_str[1] == "2":
-                self.labelDeviceState.setText('WAIT_FOR_GPS_FIX')
-            elif state_str[1] == "3":
-                self.labelDeviceState.setText('LOG_MEAS_DATA')
+            self.status_timer.stop()
 
+    def poll_status(self):
+        if self.device_connected:
+            self.refresh_status()
+
+    def flag_pixmap(self, flag):
+        if flag == 1:
+            return self.pixmapGood
+        elif flag == 2:
+            return self.pixmapUnknown
+        return self.pixmapBad
+
+    ''' Updates only widgets of fields that differ from the status shown last '''
+    def show_device_status(self, status):
+        shown = self.shown_status
+        if shown == status:
+            return
+        self.shown_status = status
+
+        if shown is None or shown.memory_used != status.memory_used:
+            self.memoryProgressBar.setValue(int(status.memory_percent))
+            self.memoryProgressBar.setFormat("%.02f %%" % status.memory_percent)
+        if shown is None or shown.memory_state != status.memory_state:
+            self.memoryStateLabel.setPixmap(self.flag_pixmap(status.memory_state))
+        if shown is None or shown.gps != status.gps:
+            self.gpsStateLabel.setPixmap(self.flag_pixmap(status.gps))
+        if shown is None or shown.baro != status.baro:
+            self.baroStateLabel.setPixmap(self.flag_pixmap(status.baro))
+        if shown is None or shown.gps_fix != status.gps_fix:
+            self.gpsFixStateLabel.setPixmap(self.pixmapGood if status.gps_fix else self.pixmapBad)
+        if shown is None or shown.state != status.state:
+            self.labelDeviceState.setText(status.state_name)
+
+    ''' Device status and sensor data in one pipelined round trip, cache is refreshed with it '''
     def update_state_info(self):
-        self.get_memory_state()
-        self.get_device_state()
-        self.read_live_data()
+        self.run_device(self.usb_com.get_status, priority=PRIORITY_STATUS, key="STATUS", on_result=self.show_status,
+                        on_error=print)
+
+    def show_status(self, result):
+        status, sensor_data = result
+        self.status_cache.store(status)
+        self.show_device_status(status)
+        self.show_live_data(sensor_data)
 
     def show_dialog(self):
         self.msg_box.setIcon(QMessageBox.Warning)
@@ -312,24 +590,30 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         else:
             return False
 
+    # called from sampling thread of live telemetry, never from the UI thread. Behind a download
+    # the sample times out and is dropped instead of holding up the sampler and its stop()
+    def read_sensor_data(self):
+        return self.scheduler.call(self.usb_com.get_sensor_data, priority=PRIORITY_STATUS, key="READ_SENSOR_DATA",
+                                   timeout=2)
+
     def read_live_data(self):
+        self.run_device(self.usb_com.get_sensor_data, priority=PRIORITY_STATUS, key="READ_SENSOR_DATA",
+                        on_result=self.show_live_data, on_error=print)
+
+    def show_live_data(self, sensor_data):
         try:
-            self.mutex.lock()
-            baro_alt, gps_long, gps_lat, gps_alt, gps_time, gps_fix_time, gps_time_time = self.usb_com.get_sensor_data()
+            baro_alt, gps_long, gps_lat, gps_alt, gps_time, gps_fix_time, gps_time_time = sensor_data
             baro_alt_float = float(int(baro_alt)/100.0)
-
-            self.baroAltValue.setText(str(baro_alt_float))
-            self.gpsLatValue.setText(gps_lat)
-            self.gpsLongValue.setText(gps_long)
-            self.gpsAltValue.setText(gps_alt)
-            self.gpsTimeValue.setText(gps_time)
-            self.gpsFixTime.setText(gps_fix_time)
-
         except Exception as e:
-            self.mutex.unlock()
             print(e.__str__())
-        else:
-            self.mutex.unlock()
+            return
+
+        self.baroAltValue.setText(str(baro_alt_float))
+        self.gpsLatValue.setText(gps_lat)
+        self.gpsLongValue.setText(gps_long)
+        self.gpsAltValue.setText(gps_alt)
+        self.gpsTimeValue.setText(gps_time)
+        self.gpsFixTime.setText(gps_fix_time)
 
 
 if __name__ == '__main__':
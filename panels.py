@@ -0,0 +1,1231 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PyQt5.QtCore import QDate, QObject, QPointF, QRectF, Qt, QTime, QTimer, pyqtSignal
+from PyQt5.QtGui import QColor, QPainter, QPen, QPixmap, QPolygonF
+from PyQt5.QtWidgets import (QCheckBox, QComboBox, QDateEdit, QDialog, QDoubleSpinBox, QFileDialog, QGridLayout,
+                             QHBoxLayout, QHeaderView, QLabel, QLineEdit, QListWidget, QListWidgetItem,
+                             QPushButton, QSpinBox, QTableWidget, QTableWidgetItem, QTimeEdit, QVBoxLayout,
+                             QWidget)
+
+import harvest
+import log_store
+import pipeline
+from decoder import decode_file
+from instrumentation import BUCKET_BOUNDS
+from telemetry import LiveSampler, TelemetryBuffer, decimate_minmax
+from track_lod import TILE_SIZE, Track, project, unproject
+
+BAUD_RATES = ["9600", "14400", "19200", "38400", "57600", "115200", "230400", "460800", "921600"]
+
+
+class CleanupDialog(QDialog):
+    ''' Dialog that runs cleanup() however it is dismissed. Esc and reject() end the dialog through
+        done() without a closeEvent, so stopping timers and threads in closeEvent is not enough '''
+    def done(self, result):
+        self.cleanup()
+        QDialog.done(self, result)
+
+    def cleanup(self):
+        pass
+
+
+class DeviceSignals(QObject):
+    discovered = pyqtSignal(list)
+    status = pyqtSignal(dict)
+    finished = pyqtSignal()
+
+
+class PortScanDialog(QDialog):
+    ''' Base of dialogs working on many tags at once. Finds tags on serial ports, lists them to be
+        checked and keeps one result table row per port. Subclass adds its settings with
+        set_settings and connects startPushButton and signals.status / signals.finished '''
+    columns = []
+
+    def __init__(self, parent=None, exclude_ports=()):
+        QDialog.__init__(self, parent)
+        self.resize(760, 420)
+        self.exclude_ports = list(exclude_ports)
+        self.rows = {}
+
+        self.signals = DeviceSignals()
+        self.signals.discovered.connect(self.devices_discovered)
+
+        self.portList = QListWidget()
+        self.scanPushButton = QPushButton("Scan ports")
+        self.baudComboBox = QComboBox()
+        self.baudComboBox.addItems(BAUD_RATES)
+        self.baudComboBox.setCurrentIndex(BAUD_RATES.index("115200"))
+        self.startPushButton = QPushButton("Start")
+        self.startPushButton.setEnabled(False)
+
+        self.resultTable = QTableWidget(0, len(self.columns))
+        self.resultTable.setHorizontalHeaderLabels(self.columns)
+        self.resultTable.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.resultTable.horizontalHeader().setStretchLastSection(True)
+        self.summaryLabel = QLabel()
+
+        self.scanPushButton.pressed.connect(self.scan_ports)
+
+    ''' Lays out port list, settings grid and result table. Baud rate takes the first row of settings '''
+    def set_settings(self, settings):
+        settings.addWidget(QLabel("Baud rate"), 0, 0)
+        settings.addWidget(self.baudComboBox, 0, 1)
+
+        top = QHBoxLayout()
+        top.addWidget(self.portList)
+        top.addLayout(settings)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(top)
+        layout.addWidget(self.resultTable)
+        layout.addWidget(self.summaryLabel)
+
+    def baud_rate(self):
+        return int(self.baudComboBox.currentText())
+
+    def scan_ports(self):
+        self.scanPushButton.setEnabled(False)
+        self.startPushButton.setEnabled(False)
+        self.summaryLabel.setText("Scanning ports ...")
+        baud = self.baud_rate()
+
+        def scan():
+            self.signals.discovered.emit(harvest.discover_devices(baud, exclude=self.exclude_ports))
+
+        threading.Thread(target=scan, daemon=True).start()
+
+    def devices_discovered(self, ports):
+        self.portList.clear()
+        for port in ports:
+            item = QListWidgetItem(port)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked)
+            self.portList.addItem(item)
+
+        self.summaryLabel.setText("Found %d device(s)" % len(ports))
+        self.scanPushButton.setEnabled(True)
+        self.startPushButton.setEnabled(len(ports) > 0)
+
+    def checked_ports(self):
+        return [self.portList.item(i).text() for i in range(self.portList.count())
+                if self.portList.item(i).checkState() == Qt.Checked]
+
+    ''' Clears result table before a run over ports '''
+    def start_run(self, message):
+        self.scanPushButton.setEnabled(False)
+        self.startPushButton.setEnabled(False)
+        self.resultTable.setRowCount(0)
+        self.rows = {}
+        self.summaryLabel.setText(message)
+
+    def run_finished(self, message):
+        self.summaryLabel.setText(message)
+        self.scanPushButton.setEnabled(True)
+        self.startPushButton.setEnabled(self.portList.count() > 0)
+
+    def set_row(self, port, values):
+        if port not in self.rows:
+            self.rows[port] = self.resultTable.rowCount()
+            self.resultTable.insertRow(self.rows[port])
+
+        row = self.rows[port]
+        for column, value in enumerate(values):
+            self.resultTable.setItem(row, column, QTableWidgetItem(value))
+
+
+class BatchHarvestDialog(PortScanDialog):
+    columns = ["Port", "Tag", "State", "Downloaded", "Rate", "File / error"]
+
+    def __init__(self, parent=None, exclude_ports=()):
+        PortScanDialog.__init__(self, parent, exclude_ports)
+        self.setWindowTitle("Batch harvest")
+        self.signals.status.connect(self.update_status)
+        self.signals.finished.connect(self.harvest_finished)
+
+        self.outDirLineEdit = QLineEdit(os.getcwd())
+        self.outDirPushButton = QPushButton("...")
+        self.workersSpinBox = QSpinBox()
+        self.workersSpinBox.setRange(0, 64)
+        self.workersSpinBox.setSpecialValueText("one per port")
+        self.eraseCheckBox = QCheckBox("Erase after download")
+        self.resumeCheckBox = QCheckBox("Resumable download")
+        self.fastCheckBox = QCheckBox("Tune link speed")
+
+        settings = QGridLayout()
+        settings.addWidget(QLabel("Output directory"), 1, 0)
+        out_dir = QHBoxLayout()
+        out_dir.addWidget(self.outDirLineEdit)
+        out_dir.addWidget(self.outDirPushButton)
+        settings.addLayout(out_dir, 1, 1)
+        settings.addWidget(QLabel("Parallel downloads"), 2, 0)
+        settings.addWidget(self.workersSpinBox, 2, 1)
+        settings.addWidget(self.eraseCheckBox, 3, 1)
+        settings.addWidget(self.resumeCheckBox, 4, 1)
+        settings.addWidget(self.fastCheckBox, 5, 1)
+        settings.addWidget(self.scanPushButton, 6, 0)
+        settings.addWidget(self.startPushButton, 6, 1)
+        self.set_settings(settings)
+
+        self.outDirPushButton.pressed.connect(self.browse_out_dir)
+        self.startPushButton.pressed.connect(self.start_harvest)
+
+    def browse_out_dir(self):
+        out_dir = QFileDialog.getExistingDirectory(self, "Output directory", self.outDirLineEdit.text())
+        if out_dir:
+            self.outDirLineEdit.setText(out_dir)
+
+    def start_harvest(self):
+        ports = self.checked_ports()
+        if not ports:
+            return
+
+        self.start_run("Harvesting %d device(s) ..." % len(ports))
+        args = (ports, self.baud_rate(), self.outDirLineEdit.text(),
+                self.eraseCheckBox.isChecked(), self.resumeCheckBox.isChecked(), self.workersSpinBox.value(),
+                self.signals.status.emit, None, self.fastCheckBox.isChecked())
+
+        def run():
+            try:
+                harvest.harvest(*args)
+            finally:
+                self.signals.finished.emit()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def update_status(self, status):
+        self.set_row(status["port"], [status["port"], status["tag_id"], status["state"],
+                                      "%.1f kB" % (status["bytes"] / 1000), "%.1f kB/s" % (status["rate"] / 1000),
+                                      status["error"] or status["file"]])
+
+    def harvest_finished(self):
+        done = 0
+        for row in range(self.resultTable.rowCount()):
+            if self.resultTable.item(row, 2).text() == "done":
+                done += 1
+        self.run_finished("Harvested %d/%d device(s)" % (done, self.resultTable.rowCount()))
+
+
+class ProvisionDialog(PortScanDialog):
+    ''' Sets clock, wake time and altitude trigger on all checked tags at once '''
+    columns = ["Port", "Tag", "State", "RTT", "Clock", "Device state", "Error"]
+
+    def __init__(self, parent=None, exclude_ports=(), wake_time=(20, 0), altitude=0):
+        PortScanDialog.__init__(self, parent, exclude_ports)
+        self.setWindowTitle("Provision tags")
+        self.results = []
+        self.signals.status.connect(self.update_status)
+        self.signals.finished.connect(self.provisioning_finished)
+
+        self.wakeTimeEdit = QTimeEdit(QTime(*wake_time))
+        self.altitudeSpinBox = QSpinBox()
+        self.altitudeSpinBox.setRange(0, 9999)
+        self.altitudeSpinBox.setSuffix(" m")
+        self.altitudeSpinBox.setValue(altitude)
+        self.clockCheckBox = QCheckBox("Set clock")
+        self.clockCheckBox.setChecked(True)
+        self.utcCheckBox = QCheckBox("Clock in UTC")
+        self.reportPushButton = QPushButton("Save report ...")
+        self.reportPushButton.setEnabled(False)
+
+        settings = QGridLayout()
+        settings.addWidget(QLabel("Wake up time"), 1, 0)
+        settings.addWidget(self.wakeTimeEdit, 1, 1)
+        settings.addWidget(QLabel("Altitude trigger"), 2, 0)
+        settings.addWidget(self.altitudeSpinBox, 2, 1)
+        settings.addWidget(self.clockCheckBox, 3, 1)
+        settings.addWidget(self.utcCheckBox, 4, 1)
+        settings.addWidget(self.scanPushButton, 5, 0)
+        settings.addWidget(self.startPushButton, 5, 1)
+        settings.addWidget(self.reportPushButton, 6, 1)
+        self.set_settings(settings)
+
+        self.startPushButton.pressed.connect(self.start_provisioning)
+        self.reportPushButton.pressed.connect(self.save_report)
+
+    def start_provisioning(self):
+        import provisioning
+        ports = self.checked_ports()
+        if not ports:
+            return
+
+        self.start_run("Provisioning %d device(s) ..." % len(ports))
+        self.reportPushButton.setEnabled(False)
+        self.results = []
+
+        wake_time = self.wakeTimeEdit.time()
+        profile = provisioning.Profile(wake_time.hour(), wake_time.minute(), self.altitudeSpinBox.value(),
+                                       self.clockCheckBox.isChecked(), self.utcCheckBox.isChecked())
+        args = (ports, self.baud_rate(), profile, 0, self.signals.status.emit)
+
+        def run():
+            try:
+                self.results = provisioning.provision(*args)
+            finally:
+                self.signals.finished.emit()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def update_status(self, status):
+        self.set_row(status["port"], [
+            status["port"], status["tag_id"], status["state"], "%.1f ms" % status["rtt_ms"],
+            "%s (%+.1f ms)" % (status["clock"], status["clock_error_ms"]) if status["clock"] else "",
+            status["device_state_name"], status["error"]])
+
+    def provisioning_finished(self):
+        done = len([status for status in self.results if status["state"] == "done"])
+        self.run_finished("Provisioned %d/%d device(s)" % (done, len(self.results)))
+        self.reportPushButton.setEnabled(len(self.results) > 0)
+
+    def save_report(self):
+        import provisioning
+        file_name, _ = QFileDialog.getSaveFileName(self, "Save report", provisioning.report_file_name(os.getcwd()),
+                                                   "CSV Files (*.csv)")
+        if file_name:
+            provisioning.write_report(self.results, file_name)
+
+
+class ProcessSignals(QObject):
+    status = pyqtSignal(dict)
+    finished = pyqtSignal(list)
+
+
+class ProcessLogsDialog(QDialog):
+    ''' Runs the processing pipeline over downloaded logs on a process pool '''
+    columns = ["Log", "State", "Records", "Fixes", "Rejected", "Time", "Output / error"]
+
+    def __init__(self, parent=None, files=(), altitude=0):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle("Process logs")
+        self.resize(760, 420)
+        self.rows = {}
+
+        self.signals = ProcessSignals()
+        self.signals.status.connect(self.update_status)
+        self.signals.finished.connect(self.processing_finished)
+
+        self.fileList = QListWidget()
+        self.addPushButton = QPushButton("Add logs ...")
+        self.clearPushButton = QPushButton("Clear")
+        self.outDirLineEdit = QLineEdit(os.path.dirname(os.path.abspath(files[0])) if files else os.getcwd())
+        self.outDirPushButton = QPushButton("...")
+        self.csvCheckBox = QCheckBox("CSV")
+        self.csvCheckBox.setChecked(True)
+        self.gpxCheckBox = QCheckBox("GPX")
+        self.gpxCheckBox.setChecked(True)
+        self.altitudeSpinBox = QSpinBox()
+        self.altitudeSpinBox.setRange(0, 9999)
+        self.altitudeSpinBox.setSuffix(" m")
+        self.altitudeSpinBox.setValue(altitude)
+        self.maxSpeedSpinBox = QDoubleSpinBox()
+        self.maxSpeedSpinBox.setRange(1.0, 500.0)
+        self.maxSpeedSpinBox.setSuffix(" m/s")
+        self.maxSpeedSpinBox.setValue(pipeline.MAX_SPEED)
+        self.workersSpinBox = QSpinBox()
+        self.workersSpinBox.setRange(0, 64)
+        self.workersSpinBox.setSpecialValueText("one per core")
+        self.startPushButton = QPushButton("Start")
+
+        self.resultTable = QTableWidget(0, len(self.columns))
+        self.resultTable.setHorizontalHeaderLabels(self.columns)
+        self.resultTable.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.resultTable.horizontalHeader().setStretchLastSection(True)
+        self.summaryLabel = QLabel()
+
+        settings = QGridLayout()
+        settings.addWidget(QLabel("Output directory"), 0, 0)
+        out_dir = QHBoxLayout()
+        out_dir.addWidget(self.outDirLineEdit)
+        out_dir.addWidget(self.outDirPushButton)
+        settings.addLayout(out_dir, 0, 1)
+        formats = QHBoxLayout()
+        formats.addWidget(self.csvCheckBox)
+        formats.addWidget(self.gpxCheckBox)
+        settings.addWidget(QLabel("Export"), 1, 0)
+        settings.addLayout(formats, 1, 1)
+        settings.addWidget(QLabel("Altitude trigger"), 2, 0)
+        settings.addWidget(self.altitudeSpinBox, 2, 1)
+        settings.addWidget(QLabel("Max speed"), 3, 0)
+        settings.addWidget(self.maxSpeedSpinBox, 3, 1)
+        settings.addWidget(QLabel("Parallel processes"), 4, 0)
+        settings.addWidget(self.workersSpinBox, 4, 1)
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.addPushButton)
+        buttons.addWidget(self.clearPushButton)
+        settings.addLayout(buttons, 5, 0)
+        settings.addWidget(self.startPushButton, 5, 1)
+
+        top = QHBoxLayout()
+        top.addWidget(self.fileList)
+        top.addLayout(settings)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(top)
+        layout.addWidget(self.resultTable)
+        layout.addWidget(self.summaryLabel)
+
+        self.addPushButton.pressed.connect(self.add_logs)
+        self.clearPushButton.pressed.connect(self.fileList.clear)
+        self.outDirPushButton.pressed.connect(self.browse_out_dir)
+        self.startPushButton.pressed.connect(self.start_processing)
+
+        self.fileList.addItems(list(files))
+
+    def add_logs(self):
+        files, _ = QFileDialog.getOpenFileNames(self, "Add logs", "", "Text Files (*.txt);;All Files (*)")
+        self.fileList.addItems(files)
+
+    def browse_out_dir(self):
+        out_dir = QFileDialog.getExistingDirectory(self, "Output directory", self.outDirLineEdit.text())
+        if out_dir:
+            self.outDirLineEdit.setText(out_dir)
+
+    def start_processing(self):
+        files = [self.fileList.item(i).text() for i in range(self.fileList.count())]
+        formats = [fmt for fmt, check_box in (("csv", self.csvCheckBox), ("gpx", self.gpxCheckBox))
+                   if check_box.isChecked()]
+        if not files or not formats:
+            return
+
+        self.startPushButton.setEnabled(False)
+        self.resultTable.setRowCount(0)
+        self.rows = {}
+        self.summaryLabel.setText("Processing %d log(s) ..." % len(files))
+        self.start_time = time.monotonic()
+
+        args = (files, self.outDirLineEdit.text(), formats, self.altitudeSpinBox.value(), None,
+                self.workersSpinBox.value(), self.signals.status.emit, self.maxSpeedSpinBox.value())
+
+        def run():
+            results = []
+            try:
+                results = pipeline.process_files(*args)
+            except Exception as e:
+                print(e)
+            finally:
+                self.signals.finished.emit(results)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def update_status(self, status):
+        file_name = status["file"]
+        if file_name not in self.rows:
+            self.rows[file_name] = self.resultTable.rowCount()
+            self.resultTable.insertRow(self.rows[file_name])
+
+        row = self.rows[file_name]
+        values = [os.path.basename(file_name), status["state"], str(status["records"]), str(status["fixes"]),
+                  str(status["rejected"]), "%.1f s" % status["seconds"],
+                  status["error"] or ", ".join(os.path.basename(output) for output in status["outputs"])]
+        for column, value in enumerate(values):
+            self.resultTable.setItem(row, column, QTableWidgetItem(value))
+
+    def processing_finished(self, results):
+        done = len([status for status in results if status["state"] == "done"])
+        self.summaryLabel.setText("Processed %d/%d log(s) in %.1f s" % (done, self.fileList.count(),
+                                                                      time.monotonic() - self.start_time))
+        self.startPushButton.setEnabled(True)
+
+
+class PlotWidget(QWidget):
+    ''' Minimal line plot, series are expected to be already decimated to widget width '''
+    margin = 40
+
+    def __init__(self, title, x_label, parent=None):
+        QWidget.__init__(self, parent)
+        self.title = title
+        self.x_label = x_label
+        self.series = []
+        self.setMinimumSize(300, 160)
+
+    def plot_width(self):
+        return max(1, self.width() - 2 * self.margin)
+
+    def set_series(self, series):
+        self.series = series
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(40, 40, 40))
+        painter.setPen(Qt.white)
+        painter.drawText(self.margin, 15, self.title)
+
+        points = []
+        for x, y, color in self.series:
+            valid = ~(np.isnan(x) | np.isnan(y))
+            if valid.any():
+                points.append((x[valid], y[valid]))
+        if not points:
+            return
+
+        x_min = min(x.min() for x, y in points)
+        x_max = max(x.max() for x, y in points)
+        y_min = min(y.min() for x, y in points)
+        y_max = max(y.max() for x, y in points)
+        if x_max == x_min:
+            x_max = x_min + 1
+        if y_max == y_min:
+            y_min, y_max = y_min - 0.5, y_max + 0.5
+        # keep lines off the frame
+        padding = (y_max - y_min) * 0.05
+        y_min, y_max = y_min - padding, y_max + padding
+
+        width = self.plot_width()
+        height = max(1, self.height() - 2 * self.margin)
+        painter.setPen(QColor(120, 120, 120))
+        painter.drawRect(self.margin, self.margin, width, height)
+        painter.drawText(2, self.margin + 10, "%.6g" % y_max)
+        painter.drawText(2, self.margin + height, "%.6g" % y_min)
+        painter.drawText(self.margin, self.height() - 8, "%.6g" % x_min)
+        painter.drawText(self.margin + width - 60, self.height() - 8, "%.6g %s" % (x_max, self.x_label))
+
+        for x, y, color in self.series:
+            px = self.margin + (x - x_min) / (x_max - x_min) * width
+            py = self.margin + height - (y - y_min) / (y_max - y_min) * height
+            painter.setPen(QPen(QColor(color), 1))
+            # NaN splits the line into separate segments
+            invalid = np.isnan(px) | np.isnan(py)
+            for segment in np.split(np.arange(len(px)), np.flatnonzero(invalid)):
+                segment = segment[~invalid[segment]]
+                if len(segment) > 1:
+                    painter.drawPolyline(QPolygonF([QPointF(px[i], py[i]) for i in segment]))
+
+
+class LiveTelemetryDialog(CleanupDialog):
+    ''' Samples sensor data continuously into a bounded ring buffer and redraws decimated plots
+        at display rate. read_sample is called on a background thread '''
+    redraw_interval = 33
+
+    def __init__(self, read_sample, parent=None, sample_callback=None):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle("Live telemetry")
+        self.resize(700, 520)
+        self.read_sample = read_sample
+        self.sample_callback = sample_callback
+        self.sampler = None
+        self.buffer = None
+        self.drawn_samples = -1
+
+        self.rateSpinBox = QDoubleSpinBox()
+        self.rateSpinBox.setRange(0.1, 50.0)
+        self.rateSpinBox.setValue(5.0)
+        self.rateSpinBox.setSuffix(" Hz")
+        self.historySpinBox = QSpinBox()
+        self.historySpinBox.setRange(1, 240)
+        self.historySpinBox.setValue(10)
+        self.historySpinBox.setSuffix(" min")
+        self.startPushButton = QPushButton("Start")
+        self.statusLabel = QLabel()
+        self.altitudePlot = PlotWidget("Altitude [m] - baro (green), GPS (yellow)", "s")
+        self.trackPlot = PlotWidget("GPS track - latitude vs longitude", "")
+
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel("Sample rate"))
+        controls.addWidget(self.rateSpinBox)
+        controls.addWidget(QLabel("History"))
+        controls.addWidget(self.historySpinBox)
+        controls.addWidget(self.startPushButton)
+        controls.addStretch()
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(controls)
+        layout.addWidget(self.altitudePlot)
+        layout.addWidget(self.trackPlot)
+        layout.addWidget(self.statusLabel)
+
+        self.redraw_timer = QTimer(self)
+        self.redraw_timer.timeout.connect(self.redraw)
+        self.startPushButton.pressed.connect(self.toggle_sampling)
+
+    def toggle_sampling(self):
+        if self.sampler is not None:
+            self.stop_sampling()
+            return
+
+        rate = self.rateSpinBox.value()
+        self.buffer = TelemetryBuffer(max(2, int(rate * 60 * self.historySpinBox.value())))
+        self.sampler = LiveSampler(self.read_sample, self.buffer, rate)
+        self.sampler.start()
+        self.drawn_samples = -1
+        self.redraw_timer.start(self.redraw_interval)
+        self.rateSpinBox.setEnabled(False)
+        self.historySpinBox.setEnabled(False)
+        self.startPushButton.setText("Stop")
+
+    def stop_sampling(self):
+        self.redraw_timer.stop()
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler = None
+        self.rateSpinBox.setEnabled(True)
+        self.historySpinBox.setEnabled(True)
+        self.startPushButton.setText("Start")
+
+    def redraw(self):
+        total = self.buffer.total
+        if total == self.drawn_samples:
+            return
+        self.drawn_samples = total
+        samples = self.buffer.snapshot()
+        if not len(samples):
+            return
+
+        t = samples["t"] - samples["t"][-1]
+        buckets = self.altitudePlot.plot_width()
+        self.altitudePlot.set_series([
+            decimate_minmax(t, samples["baro_alt"].astype(np.float64), buckets) + ("lime",),
+            decimate_minmax(t, samples["gps_alt"].astype(np.float64), buckets) + ("yellow",),
+        ])
+        # track is not a function of time, thin it by stride instead
+        stride = max(1, len(samples) // (4 * self.trackPlot.plot_width()))
+        self.trackPlot.set_series([(samples["gps_long"][::stride], samples["gps_lat"][::stride], "cyan")])
+
+        self.statusLabel.setText("%d samples buffered, %d errors" % (len(samples), self.sampler.errors))
+        if self.sample_callback is not None and self.sampler.latest is not None:
+            self.sample_callback(self.sampler.latest)
+
+    def cleanup(self):
+        self.stop_sampling()
+
+
+class HistogramWidget(QWidget):
+    ''' Bar chart of latency histogram buckets, log2 scale on x axis '''
+    def __init__(self, parent=None):
+        QWidget.__init__(self, parent)
+        self.title = ""
+        self.counts = []
+        self.setMinimumSize(300, 140)
+
+    def set_histogram(self, title, counts):
+        self.title = title
+        self.counts = counts
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(40, 40, 40))
+        painter.setPen(Qt.white)
+        painter.drawText(10, 15, self.title)
+        if not self.counts or not max(self.counts):
+            return
+
+        used = [i for i, count in enumerate(self.counts) if count]
+        first, last = used[0], used[-1]
+        bars = last - first + 1
+        top, bottom = 25, self.height() - 20
+        bar_width = max(1.0, (self.width() - 20) / bars)
+        peak = max(self.counts)
+        for i in range(first, last + 1):
+            height = (bottom - top) * self.counts[i] / peak
+            x = 10 + (i - first) * bar_width
+            painter.fillRect(int(x), int(bottom - height), max(1, int(bar_width) - 2), int(height),
+                             QColor("cyan"))
+        painter.setPen(Qt.white)
+        painter.drawText(10, self.height() - 5, bucket_label(first))
+        painter.drawText(self.width() - 70, self.height() - 5, bucket_label(last))
+
+
+def bucket_label(index):
+    if index >= len(BUCKET_BOUNDS):
+        return "> %.6g s" % BUCKET_BOUNDS[-1]
+    return "<= %.3g ms" % (BUCKET_BOUNDS[index] * 1000)
+
+
+class DiagnosticsDialog(CleanupDialog):
+    ''' Shows counters and latency histograms collected by instrumentation of the connection,
+        statistics and trace can be exported as JSON '''
+    columns = ["Command", "Count", "Mean [ms]", "p50 [ms]", "p95 [ms]", "Max [ms]", "Timeouts", "Errors"]
+    refresh_interval = 500
+
+    def __init__(self, instrumentation, parent=None):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle("Diagnostics")
+        self.resize(760, 520)
+        self.instrumentation = instrumentation
+        self.histograms = {}
+
+        self.enableCheckBox = QCheckBox("Enable instrumentation")
+        self.enableCheckBox.setChecked(instrumentation.enabled)
+        self.resetPushButton = QPushButton("Reset")
+        self.summaryPushButton = QPushButton("Export statistics ...")
+        self.tracePushButton = QPushButton("Export trace ...")
+        self.countersLabel = QLabel()
+        self.commandTable = QTableWidget(0, len(self.columns))
+        self.commandTable.setHorizontalHeaderLabels(self.columns)
+        self.commandTable.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.commandTable.horizontalHeader().setStretchLastSection(True)
+        self.commandTable.setSelectionBehavior(QTableWidget.SelectRows)
+        self.histogramWidget = HistogramWidget()
+
+        controls = QHBoxLayout()
+        controls.addWidget(self.enableCheckBox)
+        controls.addStretch()
+        controls.addWidget(self.resetPushButton)
+        controls.addWidget(self.summaryPushButton)
+        controls.addWidget(self.tracePushButton)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(controls)
+        layout.addWidget(self.countersLabel)
+        layout.addWidget(self.commandTable)
+        layout.addWidget(self.histogramWidget)
+
+        self.enableCheckBox.toggled.connect(self.set_enabled)
+        self.resetPushButton.pressed.connect(self.reset)
+        self.summaryPushButton.pressed.connect(self.export_summary)
+        self.tracePushButton.pressed.connect(self.export_trace)
+        self.commandTable.itemSelectionChanged.connect(self.show_histogram)
+
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(self.refresh_interval)
+        self.refresh()
+
+    def set_enabled(self, enabled):
+        self.instrumentation.enabled = enabled
+
+    def reset(self):
+        self.instrumentation.reset()
+        self.refresh()
+
+    def refresh(self):
+        summary = self.instrumentation.summary()
+        counters = summary["counters"]
+        retries = sum(value for name, value in counters.items() if name.startswith("retry:"))
+        self.countersLabel.setText("Bytes in %d, bytes out %d, retries %d, send errors %d" % (
+            summary["bytes_in"], summary["bytes_out"], retries, counters.get("send_error", 0)))
+
+        rows = [(name, stats) for name, stats in sorted(summary["latency"].items())]
+        rows += [("wait: " + name, stats) for name, stats in sorted(summary["waits"].items())]
+        with self.instrumentation.lock:
+            self.histograms = {name: list(histogram.counts) for name, histogram in self.instrumentation.latency.items()}
+            self.histograms.update({"wait: " + name: list(histogram.counts)
+                                    for name, histogram in self.instrumentation.waits.items()})
+
+        selected = self.selected_name()
+        self.commandTable.setRowCount(len(rows))
+        for row, (name, stats) in enumerate(rows):
+            values = [name, str(stats["count"])] + \
+                ["%.2f" % (stats[key] * 1000) for key in ("mean", "p50", "p95", "max")] + \
+                [str(counters.get("timeout:" + name, 0)), str(counters.get("error:" + name, 0))]
+            for column, value in enumerate(values):
+                self.commandTable.setItem(row, column, QTableWidgetItem(value))
+            if name == selected:
+                self.commandTable.selectRow(row)
+        self.show_histogram()
+
+    def selected_name(self):
+        items = self.commandTable.selectedItems()
+        return self.commandTable.item(items[0].row(), 0).text() if items else None
+
+    def show_histogram(self):
+        name = self.selected_name()
+        self.histogramWidget.set_histogram(name or "Select command to show its latency histogram",
+                                           self.histograms.get(name, []))
+
+    def export_summary(self):
+        file_name, _ = QFileDialog.getSaveFileName(self, "Export statistics", "bat_gps_stats.json", "JSON (*.json)")
+        if file_name:
+            self.instrumentation.export_summary(file_name)
+
+    def export_trace(self):
+        file_name, _ = QFileDialog.getSaveFileName(self, "Export trace", "bat_gps_trace.json",
+                                                   "Chrome trace (*.json)")
+        if file_name:
+            self.instrumentation.export_trace(file_name)
+
+    def cleanup(self):
+        self.refresh_timer.stop()
+
+
+def polygon(x, y):
+    ''' QPolygonF filled straight from NumPy arrays, QPointF is two doubles '''
+    points = QPolygonF(len(x))
+    buffer = points.data()
+    buffer.setsize(len(x) * 16)
+    array = np.frombuffer(buffer, dtype=np.float64)
+    array[0::2] = x
+    array[1::2] = y
+    return points
+
+
+class TrackLoadSignals(QObject):
+    loaded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+
+class MapWidget(QWidget):
+    ''' Pans and zooms tracks in Web Mercator world coordinates over offline XYZ tiles
+        (<tile_dir>/<z>/<x>/<y>.png) or, without tiles, over a longitude / latitude graticule '''
+    # per track, coarser level is drawn when the view holds more
+    max_points = 50000
+    max_tiles = 256
+
+    def __init__(self, parent=None):
+        QWidget.__init__(self, parent)
+        self.tracks = []
+        self.tile_dir = None
+        self.tiles = OrderedDict()
+        self.center = (0.5, 0.5)
+        self.zoom = 1.0
+        self.drag_start = None
+        self.drawn_points = 0
+        self.paint_time = 0.0
+        self.setMinimumSize(400, 300)
+        self.setMouseTracking(True)
+
+    def scale(self):
+        return TILE_SIZE * 2.0 ** self.zoom
+
+    def view(self):
+        scale = self.scale()
+        return (self.center[0] - self.width() / 2 / scale, self.center[1] - self.height() / 2 / scale,
+                self.center[0] + self.width() / 2 / scale, self.center[1] + self.height() / 2 / scale)
+
+    def to_screen(self, x, y):
+        scale = self.scale()
+        return (x - self.center[0]) * scale + self.width() / 2, (y - self.center[1]) * scale + self.height() / 2
+
+    def to_world(self, px, py):
+        scale = self.scale()
+        return self.center[0] + (px - self.width() / 2) / scale, self.center[1] + (py - self.height() / 2) / scale
+
+    def add_track(self, track):
+        self.tracks.append(track)
+        self.update()
+
+    def clear(self):
+        self.tracks = []
+        self.update()
+
+    def set_tile_dir(self, tile_dir):
+        self.tile_dir = tile_dir
+        self.tiles.clear()
+        self.update()
+
+    def fit(self):
+        if not self.tracks:
+            return
+        bounds = np.array([track.bounds() for track in self.tracks])
+        x_min, y_min = bounds[:, 0].min(), bounds[:, 1].min()
+        x_max, y_max = bounds[:, 2].max(), bounds[:, 3].max()
+        self.center = ((x_min + x_max) / 2, (y_min + y_max) / 2)
+        span = max(x_max - x_min, y_max - y_min, 1e-9)
+        self.zoom = float(np.clip(np.log2(min(self.width(), self.height()) * 0.9 / span / TILE_SIZE), 0, 22))
+        self.update()
+
+    def wheelEvent(self, event):
+        # zoom around the cursor
+        px, py = event.pos().x(), event.pos().y()
+        x, y = self.to_world(px, py)
+        self.zoom = float(np.clip(self.zoom + event.angleDelta().y() / 480, 0, 22))
+        scale = self.scale()
+        self.center = (x - (px - self.width() / 2) / scale, y - (py - self.height() / 2) / scale)
+        self.update()
+
+    def mousePressEvent(self, event):
+        self.drag_start = (event.pos().x(), event.pos().y(), self.center)
+
+    def mouseMoveEvent(self, event):
+        if self.drag_start is not None:
+            px, py, center = self.drag_start
+            scale = self.scale()
+            self.center = (center[0] - (event.pos().x() - px) / scale, center[1] - (event.pos().y() - py) / scale)
+            self.update()
+
+    def mouseReleaseEvent(self, event):
+        self.drag_start = None
+
+    def tile(self, z, x, y):
+        key = (z, x, y)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        path = os.path.join(self.tile_dir, str(z), str(x), "%d.png" % y)
+        pixmap = QPixmap(path) if os.path.exists(path) else None
+        self.tiles[key] = pixmap
+        if len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return pixmap
+
+    def draw_tiles(self, painter, view):
+        z = max(0, int(round(self.zoom)))
+        count = 2 ** z
+        size = self.scale() / count
+        drawn = False
+        for tx in range(max(0, int(view[0] * count)), min(count, int(view[2] * count) + 1)):
+            for ty in range(max(0, int(view[1] * count)), min(count, int(view[3] * count) + 1)):
+                pixmap = self.tile(z, tx, ty)
+                if pixmap is None:
+                    continue
+                px, py = self.to_screen(tx / count, ty / count)
+                painter.drawPixmap(QRectF(px, py, size, size), pixmap, QRectF(pixmap.rect()))
+                drawn = True
+        return drawn
+
+    def draw_graticule(self, painter, view):
+        long_min, lat_max = unproject(view[0], view[1])
+        long_max, lat_min = unproject(view[2], view[3])
+        span = max(long_max - long_min, 1e-9)
+        step = next(step for step in (30, 10, 5, 2, 1, 0.5, 0.2, 0.1, 0.05, 0.02, 0.01, 0.005, 0.002, 0.001,
+                                      0.0005, 0.0002, 0.0001, 0.00005, 0.00002, 0.00001) if span / step >= 3)
+        painter.setPen(QPen(QColor(80, 80, 80), 1))
+        for long in np.arange(np.floor(long_min / step) * step, long_max + step, step):
+            px, py = self.to_screen(project(long, 0)[0], 0)
+            painter.drawLine(QPointF(px, 0), QPointF(px, self.height()))
+            painter.drawText(QPointF(px + 2, self.height() - 4), "%.6g" % long)
+        for lat in np.arange(np.floor(lat_min / step) * step, lat_max + step, step):
+            px, py = self.to_screen(0, project(0, lat)[1])
+            painter.drawLine(QPointF(0, py), QPointF(self.width(), py))
+            painter.drawText(QPointF(2, py - 2), "%.6g" % lat)
+
+    def paintEvent(self, event):
+        start = time.perf_counter()
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(30, 30, 30))
+        view = self.view()
+        if self.tile_dir is None or not self.draw_tiles(painter, view):
+            self.draw_graticule(painter, view)
+
+        scale = self.scale()
+        self.drawn_points = 0
+        for track in self.tracks:
+            # cosmetic 1 px pen is drawn without path stroking, much faster for long polylines
+            pen = QPen(QColor(track.color), 1)
+            pen.setCosmetic(True)
+            painter.setPen(pen)
+            for x, y in track.visible(self.zoom, view, self.max_points):
+                painter.drawPolyline(polygon((x - self.center[0]) * scale + self.width() / 2,
+                                             (y - self.center[1]) * scale + self.height() / 2))
+                self.drawn_points += len(x)
+
+        long, lat = unproject(*self.center)
+        painter.setPen(Qt.white)
+        painter.drawText(10, 15, "%.6f, %.6f  zoom %.1f" % (long, lat, self.zoom))
+        self.paint_time = time.perf_counter() - start
+
+
+class TrackViewerDialog(CleanupDialog):
+    ''' Tracks of downloaded logs (text) or log store files on a map. Logs are decoded and
+        simplified on a background thread '''
+    colors = ["cyan", "yellow", "lime", "magenta", "orange", "deepskyblue", "tomato", "white"]
+
+    def __init__(self, parent=None, files=()):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle("Track viewer")
+        self.resize(900, 700)
+
+        self.signals = TrackLoadSignals()
+        self.signals.loaded.connect(self.track_loaded)
+        self.signals.failed.connect(self.load_failed)
+
+        self.mapWidget = MapWidget()
+        self.openPushButton = QPushButton("Open logs ...")
+        self.storePushButton = QPushButton("Open store ...")
+        self.tilesPushButton = QPushButton("Tiles ...")
+        self.fitPushButton = QPushButton("Fit")
+        self.clearPushButton = QPushButton("Clear")
+        self.trackList = QListWidget()
+        self.trackList.setMaximumWidth(220)
+        self.statusLabel = QLabel()
+
+        controls = QHBoxLayout()
+        for button in (self.openPushButton, self.storePushButton, self.tilesPushButton, self.fitPushButton,
+                       self.clearPushButton):
+            controls.addWidget(button)
+        controls.addStretch()
+
+        center = QHBoxLayout()
+        center.addWidget(self.mapWidget, 1)
+        center.addWidget(self.trackList)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(controls)
+        layout.addLayout(center)
+        layout.addWidget(self.statusLabel)
+
+        self.openPushButton.pressed.connect(self.open_logs)
+        self.storePushButton.pressed.connect(self.open_store)
+        self.tilesPushButton.pressed.connect(self.choose_tiles)
+        self.fitPushButton.pressed.connect(self.mapWidget.fit)
+        self.clearPushButton.pressed.connect(self.clear)
+
+        self.status_timer = QTimer(self)
+        self.status_timer.timeout.connect(self.show_status)
+        self.status_timer.start(250)
+
+        if files:
+            self.load(list(files))
+
+    def open_logs(self):
+        files, _ = QFileDialog.getOpenFileNames(self, "Open logs", "",
+                                                "Logs (*.txt *.npy *.npz *.h5 *.parquet);;All Files (*)")
+        if files:
+            self.load(files)
+
+    def open_store(self):
+        store_dir = QFileDialog.getExistingDirectory(self, "Log store", "")
+        if store_dir:
+            self.load([os.path.join(store_dir, entry["file"]) for entry in log_store.read_index(store_dir)])
+
+    def choose_tiles(self):
+        tile_dir = QFileDialog.getExistingDirectory(self, "Offline tiles (<z>/<x>/<y>.png)", "")
+        if tile_dir:
+            self.mapWidget.set_tile_dir(tile_dir)
+
+    def clear(self):
+        self.mapWidget.clear()
+        self.trackList.clear()
+
+    def load(self, files):
+        self.statusLabel.setText("Loading %d file(s) ..." % len(files))
+        first_color = len(self.mapWidget.tracks)
+
+        def run():
+            for number, file_name in enumerate(files):
+                try:
+                    self.signals.loaded.emit(load_track(file_name, self.colors[(first_color + number) %
+                                                                               len(self.colors)]))
+                except Exception as e:
+                    self.signals.failed.emit("%s: %s" % (os.path.basename(file_name), e))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def track_loaded(self, track):
+        if track is None:
+            return
+        first = not self.mapWidget.tracks
+        self.mapWidget.add_track(track)
+        item = QListWidgetItem("%s (%d)" % (track.name, len(track)))
+        item.setForeground(QColor(track.color))
+        self.trackList.addItem(item)
+        if first:
+            self.mapWidget.fit()
+
+    def load_failed(self, error):
+        print(error)
+        self.statusLabel.setText(error)
+
+    def show_status(self):
+        total = sum(len(track) for track in self.mapWidget.tracks)
+        self.statusLabel.setText("%d track(s), %d points, %d drawn in %.1f ms" % (
+            len(self.mapWidget.tracks), total, self.mapWidget.drawn_points, self.mapWidget.paint_time * 1000))
+
+    def cleanup(self):
+        self.status_timer.stop()
+
+
+''' Track of valid fixes of a text log or log store file, None when it has no fix '''
+def load_track(file_name, color):
+    if file_name.endswith(tuple(log_store.FORMATS.values())):
+        records = log_store.load(file_name)
+    else:
+        records = decode_file(file_name)
+    fixes = records[log_store.valid_fixes(records)]
+    if not len(fixes):
+        return None
+    name = os.path.splitext(os.path.basename(file_name))[0]
+    return Track(name, fixes["gps_long"], fixes["gps_lat"], color)
+
+
+class IndexSignals(QObject):
+    updated = pyqtSignal(int, float)
+    failed = pyqtSignal(str)
+
+
+class ArchiveQueryDialog(CleanupDialog):
+    ''' Range queries over the spatiotemporal index of an archive directory. Queries run on the
+        UI thread, index updates on a background thread '''
+    columns = ["Tag", "Fixes", "First", "Last", "Log"]
+
+    def __init__(self, parent=None, archive_dir=None):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle("Archive query")
+        self.resize(820, 520)
+        self.index = None
+        self.result = None
+        self.files = {}
+
+        self.signals = IndexSignals()
+        self.signals.updated.connect(self.index_updated)
+        self.signals.failed.connect(self.show_error)
+
+        self.archiveLineEdit = QLineEdit(archive_dir or "")
+        self.archivePushButton = QPushButton("...")
+        self.updatePushButton = QPushButton("Update index")
+        self.nearCheckBox = QCheckBox("Near")
+        self.nearCheckBox.setChecked(True)
+        self.longSpinBox = QDoubleSpinBox()
+        self.longSpinBox.setRange(-180.0, 180.0)
+        self.longSpinBox.setDecimals(6)
+        self.latSpinBox = QDoubleSpinBox()
+        self.latSpinBox.setRange(-90.0, 90.0)
+        self.latSpinBox.setDecimals(6)
+        self.radiusSpinBox = QDoubleSpinBox()
+        self.radiusSpinBox.setRange(0.01, 20000.0)
+        self.radiusSpinBox.setValue(5.0)
+        self.radiusSpinBox.setSuffix(" km")
+        self.datesCheckBox = QCheckBox("Dates")
+        self.fromDateEdit = QDateEdit(QDate.currentDate().addMonths(-1))
+        self.fromDateEdit.setCalendarPopup(True)
+        self.toDateEdit = QDateEdit(QDate.currentDate())
+        self.toDateEdit.setCalendarPopup(True)
+        self.hoursCheckBox = QCheckBox("Hours")
+        self.fromTimeEdit = QTimeEdit(QTime(22, 0))
+        self.toTimeEdit = QTimeEdit(QTime(2, 0))
+        self.utcOffsetSpinBox = QDoubleSpinBox()
+        self.utcOffsetSpinBox.setRange(-12.0, 14.0)
+        self.utcOffsetSpinBox.setPrefix("UTC ")
+        self.tagComboBox = QComboBox()
+        self.queryPushButton = QPushButton("Query")
+        self.mapPushButton = QPushButton("Show on map")
+        self.mapPushButton.setEnabled(False)
+
+        self.resultTable = QTableWidget(0, len(self.columns))
+        self.resultTable.setHorizontalHeaderLabels(self.columns)
+        self.resultTable.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.resultTable.horizontalHeader().setStretchLastSection(True)
+        self.summaryLabel = QLabel()
+
+        archive = QHBoxLayout()
+        archive.addWidget(QLabel("Archive"))
+        archive.addWidget(self.archiveLineEdit)
+        archive.addWidget(self.archivePushButton)
+        archive.addWidget(self.updatePushButton)
+
+        filters = QGridLayout()
+        filters.addWidget(self.nearCheckBox, 0, 0)
+        filters.addWidget(self.longSpinBox, 0, 1)
+        filters.addWidget(self.latSpinBox, 0, 2)
+        filters.addWidget(self.radiusSpinBox, 0, 3)
+        filters.addWidget(self.datesCheckBox, 1, 0)
+        filters.addWidget(self.fromDateEdit, 1, 1)
+        filters.addWidget(self.toDateEdit, 1, 2)
+        filters.addWidget(self.hoursCheckBox, 2, 0)
+        filters.addWidget(self.fromTimeEdit, 2, 1)
+        filters.addWidget(self.toTimeEdit, 2, 2)
+        filters.addWidget(self.utcOffsetSpinBox, 2, 3)
+        filters.addWidget(QLabel("Tag"), 3, 0)
+        filters.addWidget(self.tagComboBox, 3, 1)
+        filters.addWidget(self.queryPushButton, 3, 2)
+        filters.addWidget(self.mapPushButton, 3, 3)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(archive)
+        layout.addLayout(filters)
+        layout.addWidget(self.resultTable)
+        layout.addWidget(self.summaryLabel)
+
+        self.archivePushButton.pressed.connect(self.browse_archive)
+        self.updatePushButton.pressed.connect(self.update_index)
+        self.queryPushButton.pressed.connect(self.run_query)
+        self.mapPushButton.pressed.connect(self.show_on_map)
+
+        if archive_dir:
+            self.open_index(archive_dir)
+
+    def browse_archive(self):
+        archive_dir = QFileDialog.getExistingDirectory(self, "Archive directory", self.archiveLineEdit.text())
+        if archive_dir:
+            self.archiveLineEdit.setText(archive_dir)
+            self.open_index(archive_dir)
+
+    def open_index(self, archive_dir):
+        import archive_index
+        if self.index is not None:
+            self.index.close()
+        try:
+            self.index = archive_index.ArchiveIndex(archive_dir)
+        except Exception as e:
+            self.index = None
+            self.show_error(str(e))
+            return
+        self.refresh_files()
+
+    def refresh_files(self):
+        self.files = {entry["id"]: entry for entry in self.index.files()}
+        tag = self.tagComboBox.currentText()
+        self.tagComboBox.clear()
+        self.tagComboBox.addItems(["all"] + self.index.tags())
+        self.tagComboBox.setCurrentText(tag)
+        self.summaryLabel.setText("%d log(s), %d fixes indexed" % (
+            len(self.files), sum(entry["fixes"] for entry in self.files.values())))
+
+    def update_index(self):
+        if self.index is None:
+            return
+        self.updatePushButton.setEnabled(False)
+        self.summaryLabel.setText("Indexing ...")
+        index = self.index
+        archive_dir = self.archiveLineEdit.text()
+
+        def run():
+            start_time = time.monotonic()
+            try:
+                added = index.ingest_dir(archive_dir)
+            except Exception as e:
+                self.signals.failed.emit(str(e))
+            else:
+                self.signals.updated.emit(sum(added.values()), time.monotonic() - start_time)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def index_updated(self, count, seconds):
+        self.updatePushButton.setEnabled(True)
+        self.refresh_files()
+        self.summaryLabel.setText("%d new fixes indexed in %.1f s, %s" % (count, seconds, self.summaryLabel.text()))
+
+    def show_error(self, error):
+        print(error)
+        self.updatePushButton.setEnabled(True)
+        self.summaryLabel.setText(error)
+
+    def run_query(self):
+        import archive_index
+        if self.index is None:
+            return
+        center = radius = time_from = time_to = hours = None
+        if self.nearCheckBox.isChecked():
+            center = (self.longSpinBox.value(), self.latSpinBox.value())
+            radius = self.radiusSpinBox.value() * 1000
+        if self.datesCheckBox.isChecked():
+            time_from = archive_index.parse_date(self.fromDateEdit.date().toString("yyyy-MM-dd"))
+            time_to = archive_index.parse_date(self.toDateEdit.date().toString("yyyy-MM-dd")) + archive_index.DAY
+        if self.hoursCheckBox.isChecked():
+            hours = (QTime(0, 0).secsTo(self.fromTimeEdit.time()), QTime(0, 0).secsTo(self.toTimeEdit.time()))
+        tag_id = None if self.tagComboBox.currentText() in ("", "all") else self.tagComboBox.currentText()
+
+        self.result = self.index.query(None, center, radius, time_from, time_to, hours,
+                                       self.utcOffsetSpinBox.value(), tag_id)
+        file_ids, first = np.unique(self.result["file_id"], return_index=True)
+        last = np.append(first[1:], len(self.result)) - 1
+        self.resultTable.setRowCount(len(file_ids))
+        for row, (file_id, start, end) in enumerate(zip(file_ids, first, last)):
+            entry = self.files.get(file_id) or {"tag_id": "?", "path": "?"}
+            values = [entry["tag_id"], str(end - start + 1),
+                      time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(self.result["time"][start])),
+                      time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(self.result["time"][end])), entry["path"]]
+            for column, value in enumerate(values):
+                self.resultTable.setItem(row, column, QTableWidgetItem(value))
+
+        stats = self.index.last_query
+        self.summaryLabel.setText("%d fixes of %d log(s) from %d block(s) in %.1f ms" % (
+            len(self.result), len(file_ids), stats["blocks"], stats["seconds"] * 1000))
+        self.mapPushButton.setEnabled(len(self.result) > 0)
+
+    def show_on_map(self):
+        dialog = TrackViewerDialog(self)
+        for number, file_id in enumerate(np.unique(self.result["file_id"])):
+            fixes = self.result[self.result["file_id"] == file_id]
+            name = self.files[file_id]["tag_id"] if file_id in self.files else str(file_id)
+            dialog.track_loaded(Track(name, fixes["gps_long"], fixes["gps_lat"],
+                                      TrackViewerDialog.colors[number % len(TrackViewerDialog.colors)]))
+        dialog.exec()
+
+    def cleanup(self):
+        if self.index is not None:
+            self.index.close()
@@ -0,0 +1,334 @@
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from decoder import decode_bytes, time_of_day
+from log_store import valid_fixes
+from usb import file_tag_id
+
+''' Post-download processing of text logs: parse -> validate -> derive -> export. Stages are
+    generators passing structured arrays of at most CHUNK_BYTES of log text, so a worker holds
+    one chunk per stage whatever the log size. State crossing chunk boundaries (last accepted
+    fix, day count past midnight) lives in the stage objects. Files run in parallel on a
+    process pool, one file per task '''
+
+CHUNK_BYTES = 1 << 20
+EARTH_RADIUS = 6371008.8
+DAY = 86400.0
+# fixes implying faster ground speed from the last accepted fix are rejected [m/s]
+MAX_SPEED = 50.0
+# after this many rejected fixes in a row the last accepted fix is the wrong one
+MAX_REJECTED = 5
+FORMATS = ["csv", "gpx"]
+
+PROCESSED_DTYPE = np.dtype([
+    ("time", np.float64),           # seconds from midnight of the first day, continues past midnight
+    ("gps_long", np.float64),       # NaN when there is no valid fix
+    ("gps_lat", np.float64),
+    ("gps_alt", np.float32),        # [m]
+    ("baro_alt", np.float32),       # [m]
+    ("height", np.float32),         # barometric altitude above the altitude trigger [m]
+    ("speed", np.float32),          # ground speed from the previous fix [m/s]
+])
+CSV_FORMAT = ["%.2f", "%.6f", "%.6f", "%.1f", "%.2f", "%.2f", "%.2f"]
+
+
+def haversine(long0, lat0, long1, lat1):
+    long0, lat0, long1, lat1 = (np.radians(value) for value in (long0, lat0, long1, lat1))
+    a = np.sin((lat1 - lat0) / 2) ** 2 + np.cos(lat0) * np.cos(lat1) * np.sin((long1 - long0) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+''' Ground speed [m/s] between fixes, times are seconds of day and may wrap past midnight '''
+def ground_speed(t0, long0, lat0, t1, long1, lat1):
+    distance = haversine(long0, lat0, long1, lat1)
+    elapsed = np.mod(np.subtract(t1, t0), DAY)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(distance > 0, distance / elapsed, 0.0)
+
+
+''' Log text from start to end offset in chunks of about chunk_bytes ending at a line end '''
+def read_chunks(file_name, chunk_bytes=CHUNK_BYTES, start=0, end=None):
+    rest = b''
+    with open(file_name, 'rb') as f:
+        f.seek(start)
+        while True:
+            data = f.read(chunk_bytes if end is None else min(chunk_bytes, end - f.tell()))
+            if not data:
+                break
+            data = rest + data
+            cut = data.rfind(b'\n') + 1
+            rest = data[cut:]
+            if cut:
+                yield data[:cut]
+    if rest:
+        yield rest
+
+
+def parse(chunks):
+    for chunk in chunks:
+        records = decode_bytes(chunk)
+        if len(records):
+            yield records
+
+
+class Validator:
+    ''' Rejects fixes out of range or further from the last accepted fix than max_speed allows.
+        Records are kept for their barometric altitude, rejected fixes get NaN position '''
+    def __init__(self, max_speed=MAX_SPEED):
+        self.max_speed = max_speed
+        # time, long, lat of the last accepted fix
+        self.last = None
+        self.rejected = 0
+        self.fixes = 0
+        self.dropped = 0
+
+    def __call__(self, chunks):
+        for records in chunks:
+            long, lat = records["gps_long"], records["gps_lat"]
+            t = time_of_day(records["gps_time"])
+            valid = valid_fixes(records) & (np.abs(long) <= 180) & (np.abs(lat) <= 90) & np.isfinite(t)
+            index = np.flatnonzero(valid)
+            if len(index):
+                valid[index] = self.plausible(t[index], long[index], lat[index])
+            self.dropped += len(index) - int(valid.sum())
+            self.fixes += int(valid.sum())
+
+            records = records.copy()
+            for field in ("gps_long", "gps_lat", "gps_alt"):
+                records[field][~valid] = np.nan
+            yield records
+
+    def plausible(self, t, long, lat):
+        t0, long0, lat0 = self.last if self.last is not None else (t[0], long[0], lat[0])
+        keep = ground_speed(np.concatenate(([t0], t[:-1])), np.concatenate(([long0], long[:-1])),
+                            np.concatenate(([lat0], lat[:-1])), t, long, lat) <= self.max_speed
+        suspicious = np.flatnonzero(~keep)
+        if not len(suspicious):
+            self.last = (t[-1], long[-1], lat[-1])
+            self.rejected = 0
+            return keep
+
+        # fixes from the first suspicious one on are judged against the last accepted fix, runs
+        # that follow an accepted fix without a suspicious jump are skipped over
+        i = suspicious[0]
+        if i > 0:
+            self.last = (t[i - 1], long[i - 1], lat[i - 1])
+            self.rejected = 0
+        while i < len(t):
+            if self.last is None or self.rejected >= MAX_REJECTED or \
+                    ground_speed(*self.last, t[i], long[i], lat[i]) <= self.max_speed:
+                keep[i] = True
+                self.rejected = 0
+                following = np.searchsorted(suspicious, i, side='right')
+                if following == len(suspicious):
+                    self.last = (t[-1], long[-1], lat[-1])
+                    break
+                i = suspicious[following]
+                self.last = (t[i - 1], long[i - 1], lat[i - 1])
+            else:
+                keep[i] = False
+                self.rejected += 1
+                i += 1
+        return keep
+
+
+class Deriver:
+    ''' Output units as in the main window (baro altitude in m), continuous time, height above
+        the altitude trigger and ground speed to the previous fix '''
+    def __init__(self, altitude=0):
+        self.altitude = altitude
+        self.day = 0
+        self.last_time = None
+        # time, long, lat of the previous fix
+        self.last_fix = None
+
+    def __call__(self, chunks):
+        for records in chunks:
+            out = np.empty(len(records), dtype=PROCESSED_DTYPE)
+            for field in ("gps_long", "gps_lat", "gps_alt"):
+                out[field] = records[field]
+            out["baro_alt"] = records["baro_alt"] / 100.0
+            out["height"] = out["baro_alt"] - self.altitude
+            out["time"] = np.nan
+            out["speed"] = np.nan
+
+            fixes = np.isfinite(records["gps_long"])
+            # tag without a fix reports 000000
+            timed = np.flatnonzero(np.isfinite(records["gps_time"]) & ((records["gps_time"] > 0) | fixes))
+            if len(timed):
+                t = time_of_day(records["gps_time"][timed])
+                previous = np.concatenate(([self.last_time if self.last_time is not None else t[0]], t[:-1]))
+                days = self.day + np.cumsum(t < previous - DAY / 2)
+                out["time"][timed] = t + days * DAY
+                self.day = int(days[-1])
+                self.last_time = t[-1]
+
+            index = np.flatnonzero(fixes & np.isfinite(out["time"]))
+            if len(index):
+                t, long, lat = out["time"][index], out["gps_long"][index], out["gps_lat"][index]
+                if self.last_fix is not None:
+                    t0, long0, lat0 = (np.concatenate(([last], values[:-1])) for last, values in
+                                       zip(self.last_fix, (t, long, lat)))
+                    out["speed"][index] = ground_speed(t0, long0, lat0, t, long, lat)
+                else:
+                    out["speed"][index[1:]] = ground_speed(t[:-1], long[:-1], lat[:-1], t[1:], long[1:], lat[1:])
+                self.last_fix = (t[-1], long[-1], lat[-1])
+            yield out
+
+
+class CsvWriter:
+    def __init__(self, file_name):
+        self.f = open(file_name, 'w')
+        self.f.write(",".join(PROCESSED_DTYPE.names) + "\n")
+
+    def write(self, records):
+        np.savetxt(self.f, np.column_stack([records[field].astype(np.float64) for field in PROCESSED_DTYPE.names]),
+                   fmt=CSV_FORMAT, delimiter=",")
+
+    def close(self):
+        self.f.close()
+
+
+class GpxWriter:
+    ''' Track of valid fixes, GPS time of day is put on date, the day of the first record '''
+    def __init__(self, file_name, name, date):
+        self.date = np.datetime64(date, 'D')
+        self.f = open(file_name, 'w', encoding='utf-8')
+        self.f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                     '<gpx version="1.1" creator="bat_tracker" xmlns="http://www.topografix.com/GPX/1/1">\n'
+                     '<trk><name>%s</name><trkseg>\n' % name)
+
+    def write(self, records):
+        records = records[np.isfinite(records["gps_long"]) & np.isfinite(records["time"])]
+        if not len(records):
+            return
+        times = np.datetime_as_string(self.date + (records["time"] * 1000).astype('timedelta64[ms]'), unit='s')
+        self.f.write("".join('<trkpt lat="%.6f" lon="%.6f"><ele>%.1f</ele><time>%sZ</time></trkpt>\n' % point
+                             for point in zip(records["gps_lat"], records["gps_long"], records["gps_alt"], times)))
+
+    def close(self):
+        self.f.write('</trkseg></trk>\n</gpx>\n')
+        self.f.close()
+
+
+''' Export names of logs written into one directory. Logs of different tags kept in their own
+    directories often share a file name, so a name is the path relative to the common directory
+    of all logs, directories joined with _ '''
+def export_names(files):
+    stems = [os.path.splitext(os.path.abspath(file_name))[0] for file_name in files]
+    if len(stems) == 1:
+        return [os.path.basename(stems[0])]
+    common = os.path.commonpath([os.path.dirname(stem) for stem in stems])
+    return [os.path.relpath(stem, common).replace(os.sep, "_") for stem in stems]
+
+
+''' Export name of a log of a known tag, prefixed with the tag unless the file name starts with it '''
+def tagged_name(file_name, tag_id):
+    name = os.path.splitext(os.path.basename(file_name))[0]
+    tag_id = file_tag_id(tag_id)
+    if not tag_id or name.startswith(tag_id):
+        return name
+    return "%s_%s" % (tag_id, name)
+
+
+''' Runs the pipeline over one log, returns dict with records, fixes, rejected fixes and written files.
+    date is the day of the first record, day of file modification by default. Exports are named
+    name.csv / name.gpx, the log file name without extension by default '''
+def process_file(file_name, out_dir, formats=FORMATS, altitude=0, date=None, max_speed=MAX_SPEED,
+                 chunk_bytes=CHUNK_BYTES, name=None):
+    start_time = time.monotonic()
+    name = name or os.path.splitext(os.path.basename(file_name))[0]
+    date = date or time.strftime('%Y-%m-%d', time.gmtime(os.path.getmtime(file_name)))
+    outputs = {fmt: os.path.join(out_dir, "%s.%s" % (name, fmt)) for fmt in formats}
+
+    writers = []
+    try:
+        if "csv" in outputs:
+            writers.append(CsvWriter(outputs["csv"]))
+        if "gpx" in outputs:
+            writers.append(GpxWriter(outputs["gpx"], name, date))
+
+        validator = Validator(max_speed)
+        count = 0
+        for records in Deriver(altitude)(validator(parse(read_chunks(file_name, chunk_bytes)))):
+            count += len(records)
+            for writer in writers:
+                writer.write(records)
+    finally:
+        for writer in writers:
+            writer.close()
+
+    return {"file": file_name, "state": "done", "records": count, "fixes": validator.fixes,
+            "rejected": validator.dropped, "outputs": list(outputs.values()),
+            "seconds": time.monotonic() - start_time, "error": ""}
+
+
+''' Processes logs in parallel, workers = 0 uses all cores. Status dict of every file is
+    reported through status_callback as it finishes, results are returned in order of files.
+    Export names come from export_names unless given. mp_context is passed to the process pool,
+    callers with threads of their own (Qt) pass the spawn context, fork copies their locks '''
+def process_files(files, out_dir, formats=FORMATS, altitude=0, date=None, workers=0, status_callback=None,
+                  max_speed=MAX_SPEED, names=None, mp_context=None):
+    if not files:
+        return []
+    os.makedirs(out_dir, exist_ok=True)
+    names = names or export_names(files)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(files)),
+                             mp_context=mp_context) as pool:
+        futures = {pool.submit(process_file, file_name, out_dir, formats, altitude, date, max_speed, CHUNK_BYTES,
+                               name): file_name
+                   for file_name, name in zip(files, names)}
+        for future in as_completed(futures):
+            file_name = futures[future]
+            try:
+                status = future.result()
+            except Exception as e:
+                status = {"file": file_name, "state": "failed", "records": 0, "fixes": 0, "rejected": 0,
+                          "outputs": [], "seconds": 0.0, "error": str(e)}
+            results[file_name] = status
+            if status_callback is not None:
+                status_callback(dict(status))
+    return [results[file_name] for file_name in files]
+
+
+def print_status(status):
+    line = "%-40s %-7s" % (status["file"], status["state"])
+    if status["state"] == "done":
+        line += " %9d records %9d fixes %6d rejected %6.1f s" % (status["records"], status["fixes"],
+                                                                  status["rejected"], status["seconds"])
+    else:
+        line += " " + status["error"]
+    print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process downloaded logs in parallel: drop bad fixes, derive "
+                                                 "speed and height, export CSV / GPX")
+    parser.add_argument("files", nargs="+", help="text logs, wildcards are expanded")
+    parser.add_argument("-o", "--out-dir", default=".", help="directory for exported files")
+    parser.add_argument("-f", "--format", action="append", choices=FORMATS, help="output format, all by default")
+    parser.add_argument("-a", "--altitude", type=int, default=0, help="altitude trigger set on the tags [m]")
+    parser.add_argument("-d", "--date", help="date of the first record YYYY-MM-DD, file date by default")
+    parser.add_argument("-w", "--workers", type=int, default=0, help="parallel processes, 0 = one per core")
+    parser.add_argument("--max-speed", type=float, default=MAX_SPEED, help="fastest plausible flight [m/s]")
+    args = parser.parse_args(argv)
+
+    files = [file_name for pattern in args.files for file_name in (sorted(glob.glob(pattern)) or [pattern])]
+    start_time = time.monotonic()
+    results = process_files(files, args.out_dir, args.format or FORMATS, args.altitude, args.date, args.workers,
+                            print_status, args.max_speed)
+    failed = [status for status in results if status["state"] != "done"]
+    print("Processed %d/%d log(s) in %.1f s" % (len(results) - len(failed), len(results),
+                                                time.monotonic() - start_time))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
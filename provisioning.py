@@ -0,0 +1,194 @@
+import argparse
+import csv
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from harvest import discover_devices
+from usb import COMMANDS, UsbConnection, device_state_name, time_arg
+
+''' Fleet provisioning - clock, wake time and altitude trigger set on all attached tags at once,
+    one connection per tag in parallel. SET_CLOCK carries hour and minute only and the tag
+    starts the minute when the command arrives, so it is sent at a minute boundary ahead by
+    the link delay measured from STATE_DEVICE round trips. STATE_DEVICE read back afterwards
+    has to show an armed state '''
+
+# 4x states - WAIT_ALT_TRIGGER, or past the trigger already when provisioned above the altitude
+# (WAKE_UP_GPS, WAIT_FOR_GPS_FIX, LOG_MEAS_DATA)
+ARMED_STATES = (40, 41, 42, 43)
+# clock is sent at the first minute boundary at least this far ahead [s]
+CLOCK_MARGIN = 1.0
+# last part of waiting for the boundary is spent polling, sleep overshoots by a few ms
+SPIN_TIME = 0.005
+REPORT_FIELDS = ["port", "tag_id", "state", "rtt_ms", "rtt_spread_ms", "link_delay_ms", "clock", "clock_error_ms",
+                 "wake_time", "altitude", "device_state", "device_state_name", "seconds", "error"]
+
+
+class Profile(NamedTuple):
+    wake_hour: int
+    wake_minute: int
+    altitude: int           # altitude trigger [m]
+    clock: bool = True      # set clock to current time
+    utc: bool = False       # clock in UTC instead of local time
+
+
+''' One way delay [s] of a command of command_length bytes, from round trip of a request and
+    response of given lengths. Half of the round trip without transmission of both frames is
+    the link latency, transmission of the command itself is added back (10 bits per byte) '''
+def link_delay(rtt, request_length, response_length, command_length, baud_rate):
+    byte_time = 10.0 / baud_rate if baud_rate else 0.0
+    latency = max(0.0, rtt - (request_length + response_length) * byte_time) / 2
+    return latency + command_length * byte_time
+
+
+''' Sleeps until perf_counter() reaches deadline '''
+def wait_until(deadline):
+    remaining = deadline - time.perf_counter()
+    if remaining > SPIN_TIME:
+        time.sleep(remaining - SPIN_TIME)
+    while time.perf_counter() < deadline:
+        # lets other provisioning threads run
+        time.sleep(0)
+
+
+''' Sends SET_CLOCK so that it arrives at the next minute boundary at least margin ahead.
+    Returns the clock set and the error of the send time against the plan [s] '''
+def set_clock_on_boundary(usb_com, delay, utc=False, margin=CLOCK_MARGIN):
+    now = time.time()
+    boundary = math.ceil((now + margin + delay) / 60.0) * 60.0
+    deadline = time.perf_counter() + (boundary - now) - delay
+    clock = time.gmtime(boundary) if utc else time.localtime(boundary)
+
+    wait_until(deadline)
+    sent = time.perf_counter()
+    usb_com.set_clock(clock.tm_hour, clock.tm_min)
+    return (clock.tm_hour, clock.tm_min), sent - deadline
+
+
+''' Provisions tag on port with profile. Status dicts are reported through status_callback as the
+    tag moves through connecting -> measuring -> clock -> configuring -> verifying -> done / failed '''
+def provision_device(port, baud_rate, profile, status_callback=None, rtt_samples=5, retries=1):
+    status = {"port": port, "tag_id": "", "state": "connecting", "rtt_ms": 0.0, "rtt_spread_ms": 0.0,
+              "link_delay_ms": 0.0, "clock": "", "clock_error_ms": 0.0,
+              "wake_time": "%02d:%02d" % (profile.wake_hour, profile.wake_minute), "altitude": profile.altitude,
+              "device_state": 0, "device_state_name": "", "seconds": 0.0, "error": ""}
+
+    def report(**kwargs):
+        status.update(kwargs)
+        if status_callback is not None:
+            status_callback(dict(status))
+
+    start_time = time.monotonic()
+    usb_com = UsbConnection(port, baud_rate)
+    try:
+        report()
+        usb_com.connect()
+
+        report(tag_id=usb_com.read_tag_id(), state="measuring")
+
+        rtts, request_length, response_length = usb_com.measure_rtt(rtt_samples)
+        command_length = len(usb_com.starting_char + COMMANDS["SET_CLOCK"] + time_arg(0, 0) +
+                             usb_com.termination_char)
+        delay = link_delay(min(rtts), request_length, response_length, command_length, usb_com.baud_rate)
+        report(rtt_ms=min(rtts) * 1000, rtt_spread_ms=(max(rtts) - min(rtts)) * 1000, link_delay_ms=delay * 1000)
+
+        if profile.clock:
+            report(state="clock")
+            clock, error = set_clock_on_boundary(usb_com, delay, profile.utc)
+            report(clock="%02d:%02d" % clock, clock_error_ms=error * 1000)
+
+        for attempt in range(retries + 1):
+            report(state="configuring")
+            # no response to these, state read back confirms them
+            usb_com.set_time(profile.wake_hour, profile.wake_minute)
+            usb_com.set_altitude(profile.altitude)
+
+            report(state="verifying")
+            gps, baro, state, gps_fix = usb_com.get_device_state()
+            report(device_state=state, device_state_name=device_state_name(state))
+            if state in ARMED_STATES:
+                break
+        else:
+            raise Exception("Device is in %s instead of an armed state!" % (device_state_name(state) or state))
+
+        usb_com.disconnect()
+    except Exception as e:
+        if usb_com.is_open():
+            usb_com.ser.close()
+        report(state="failed", error=str(e), seconds=time.monotonic() - start_time)
+    else:
+        report(state="done", seconds=time.monotonic() - start_time)
+
+    return status
+
+
+''' Provisions all tags in parallel, one UsbConnection per port '''
+def provision(ports, baud_rate, profile, workers=0, status_callback=None):
+    if not ports:
+        return []
+
+    with ThreadPoolExecutor(max_workers=workers or len(ports)) as pool:
+        futures = [pool.submit(provision_device, port, baud_rate, profile, status_callback) for port in ports]
+        return [future.result() for future in futures]
+
+
+def write_report(results, file_name):
+    with open(file_name, 'w', newline='') as f:
+        writer = csv.DictWriter(f, REPORT_FIELDS)
+        writer.writeheader()
+        for status in results:
+            writer.writerow({field: round(value, 3) if isinstance(value, float) else value
+                             for field, value in status.items()})
+
+
+def report_file_name(out_dir):
+    return os.path.join(out_dir, "provisioning_%s.csv" % time.strftime('%Y%m%d_%H%M%S'))
+
+
+def print_status(status):
+    if status["state"] not in ("done", "failed"):
+        return
+    line = "%-14s %-16s %-7s" % (status["port"], status["tag_id"], status["state"])
+    if status["state"] == "done":
+        line += " rtt %6.1f ms  clock %s (%+.1f ms)  %s" % (status["rtt_ms"], status["clock"] or "-",
+                                                           status["clock_error_ms"], status["device_state_name"])
+    else:
+        line += " " + status["error"]
+    print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Set clock, wake time and altitude trigger on all attached tags")
+    parser.add_argument("ports", nargs="*", help="serial ports, attached tags are discovered when omitted")
+    parser.add_argument("-t", "--wake", required=True, help="wake up time HH:MM")
+    parser.add_argument("-a", "--altitude", type=int, required=True, help="altitude trigger [m]")
+    parser.add_argument("-b", "--baud", type=int, default=115200)
+    parser.add_argument("-w", "--workers", type=int, default=0, help="parallel connections, 0 = one per port")
+    parser.add_argument("--no-clock", action="store_true", help="do not set device clock")
+    parser.add_argument("--utc", action="store_true", help="set clock to UTC instead of local time")
+    parser.add_argument("-r", "--report", help="CSV report file, provisioning_<time>.csv by default")
+    args = parser.parse_args(argv)
+
+    hour, minute = (int(value) for value in args.wake.split(':'))
+    profile = Profile(hour, minute, args.altitude, not args.no_clock, args.utc)
+
+    ports = discover_devices(args.baud, args.ports or None)
+    if not ports:
+        print("No device found!")
+        return 1
+    print("Found %d device(s): %s" % (len(ports), ", ".join(ports)))
+
+    start_time = time.monotonic()
+    results = provision(ports, args.baud, profile, args.workers, print_status)
+    report = args.report or report_file_name(".")
+    write_report(results, report)
+    failed = [status for status in results if status["state"] != "done"]
+    print("Provisioned %d/%d device(s) in %.1f s, report %s" % (len(results) - len(failed), len(results),
+                                                              time.monotonic() - start_time, report))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,104 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+''' Device command scheduler. One owner thread per connection runs device calls one at a time,
+    so callers never share the serial port and never block on it unless they wait for the
+    returned future themselves '''
+
+# lower runs first - user commands, then status polls, then long transfers
+PRIORITY_USER = 0
+PRIORITY_STATUS = 1
+PRIORITY_BULK = 2
+
+
+class Job:
+    __slots__ = ("fn", "args", "kwargs", "key", "future", "submit_time")
+
+    def __init__(self, fn, args, kwargs, key):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.future = Future()
+        self.submit_time = time.perf_counter()
+
+
+class DeviceScheduler:
+    def __init__(self, name="device", instrumentation=None):
+        self.instrumentation = instrumentation
+        self.condition = threading.Condition()
+        self.queue = []
+        self.counter = itertools.count()
+        # waiting jobs by coalescing key
+        self.pending = {}
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    ''' Queues fn(*args, **kwargs) and returns its Future. Job submitted with a key while another
+        job with the same key still waits is not queued, the waiting job's future is returned, so
+        repeated status polls behind a long transfer collapse into one '''
+    def submit(self, fn, *args, priority=PRIORITY_USER, key=None, **kwargs):
+        with self.condition:
+            if not self.running:
+                raise Exception("Device scheduler is stopped!")
+            # cancelled job is skipped when its turn comes, it is not joined
+            if key is not None and key in self.pending and not self.pending[key].future.cancelled():
+                return self.pending[key].future
+            job = Job(fn, args, kwargs, key)
+            heapq.heappush(self.queue, (priority, next(self.counter), job))
+            if key is not None:
+                self.pending[key] = job
+            self.condition.notify()
+        return job.future
+
+    ''' Blocking call for threads other than the UI thread. Job still waiting in the queue when
+        timeout runs out is cancelled, TimeoutError is raised either way '''
+    def call(self, fn, *args, priority=PRIORITY_USER, key=None, timeout=None, **kwargs):
+        future = self.submit(fn, *args, priority=priority, key=key, **kwargs)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                priority, order, job = heapq.heappop(self.queue)
+                if job.key is not None and self.pending.get(job.key) is job:
+                    del self.pending[job.key]
+
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            if self.instrumentation is not None and self.instrumentation.enabled:
+                self.instrumentation.record_wait("queue", job.submit_time, time.perf_counter())
+            try:
+                result = job.fn(*job.args, **job.kwargs)
+            except BaseException as e:
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(result)
+
+    def queued(self):
+        with self.condition:
+            return len(self.queue)
+
+    ''' Cancels waiting jobs, running job is let finish '''
+    def stop(self, timeout=None):
+        with self.condition:
+            self.running = False
+            for priority, order, job in self.queue:
+                job.future.cancel()
+            self.queue = []
+            self.pending = {}
+            self.condition.notify()
+        if threading.current_thread() is not self.thread:
+            self.thread.join(timeout)
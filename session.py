@@ -0,0 +1,267 @@
+import argparse
+import bisect
+import json
+import struct
+import threading
+import time
+
+import numpy as np
+
+from telemetry import SAMPLE_DTYPE, sensor_sample
+
+''' Session recording and replay. SessionRecorder is set as UsbConnection.recorder and gets every
+    write to the port, every read from it and every decoded READ_SENSOR_DATA sample, stamped
+    with monotonic time from the start of the session. Records are only appended to a list on
+    the caller's thread, a background thread writes them in batches. ReplaySerial stands in for
+    the serial port (port name replay:<file>) and answers commands with the recorded responses.
+    File is MAGIC, u32 length and JSON metadata, then records <time:f64><kind:u8><length:u32><data> '''
+
+MAGIC = b'BATSESS1'
+RECORD = struct.Struct('<dBI')
+
+TX = 1
+RX = 2
+SAMPLE = 3
+
+
+class SessionRecorder:
+    ''' Write-behind recorder. Batches are written every flush_interval or once batch_size records
+        are pending, whichever is first. Records beyond max_pending are dropped and counted,
+        recording never blocks the caller '''
+    def __init__(self, file_name, metadata=None, flush_interval=0.5, batch_size=4096, max_pending=1000000):
+        self.file_name = file_name
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.start_time = time.monotonic()
+        self.records = 0
+        self.dropped = 0
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = False
+
+        header = json.dumps(dict(metadata or {}, start=time.time())).encode('utf-8')
+        self.f = open(file_name, 'wb')
+        self.f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        self.thread = threading.Thread(target=self.run, name="session-recorder", daemon=True)
+        self.thread.start()
+
+    def record(self, kind, data):
+        t = time.monotonic() - self.start_time
+        with self.lock:
+            if len(self.pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self.pending.append((t, kind, bytes(data)))
+            if len(self.pending) >= self.batch_size:
+                self.wake.set()
+
+    def sent(self, data):
+        self.record(TX, data)
+
+    def received(self, data):
+        self.record(RX, data)
+
+    def sample(self, sensor_data):
+        self.record(SAMPLE, ",".join(sensor_data).encode('ascii', 'replace'))
+
+    def run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            with self.lock:
+                batch, self.pending = self.pending, []
+                stopped = self.stopped
+            if batch:
+                self.f.write(b''.join(RECORD.pack(t, kind, len(data)) + data for t, kind, data in batch))
+                self.f.flush()
+                self.records += len(batch)
+            if stopped:
+                break
+
+    ''' Writes what is pending and closes the file '''
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+        self.wake.set()
+        self.thread.join()
+        self.f.close()
+
+
+''' Metadata and list of (time, kind, data) records of a session file '''
+def read_session(file_name):
+    with open(file_name, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise Exception("Not a session recording!")
+    length, = struct.unpack_from('<I', data, len(MAGIC))
+    index = len(MAGIC) + 4 + length
+    metadata = json.loads(data[len(MAGIC) + 4:index].decode('utf-8'))
+
+    records = []
+    # last record may be cut off when recording was not stopped
+    while index + RECORD.size <= len(data):
+        t, kind, length = RECORD.unpack_from(data, index)
+        index += RECORD.size
+        if index + length > len(data):
+            break
+        records.append((t, kind, data[index:index + length]))
+        index += length
+    return metadata, records
+
+
+''' Recorded samples as telemetry SAMPLE_DTYPE array, t is session time '''
+def session_samples(records):
+    samples = [sensor_sample(data.decode('ascii').split(','), t) for t, kind, data in records if kind == SAMPLE]
+    return np.array(samples, dtype=SAMPLE_DTYPE)
+
+
+class ReplaySerial:
+    ''' Replays a recorded session in place of serial.Serial. A command written to the port is
+        looked up among recorded writes of the same bytes and bytes read after that write in
+        the recording are returned, each after its recorded delay divided by speed.
+        speed > 0 - session time runs speed times faster than real time from the first write,
+                    the latest recorded write of the command at that time is answered, so
+                    sensor data and state change as they did in the session
+        speed 0   - deterministic, writes are matched in recorded order and answered at once.
+        Commands never recorded get no answer and time out like a silent device '''
+    def __init__(self, file_name, speed=1.0, timeout=2):
+        self.metadata, records = read_session(file_name)
+        self.speed = speed
+        self.timeout = timeout
+        self.baudrate = self.metadata.get("baud", 0)
+        self.is_open = True
+
+        # recorded writes by their bytes, with times and bytes read until the next write
+        self.writes = []
+        self.times = {}
+        for t, kind, data in records:
+            if kind == TX:
+                self.times.setdefault(data, []).append(len(self.writes))
+                self.writes.append((t, data, []))
+            elif kind == RX and self.writes:
+                self.writes[-1][2].append((t, data))
+        self.write_times = {data: [self.writes[i][0] for i in indices] for data, indices in self.times.items()}
+
+        self.cursor = 0
+        self.start_time = None
+        # (due time, data) not delivered yet, received bytes not read yet
+        self.scheduled = []
+        self.buffer = bytearray()
+
+    def isOpen(self):
+        return self.is_open
+
+    def close(self):
+        self.is_open = False
+
+    def flush(self):
+        pass
+
+    def fileno(self):
+        raise AttributeError("Replayed session has no file descriptor")
+
+    def reset_input_buffer(self):
+        self.scheduled = []
+        self.buffer.clear()
+
+    def find_write(self, data):
+        indices = self.times.get(data)
+        if not indices:
+            return None
+        if not self.speed:
+            position = bisect.bisect_left(indices, self.cursor)
+            if position == len(indices):
+                return None
+            self.cursor = indices[position] + 1
+            return indices[position]
+        # latest recorded write of these bytes at current session time
+        session_time = (time.monotonic() - self.start_time) * self.speed + self.writes[0][0]
+        position = bisect.bisect_right(self.write_times[data], session_time)
+        return indices[max(0, position - 1)]
+
+    def write(self, data):
+        if not self.is_open:
+            raise Exception("Port is closed!")
+        now = time.monotonic()
+        if self.start_time is None:
+            self.start_time = now
+        index = self.find_write(bytes(data))
+        if index is not None:
+            write_time, written, reads = self.writes[index]
+            for t, read in reads:
+                self.scheduled.append((now + (t - write_time) / self.speed if self.speed else now, read))
+            self.scheduled.sort(key=lambda item: item[0])
+        return len(data)
+
+    def deliver(self):
+        now = time.monotonic()
+        while self.scheduled and self.scheduled[0][0] <= now:
+            self.buffer += self.scheduled.pop(0)[1]
+
+    @property
+    def in_waiting(self):
+        self.deliver()
+        return len(self.buffer)
+
+    ''' Waits until done() holds for the buffer or timeout passes '''
+    def wait(self, done):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        self.deliver()
+        while not done():
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return
+            next_time = self.scheduled[0][0] if self.scheduled else None
+            if next_time is None or (deadline is not None and next_time > deadline):
+                if deadline is None:
+                    raise Exception("Replayed session has no more data!")
+                time.sleep(deadline - now)
+                return
+            time.sleep(max(0.0, next_time - now))
+            self.deliver()
+
+    def take(self, size):
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def read(self, size=1):
+        self.wait(lambda: len(self.buffer) >= size)
+        return self.take(size)
+
+    def read_until(self, expected=b'\n', size=None):
+        def found():
+            return self.buffer.find(expected) >= 0 or (size is not None and len(self.buffer) >= size)
+        self.wait(found)
+        end = self.buffer.find(expected)
+        return self.take(end + len(expected) if end >= 0 else len(self.buffer) if size is None else size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show recorded session, export its sensor samples")
+    parser.add_argument("file")
+    parser.add_argument("--csv", help="write sensor samples to this file")
+    args = parser.parse_args(argv)
+
+    metadata, records = read_session(args.file)
+    print("start     %s" % time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(metadata.get("start", 0))))
+    for key, value in metadata.items():
+        if key != "start":
+            print("%-9s %s" % (key, value))
+    print("duration  %.1f s" % (records[-1][0] if records else 0.0))
+    for name, kind in (("writes", TX), ("reads", RX), ("samples", SAMPLE)):
+        selected = [data for t, k, data in records if k == kind]
+        print("%-9s %d (%d B)" % (name, len(selected), sum(len(data) for data in selected)))
+
+    if args.csv:
+        samples = session_samples(records)
+        np.savetxt(args.csv, np.column_stack([samples[field] for field in SAMPLE_DTYPE.names]),
+                   fmt=["%.3f", "%.2f", "%.6f", "%.6f", "%.1f"], delimiter=",", header=",".join(SAMPLE_DTYPE.names),
+                   comments="")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,300 @@
+import argparse
+import os
+import queue
+import random
+import threading
+import time
+import tty
+import zlib
+
+import binary_dump
+from usb import COMMANDS
+
+''' Software stand-in for the tag firmware. It serves the whole UsbConnection command table on
+    the slave side of a pty pair, so UsbConnection can connect to simulator.port like to a real
+    /dev/ttyUSB<n>. Link speed, log size and faults are configurable '''
+
+CODES = {code: name for name, code in COMMANDS.items()}
+
+
+class Faults:
+    ''' drop     - probability that a response is not sent at all (host times out)
+        corrupt  - probability that one byte of a response or memory block is flipped
+        delay    - link latency added to every response [s], pipelined requests overlap it
+        stall_at - READ_MEMORY dump stops after this many bytes, 0 = never '''
+    def __init__(self, drop=0.0, corrupt=0.0, delay=0.0, stall_at=0, seed=0):
+        self.drop = drop
+        self.corrupt = corrupt
+        self.delay = delay
+        self.stall_at = stall_at
+        self.random = random.Random(seed)
+
+    def dropped(self):
+        return self.drop > 0 and self.random.random() < self.drop
+
+    def apply(self, data):
+        if self.corrupt > 0 and len(data) > 2 and self.random.random() < self.corrupt:
+            index = self.random.randrange(1, len(data) - 1)
+            data = data[:index] + bytes([data[index] ^ 0x55]) + data[index + 1:]
+        return data
+
+
+def synthetic_log(size, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    length = 0
+    long, lat, alt = 17.107748, 48.148598, 300.0
+    t = 0
+    while length < size:
+        long += rng.gauss(0, 1e-4)
+        lat += rng.gauss(0, 1e-4)
+        alt += rng.gauss(0, 0.5)
+        t += 2
+        gps_time = (t // 3600 % 24) * 10000 + (t // 60 % 60) * 100 + t % 60
+        line = "%d,%.6f,%.6f,%.1f,%06d,%d,%06d\n" % (alt * 100 + rng.gauss(0, 50), long, lat, alt, gps_time,
+                                                   rng.randint(1, 30), gps_time)
+        lines.append(line)
+        length += len(line)
+    return "".join(lines).encode('utf-8')
+
+
+class DeviceSimulator:
+    def __init__(self, log_size=64 * 1024, baud_rate=0, tag_id="SIM0001", erase_time=1.0, faults=None,
+                 memory=None, capacity=16 * 1024 * 1024, max_baud=921600, baud_revert_time=3.0, binary=True):
+        self.memory = synthetic_log(log_size) if memory is None else memory
+        self.capacity = capacity
+        # 0 = as fast as the pty goes, otherwise 10 bits per byte like 8N1 UART
+        self.baud_rate = baud_rate
+        # UART rate set by SET_BAUD, rates above max_baud garble the link like an overdriven bridge
+        self.link_baud = baud_rate or 115200
+        self.max_baud = max_baud
+        self.baud_revert_time = baud_revert_time
+        self.baud_revert = None
+        self.tag_id = tag_id
+        # False acts as old firmware without READ_MEMORY_BINARY
+        self.binary = binary
+        self.erase_time = erase_time
+        self.faults = faults or Faults()
+        self.state = 1
+        self.wake_time = None
+        self.clock = None
+        self.altitude = None
+        self.commands = []
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.running = False
+        self.thread = None
+        self.writer_thread = None
+        self.outbox = queue.Queue()
+
+    def start(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.writer_thread = threading.Thread(target=self.run_writer, daemon=True)
+        self.writer_thread.start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+        self.outbox.put((0, None))
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def run(self):
+        buffer = b''
+        while self.running:
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                break
+            if self.link_baud > self.max_baud:
+                continue
+            buffer += data
+            while b'#' in buffer:
+                frame, buffer = buffer.split(b'#', 1)
+                start = frame.rfind(b'$')
+                if start != -1:
+                    self.handle(frame[start + 1:].decode('utf-8', 'replace'))
+
+    ''' Sends queued responses once their latency has passed '''
+    def run_writer(self):
+        while self.running:
+            due_time, data = self.outbox.get()
+            if data is None:
+                break
+            time.sleep(max(0.0, due_time - time.monotonic()))
+            if callable(data):
+                data()
+                continue
+            try:
+                self.write(data)
+            except OSError:
+                break
+
+    def write(self, data):
+        if self.link_baud > self.max_baud:
+            data = bytes(self.faults.random.getrandbits(8) for i in range(len(data)))
+        if not self.baud_rate:
+            os.write(self.master, data)
+            return
+        # pace output in 10 ms slices to emulate link speed
+        bytes_per_slice = max(1, self.baud_rate // 10 // 100)
+        next_time = time.monotonic()
+        for index in range(0, len(data), bytes_per_slice):
+            chunk = data[index:index + bytes_per_slice]
+            os.write(self.master, chunk)
+            next_time += len(chunk) / (self.baud_rate / 10)
+            time.sleep(max(0.0, next_time - time.monotonic()))
+
+    def respond(self, data):
+        if self.faults.dropped():
+            return
+        self.outbox.put((time.monotonic() + self.faults.delay, self.faults.apply(data)))
+
+    def frame(self, payload):
+        return b'$' + payload.encode('utf-8') + b'#'
+
+    def handle(self, frame):
+        code, args = frame[:2], frame[2:]
+        name = CODES.get(code)
+        self.commands.append(name)
+        handler = getattr(self, "cmd_" + name.lower(), None) if name else None
+        if handler is not None:
+            try:
+                handler(args)
+            except (ValueError, OSError) as e:
+                print(e)
+
+    def cmd_connection_response(self, args):
+        self.respond(b'$BAT_GPS#')
+
+    def cmd_erase_memory(self, args):
+        time.sleep(self.erase_time)
+        self.memory = b''
+        self.respond(self.frame("OK"))
+
+    def cmd_read_memory(self, args):
+        data = b'$' + self.memory + b'#$EOF_LOG#'
+        if self.faults.stall_at:
+            data = data[:self.faults.stall_at]
+        self.respond(data)
+
+    def cmd_read_memory_binary(self, args):
+        if not self.binary:
+            return
+        mode = int(args or binary_dump.MODE_DELTA)
+        if mode not in (binary_dump.MODE_PACKED, binary_dump.MODE_DELTA):
+            self.respond(self.frame("ERR"))
+            return
+        self.respond(self.frame("BIN%d" % mode) + binary_dump.encode(self.memory, mode))
+
+    def cmd_state_memory(self, args):
+        used = min(10000, len(self.memory) * 10000 // self.capacity)
+        self.respond(self.frame("%d,%d" % (used, 1 if used < 10000 else 0)))
+
+    def cmd_set_time(self, args):
+        self.wake_time = (int(args[:2]), int(args[2:4]))
+        if self.state == 1:
+            self.state = 2
+
+    def cmd_set_altitude(self, args):
+        self.altitude = int(args)
+        if self.state == 2:
+            self.state = 40
+
+    def cmd_state_device(self, args):
+        # baro, gps, state, gps fix ('3' = 3D fix)
+        self.respond(self.frame("1,1,%d,%d" % (self.state, ord('3'))))
+
+    def cmd_disconnect(self, args):
+        self.respond(self.frame("OK"))
+
+    def cmd_set_clock(self, args):
+        self.clock = (int(args[:2]), int(args[2:4]), time.time())
+
+    def cmd_read_sensor_data(self, args):
+        t = time.time()
+        alt = 300 + 5 * ((t / 10) % 1)
+        gps_time = time.strftime("%H%M%S", time.gmtime(t))
+        self.respond(self.frame("%d,%.6f,%.6f,%.1f,%s,%d,%s" % (alt * 100, 17.107748, 48.148598, alt, gps_time,
+                                                                 12, gps_time)))
+
+    def cmd_read_memory_range(self, args):
+        offset, length = int(args[:10]), int(args[10:15])
+        data = self.memory[offset:offset + length]
+        header = self.frame("%d,%d,%d,%08x" % (offset, len(data), len(self.memory), zlib.crc32(data)))
+        self.respond(header + data)
+
+    def cmd_read_tag_id(self, args):
+        self.respond(self.frame(self.tag_id))
+
+    def cmd_set_baud(self, args):
+        baud = int(args)
+        if baud == self.link_baud:
+            # repeated at new rate - commit
+            if self.baud_revert is not None:
+                self.baud_revert.cancel()
+                self.baud_revert = None
+            self.respond(self.frame("OK"))
+            return
+        if baud < 9600:
+            self.respond(self.frame("ERR"))
+            return
+
+        previous = self.link_baud
+        self.respond(self.frame("OK"))
+        # switch once OK has left at the old rate
+        self.outbox.put((time.monotonic() + self.faults.delay, lambda: self.switch_baud(baud, previous)))
+
+    def switch_baud(self, baud, previous):
+        self.link_baud = baud
+        if self.baud_rate:
+            self.baud_rate = baud
+        self.baud_revert = threading.Timer(self.baud_revert_time, self.switch_baud_back, (previous,))
+        self.baud_revert.daemon = True
+        self.baud_revert.start()
+
+    def switch_baud_back(self, previous):
+        self.baud_revert = None
+        self.link_baud = previous
+        if self.baud_rate:
+            self.baud_rate = previous
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bat GPS tag firmware simulator on a pty")
+    parser.add_argument("--log-size", type=int, default=1024 * 1024, help="size of logged data [B]")
+    parser.add_argument("--baud", type=int, default=0, help="emulated link speed, 0 = unpaced")
+    parser.add_argument("--tag-id", default="SIM0001")
+    parser.add_argument("--erase-time", type=float, default=1.0, help="duration of ERASE_MEMORY [s]")
+    parser.add_argument("--drop", type=float, default=0.0, help="probability of dropped response")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="probability of corrupted response")
+    parser.add_argument("--delay", type=float, default=0.0, help="extra response latency [s]")
+    parser.add_argument("--stall-at", type=int, default=0, help="stop memory dump after this many bytes")
+    parser.add_argument("--max-baud", type=int, default=921600, help="fastest rate of the emulated UART bridge")
+    parser.add_argument("--text-only", action="store_true", help="act as old firmware without binary dump")
+    args = parser.parse_args(argv)
+
+    simulator = DeviceSimulator(args.log_size, args.baud, args.tag_id, args.erase_time,
+                                Faults(args.drop, args.corrupt, args.delay, args.stall_at), max_baud=args.max_baud,
+                                binary=not args.text_only)
+    # first line is read by benchmarks to find the port
+    print(simulator.start(), flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import threading
+import time
+from concurrent.futures import Future
+
+''' Device status cache. Status younger than ttl is answered without touching the link and
+    requests arriving while a query is in flight share its result, so the UI can poll at any
+    rate and the device sees at most one status query per ttl '''
+
+
+class StatusCache:
+    def __init__(self, fetch, ttl=1.0, submit=None):
+        self.fetch = fetch
+        self.ttl = ttl
+        # submit(fn) -> Future, e.g. DeviceScheduler.submit, fetch runs on the calling thread by default
+        self.submit = submit or run_now
+        self.lock = threading.Lock()
+        self.value = None
+        self.time = 0.0
+        self.in_flight = None
+        # bumped by invalidate(), result of a query started before is not cached
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    ''' Future of status at most max_age [s] old, ttl by default, 0 forces a new query '''
+    def request(self, max_age=None):
+        max_age = self.ttl if max_age is None else max_age
+        with self.lock:
+            if self.value is not None and time.monotonic() - self.time < max_age:
+                self.hits += 1
+                future = Future()
+                future.set_result(self.value)
+                return future
+            if self.in_flight is not None:
+                self.hits += 1
+                return self.in_flight
+            self.misses += 1
+            future = self.in_flight = Future()
+            generation = self.generation
+
+        try:
+            source = self.submit(self.fetch)
+        except Exception as e:
+            source = Future()
+            source.set_exception(e)
+        source.add_done_callback(lambda source: self.fetched(future, source, generation))
+        return future
+
+    def get(self, max_age=None):
+        return self.request(max_age).result()
+
+    def fetched(self, future, source, generation):
+        with self.lock:
+            if self.in_flight is future:
+                self.in_flight = None
+            if not source.cancelled() and source.exception() is None and generation == self.generation:
+                self.value = source.result()
+                self.time = time.monotonic()
+
+        if source.cancelled():
+            future.cancel()
+        elif source.exception() is not None:
+            future.set_exception(source.exception())
+        else:
+            future.set_result(source.result())
+
+    def store(self, value):
+        with self.lock:
+            self.value = value
+            self.time = time.monotonic()
+
+    ''' Drops cached status, called after commands that change device state '''
+    def invalidate(self):
+        with self.lock:
+            self.value = None
+            self.generation += 1
+            self.in_flight = None
+
+
+def run_now(fn):
+    future = Future()
+    try:
+        future.set_result(fn())
+    except Exception as e:
+        future.set_exception(e)
+    return future
@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+import time
+import zlib
+
+from usb import file_tag_id
+
+''' Incremental download into a local archive. Every tag has its archive file <tag>.txt and the
+    device memory offset archived so far in sync.json, a sync fetches only memory past that
+    offset with READ_MEMORY_RANGE and appends it. Last archived bytes are compared with the
+    device before appending, memory erased or rewritten meanwhile is archived from its start.
+    Archive is synced to disk and the state written every usb_com.journal_interval blocks '''
+
+STATE_NAME = "sync.json"
+# bytes before archived offset compared with device memory
+TAIL_CHECK = 256
+
+state_lock = threading.Lock()
+
+
+def archive_file_name(archive_dir, tag_id):
+    return os.path.join(archive_dir, "%s.txt" % file_tag_id(tag_id))
+
+
+def read_state(archive_dir):
+    path = os.path.join(archive_dir, STATE_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def update_state(archive_dir, tag_id, entry):
+    with state_lock:
+        state = read_state(archive_dir)
+        if entry is None:
+            state.pop(tag_id, None)
+        else:
+            state[tag_id] = entry
+        tmp_path = os.path.join(archive_dir, STATE_NAME + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(archive_dir, STATE_NAME))
+
+
+def tail_matches(usb_com, offset, tail_crc):
+    length = min(offset, TAIL_CHECK)
+    data, total = usb_com.read_memory_block_retry(offset - length, length)
+    return len(data) == length and zlib.crc32(data) == tail_crc
+
+
+''' State entry of an archive without one, e.g. sync.json deleted or archive copied from another
+    machine. Archive is taken for device memory up to its size when its end matches the memory
+    there, otherwise it is refused - appending memory from its start would duplicate it '''
+def recover_entry(usb_com, file_name, archived):
+    length = min(archived, TAIL_CHECK)
+    with open(file_name, 'rb') as f:
+        f.seek(archived - length)
+        tail_crc = zlib.crc32(f.read(length))
+    if not tail_matches(usb_com, archived, tail_crc):
+        raise Exception("%s has no sync state and does not match device memory, move it away to sync "
+                        "again!" % file_name)
+    return {"offset": archived, "archived": archived, "tail_crc": tail_crc,
+            "time": time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+''' Appends memory not archived yet to the archive of tag_id. Returns dict with archive file,
+    new bytes, archived device offset, device memory size and whether everything is archived '''
+def sync_device(usb_com, archive_dir, tag_id, progress_callback=None):
+    os.makedirs(archive_dir, exist_ok=True)
+    file_name = archive_file_name(archive_dir, tag_id)
+    entry = read_state(archive_dir).get(tag_id)
+    archived = os.path.getsize(file_name) if os.path.exists(file_name) else 0
+    if entry is None and archived > 0:
+        entry = recover_entry(usb_com, file_name, archived)
+        update_state(archive_dir, tag_id, entry)
+
+    offset = 0
+    if entry is not None and entry["archived"] <= archived:
+        offset = entry["offset"]
+        # archive file is cut back to what the state says was synced, e.g. after a crash mid block
+        archived = entry["archived"]
+        if offset > 0 and not tail_matches(usb_com, offset, entry["tail_crc"]):
+            offset = 0
+            entry.update({"offset": 0, "tail_crc": 0})
+            update_state(archive_dir, tag_id, entry)
+
+    received = 0
+    total = offset
+    tail = b''
+    blocks = 0
+    start_time = time.monotonic()
+    last_report = start_time
+
+    def save(f):
+        f.flush()
+        os.fsync(f.fileno())
+        update_state(archive_dir, tag_id, {"offset": offset, "archived": archived, "tail_crc": zlib.crc32(tail),
+                                           "time": time.strftime('%Y-%m-%d %H:%M:%S')})
+
+    with open(file_name, 'r+b' if os.path.exists(file_name) else 'wb') as f:
+        f.truncate(archived)
+        # tail check of the next sync covers device bytes only
+        if offset > 0:
+            f.seek(archived - min(offset, TAIL_CHECK))
+            tail = f.read(min(offset, TAIL_CHECK))
+        f.seek(archived)
+        try:
+            while True:
+                data, total = usb_com.read_memory_block_retry(offset, usb_com.block_size)
+                if not data:
+                    break
+
+                f.write(data)
+                offset += len(data)
+                archived += len(data)
+                received += len(data)
+                tail = (tail + data)[-TAIL_CHECK:]
+                blocks += 1
+                if blocks % usb_com.journal_interval == 0:
+                    save(f)
+
+                now = time.monotonic()
+                if progress_callback is not None and now - last_report >= usb_com.progress_interval:
+                    last_report = now
+                    progress_callback(received, received / (now - start_time))
+
+                if offset >= total:
+                    break
+        finally:
+            # blocks written so far are verified, interrupted sync continues after them
+            if blocks % usb_com.journal_interval:
+                save(f)
+
+    if progress_callback is not None:
+        elapsed = time.monotonic() - start_time
+        progress_callback(received, received / elapsed if elapsed > 0 else 0.0)
+
+    return {"file": file_name, "new_bytes": received, "offset": offset, "total": total,
+            "complete": offset >= total}
+
+
+''' Erases device memory after checking once more that all of it is archived '''
+def erase_archived(usb_com, archive_dir, tag_id):
+    entry = read_state(archive_dir).get(tag_id)
+    if entry is None:
+        raise Exception("Nothing archived for %s!" % tag_id)
+    data, total = usb_com.read_memory_block_retry(entry["offset"], 1)
+    if data or total != entry["offset"] or \
+            (entry["offset"] > 0 and not tail_matches(usb_com, entry["offset"], entry["tail_crc"])):
+        raise Exception("Device memory is not fully archived!")
+
+    usb_com.erase_flash_memory()
+    entry.update({"offset": 0, "tail_crc": 0})
+    update_state(archive_dir, tag_id, entry)
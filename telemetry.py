@@ -0,0 +1,132 @@
+import threading
+import time
+
+import numpy as np
+
+SAMPLE_DTYPE = np.dtype([
+    ("t", np.float64),          # monotonic time [s]
+    ("baro_alt", np.float32),   # barometric altitude [m]
+    ("gps_long", np.float64),
+    ("gps_lat", np.float64),
+    ("gps_alt", np.float32),
+])
+
+
+def sensor_sample(sensor_data, t=None):
+    baro_alt, gps_long, gps_lat, gps_alt = sensor_data[:4]
+    values = []
+    for value in (baro_alt, gps_long, gps_lat, gps_alt):
+        try:
+            values.append(float(value))
+        except ValueError:
+            values.append(np.nan)
+    # baro altitude comes in cm
+    values[0] /= 100.0
+    return (time.monotonic() if t is None else t,) + tuple(values)
+
+
+class TelemetryBuffer:
+    ''' Fixed size ring buffer of live samples, oldest samples are overwritten '''
+    def __init__(self, capacity):
+        self.data = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        self.capacity = capacity
+        self.head = 0
+        self.count = 0
+        # samples appended since start or clear, keeps growing when buffer is full
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def append(self, sample):
+        with self.lock:
+            self.data[self.head] = sample
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+            self.total += 1
+
+    ''' Copy of buffered samples, oldest first '''
+    def snapshot(self):
+        with self.lock:
+            if self.count < self.capacity:
+                return self.data[:self.count].copy()
+            return np.concatenate((self.data[self.head:], self.data[:self.head]))
+
+    def clear(self):
+        with self.lock:
+            self.head = 0
+            self.count = 0
+            self.total = 0
+
+
+''' Reduces series to min and max of every bucket, peaks survive at any zoom level.
+    Returns at most 2 * buckets points '''
+def decimate_minmax(x, y, buckets):
+    n = len(x)
+    if buckets <= 0 or n <= 2 * buckets:
+        return x, y
+
+    starts = (np.arange(buckets) * n) // buckets
+    valid = np.where(np.isnan(y), np.inf, y)
+    y_min = np.minimum.reduceat(valid, starts)
+    valid = np.where(np.isnan(y), -np.inf, y)
+    y_max = np.maximum.reduceat(valid, starts)
+    ends = np.append(starts[1:], n) - 1
+
+    x_out = np.empty(2 * buckets, dtype=x.dtype)
+    y_out = np.empty(2 * buckets, dtype=np.float64)
+    x_out[0::2] = x[starts]
+    x_out[1::2] = x[ends]
+    y_out[0::2] = y_min
+    y_out[1::2] = y_max
+    # buckets without any valid value
+    y_out[~np.isfinite(y_out)] = np.nan
+    return x_out, y_out
+
+
+class LiveSampler:
+    ''' Calls read_sample at given rate on a background thread and stores samples in buffer.
+        read_sample returns sensor data as UsbConnection.get_sensor_data does '''
+    def __init__(self, read_sample, buffer, rate=5.0):
+        self.read_sample = read_sample
+        self.buffer = buffer
+        self.rate = rate
+        self.latest = None
+        self.errors = 0
+        self.stop_event = None
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        # own event for every thread, a thread left running by stop() is not restarted by start()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(self.stop_event,), daemon=True)
+        self.thread.start()
+
+    ''' Waits at most timeout for the thread, called from the UI thread. Thread still inside
+        read_sample exits as soon as it returns, its sample is dropped '''
+    def stop(self, timeout=0.5):
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join(timeout)
+            self.thread = None
+
+    def run(self, stop_event):
+        next_time = time.monotonic()
+        while not stop_event.is_set():
+            try:
+                sensor_data = self.read_sample()
+                if stop_event.is_set():
+                    break
+                self.buffer.append(sensor_sample(sensor_data))
+                self.latest = sensor_data
+            except Exception as e:
+                self.errors += 1
+                print(e)
+
+            next_time += 1.0 / self.rate
+            delay = next_time - time.monotonic()
+            if delay < 0:
+                # cannot keep up with the rate, do not try to catch up
+                next_time = time.monotonic()
+                delay = 0
+            stop_event.wait(delay)
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# modules live in the repository root, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import link_tuning
+from simulator import DeviceSimulator
+from usb import UsbConnection
+
+
+''' Link cache of every connection in a test, not the one in the home directory '''
+@pytest.fixture(autouse=True)
+def link_cache(tmp_path, monkeypatch):
+    cache_file = str(tmp_path / "link.json")
+    monkeypatch.setattr(link_tuning, "CACHE_FILE", cache_file)
+    return cache_file
+
+
+@pytest.fixture
+def simulator():
+    sim = DeviceSimulator(log_size=32 * 1024, erase_time=0.0)
+    yield sim
+    sim.stop()
+
+
+''' UsbConnection connected to the simulator '''
+@pytest.fixture
+def usb_com(simulator):
+    usb_com = UsbConnection(simulator.start(), 115200)
+    usb_com.connect()
+    yield usb_com
+    usb_com.ser.close()
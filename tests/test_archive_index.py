@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+import archive_index
+from archive_index import ArchiveIndex, parse_date
+
+
+''' Fix every 10 s from 08:00:00, long walking east and west, lat north '''
+def fix_lines(start, count):
+    lines = []
+    for i in range(start, start + count):
+        t = 8 * 3600 + 10 * i
+        hhmmss = t // 3600 * 10000 + t // 60 % 60 * 100 + t % 60
+        lines.append(b'30000,%.6f,%.6f,300.0,%06d,5,%06d\n' % (17 + 0.01 * np.sin(i / 100), 48 + 0.0004 * i,
+                                                              hhmmss, hhmmss))
+    return b''.join(lines)
+
+
+''' All fixes of fix_lines(0, count) as (time, long, lat) arrays '''
+def all_fixes(count, date="2026-05-01"):
+    i = np.arange(count)
+    return (parse_date(date) + 8 * 3600 + 10 * i, np.round(17 + 0.01 * np.sin(i / 100), 6),
+            np.round(48 + 0.0004 * i, 6))
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = ArchiveIndex(str(tmp_path))
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    path = tmp_path / "SIM0001_20260501.txt"
+    path.write_bytes(fix_lines(0, 2000))
+    return str(path)
+
+
+def test_ingest(index, log_file):
+    assert index.ingest(log_file, date="2026-05-01") == 2000
+    entry, = index.files()
+    assert entry["tag_id"] == "SIM0001" and entry["fixes"] == 2000
+    t, long, lat = all_fixes(2000)
+    assert (entry["time_from"], entry["time_to"]) == (t[0], t[-1])
+    # unchanged file is not parsed again
+    assert index.ingest(log_file, date="2026-05-01") == 0
+
+
+@pytest.mark.parametrize("area, time_range", [
+    (None, None),
+    ((16.995, 48.1, 17.005, 48.5), None),
+    (None, (8 * 3600 + 1000, 8 * 3600 + 5000)),
+    ((17.0, 48.2, 17.02, 48.6), (8 * 3600 + 5000, 8 * 3600 + 15000)),
+    ((0.0, 0.0, 1.0, 1.0), None),
+])
+def test_query_matches_brute_force(index, log_file, area, time_range):
+    index.ingest(log_file, date="2026-05-01")
+    t, long, lat = all_fixes(2000)
+    expected = np.ones(len(t), dtype=bool)
+    kwargs = {}
+    if area is not None:
+        expected &= (long >= area[0]) & (long <= area[2]) & (lat >= area[1]) & (lat <= area[3])
+        kwargs["area"] = area
+    if time_range is not None:
+        time_from, time_to = (parse_date("2026-05-01") + value for value in time_range)
+        expected &= (t >= time_from) & (t <= time_to)
+        kwargs.update(time_from=time_from, time_to=time_to)
+
+    result = index.query(**kwargs)
+    np.testing.assert_array_equal(result["time"], t[expected])
+    np.testing.assert_array_equal(result["gps_lat"], lat[expected])
+    # blocks outside the query are not read
+    assert index.last_query["blocks"] <= -(-2000 // archive_index.BLOCK_SIZE)
+    if area is not None and not expected.any():
+        assert index.last_query["blocks"] == 0
+
+
+def test_query_radius_hours_and_tag(index, log_file, tmp_path):
+    other = tmp_path / "SIM0002.txt"
+    other.write_bytes(fix_lines(0, 100))
+    index.ingest(log_file, date="2026-05-01")
+    index.ingest(str(other), date="2026-05-02")
+    assert index.tags() == ["SIM0001", "SIM0002"]
+
+    assert len(index.query(tag_id="SIM0002")) == 100
+    result = index.query(center=(17.0, 48.0), radius=1000.0)
+    assert len(result) and (archive_index.haversine(17.0, 48.0, result["gps_long"], result["gps_lat"]) <= 1000).all()
+    assert set(result["file_id"]) == {entry["id"] for entry in index.files()}
+
+    # 08:00 - 08:05 UTC is 30 fixes of each log, 09:00 - 09:05 local time at UTC+1
+    assert len(index.query(hours=(8 * 3600, 8 * 3600 + 300))) == 60
+    assert len(index.query(hours=(9 * 3600, 9 * 3600 + 300), utc_offset=1.0)) == 60
+    assert len(index.query(hours=(8 * 3600, 8 * 3600 + 300), utc_offset=1.0)) == 0
+
+
+def test_incremental_ingest(index, log_file):
+    with open(log_file, 'wb') as f:
+        f.write(fix_lines(0, 1500) + fix_lines(1500, 1)[:20])
+    assert index.ingest(log_file, date="2026-05-01") == 1500
+
+    # partial last line is indexed once it is complete
+    with open(log_file, 'ab') as f:
+        f.write(fix_lines(1500, 1)[20:] + fix_lines(1501, 499))
+    assert index.ingest(log_file, date="2026-05-01") == 500
+    assert index.files()[0]["fixes"] == 2000
+    np.testing.assert_array_equal(index.query()["time"], all_fixes(2000)[0])
+
+
+def test_rewritten_log_indexed_again(index, log_file):
+    index.ingest(log_file, date="2026-05-01")
+    with open(log_file, 'wb') as f:
+        f.write(fix_lines(0, 2500).replace(b'30000,17', b'30001,17'))
+    # tail before the indexed offset changed, whole file is indexed again
+    assert index.ingest(log_file, date="2026-05-01") == 2500
+    assert index.files()[0]["fixes"] == 2500
+    assert len(index.query()) == 2500
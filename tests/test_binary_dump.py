@@ -0,0 +1,104 @@
+import struct
+import zlib
+
+import pytest
+
+import binary_dump
+import link_tuning
+from simulator import synthetic_log
+
+
+def decode(dump):
+    out = []
+    index = 0
+    while True:
+        length, crc = binary_dump.FRAME_HEADER.unpack_from(dump, index)
+        index += binary_dump.FRAME_HEADER.size
+        payload = dump[index:index + length]
+        index += length
+        assert zlib.crc32(payload) == crc
+        assert length <= binary_dump.MAX_FRAME
+        if not length:
+            assert index == len(dump)
+            return b''.join(out)
+        out.append(binary_dump.decode_payload(payload))
+
+
+@pytest.mark.parametrize("mode", [binary_dump.MODE_PACKED, binary_dump.MODE_DELTA])
+def test_round_trip(mode):
+    memory = synthetic_log(64 * 1024)
+    assert decode(binary_dump.encode(memory, mode)) == memory
+
+
+def test_repeated_records():
+    memory = b'30000,17.107748,48.148598,300.0,120000,5,120000\n' * 500
+    dump = binary_dump.encode(memory)
+    assert decode(dump) == memory
+    assert len(dump) < 100
+
+
+def test_lines_not_packed_exactly():
+    memory = b'garbage\n30000,17.1077480,48.148598,300.0,120000,5,120000\n-5,-0.000001,-1.500000,-0.5,000000,0,000000\n' \
+             b'partial line'
+    assert decode(binary_dump.encode(memory)) == memory
+
+
+def test_line_longer_than_frame():
+    memory = synthetic_log(1024) + b'x' * 70000 + b'\n' + synthetic_log(1024)
+    assert decode(binary_dump.encode(memory)) == memory
+
+
+def test_pack_line():
+    line = b'-1234,-17.107748,48.148598,-0.5,235959,30,235959\n'
+    values = binary_dump.pack_line(line)
+    assert values == (-1234, -17107748, 48148598, -5, 235959, 30, 235959)
+    assert binary_dump.format_record(values) == line
+    # would not survive the round trip exactly
+    assert binary_dump.pack_line(b'1,1.0,1.000000,1.0,000000,1,000000\n') is None
+    assert binary_dump.pack_line(b'1,1.000000,1.000000,1.0,000000,99999999999,000000\n') is None
+
+
+def test_unknown_entry():
+    with pytest.raises(Exception, match="Invalid binary frame"):
+        binary_dump.decode_payload(bytes([99]))
+    with pytest.raises(Exception, match="Invalid binary frame"):
+        binary_dump.decode_payload(bytes([binary_dump.REPEAT, 1]))
+    assert binary_dump.decode_payload(bytes([binary_dump.RAW]) + struct.pack('<H', 3) + b'ab\n') == b'ab\n'
+
+
+def test_download(usb_com, simulator, tmp_path):
+    file_name = str(tmp_path / "log.txt")
+    usb_com.read_tag_id()
+    usb_com.log_data(file_name)
+    assert usb_com.binary_dump
+    assert 'READ_MEMORY_BINARY' in simulator.commands
+    with open(file_name, 'rb') as f:
+        assert f.read() == simulator.memory
+    assert usb_com.get_tag_id() == 'SIM0001'
+    assert link_tuning.cached_binary_dump('SIM0001', usb_com.link_cache) is True
+
+
+def test_old_firmware_falls_back_to_text(usb_com, simulator, tmp_path):
+    simulator.binary = False
+    usb_com.dump_probe_timeout = 0.2
+    file_name = str(tmp_path / "log.txt")
+    usb_com.read_tag_id()
+    usb_com.log_data(file_name)
+    assert usb_com.binary_dump is False
+    with open(file_name, 'rb') as f:
+        assert f.read() == simulator.memory
+
+    # known for the rest of the connection, not probed again
+    usb_com.log_data(file_name)
+    assert simulator.commands.count('READ_MEMORY_BINARY') == 1
+
+    # next connection to the tag goes straight to text mode
+    assert link_tuning.cached_binary_dump('SIM0001', usb_com.link_cache) is False
+    usb_com.binary_dump = None
+    usb_com.log_data(file_name)
+    assert simulator.commands.count('READ_MEMORY_BINARY') == 1
+
+
+def test_unknown_tag_is_not_cached(usb_com, simulator, tmp_path):
+    usb_com.log_data(str(tmp_path / "log.txt"))
+    assert link_tuning.read_cache(usb_com.link_cache) == {}
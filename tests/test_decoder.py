@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from decoder import LOG_DTYPE, decode_bytes, decode_file, time_of_day
+
+LINE = b'30012,17.107748,48.148598,300.1,120005,7,120005\n'
+
+
+def test_decode_line():
+    records = decode_bytes(LINE * 3)
+    assert records.dtype == LOG_DTYPE
+    assert len(records) == 3
+    assert records["baro_alt"][0] == 30012
+    assert records["gps_long"][0] == 17.107748
+    assert records["gps_lat"][0] == 48.148598
+    assert records["gps_alt"][0] == pytest.approx(300.1)
+    assert records["gps_time"][0] == 120005
+    assert records["gps_fix_time"][0] == 7
+
+
+def test_crlf_and_missing_last_newline():
+    records = decode_bytes(LINE.replace(b'\n', b'\r\n') + LINE[:-1])
+    assert len(records) == 2
+    assert records["gps_time_time"][1] == 120005
+
+
+def test_empty_field():
+    records = decode_bytes(b'30012,,48.148598,300.1,120005,7,120005\n,17.1,48.1,300.1,120005,7,120005\n')
+    assert len(records) == 2
+    assert np.isnan(records["gps_long"][0])
+    assert records["gps_lat"][0] == 48.148598
+    # integer column cannot hold NaN
+    assert records["baro_alt"][1] == 0
+    assert records["gps_long"][1] == 17.1
+
+
+def test_malformed_lines():
+    data = LINE + b'30012,17.1,48.1\n' + b'\n' + b'30012,17.1,48.1,300.1,12x005,7,120005\n' + LINE
+    records = decode_bytes(data)
+    # line with missing fields and empty line are skipped, garbage inside a field is NaN
+    assert len(records) == 3
+    assert np.isnan(records["gps_time"][1])
+    assert records["gps_lat"][1] == 48.1
+    assert records["gps_time"][2] == 120005
+
+
+def test_empty_log(tmp_path):
+    path = tmp_path / "log.txt"
+    path.write_bytes(b'')
+    assert len(decode_file(str(path))) == 0
+    assert len(decode_bytes(b'garbage\n')) == 0
+
+
+def test_time_of_day():
+    assert list(time_of_day([0, 120005, 235959.5])) == [0, 12 * 3600 + 5, 86399.5]
@@ -0,0 +1,68 @@
+import io
+
+import pytest
+
+from usb import FrameParser, LogStreamWriter
+
+
+def test_frames_split_in_order():
+    parser = FrameParser(capacity=64)
+    parser.feed(b'$1,2#$OK')
+    assert parser.next_frame() == '$1,2#'
+    assert parser.next_frame() is None
+    parser.feed(b'#')
+    assert parser.next_frame() == '$OK#'
+    assert parser.size == 0
+
+
+def test_frame_across_wrap():
+    parser = FrameParser(capacity=16)
+    parser.feed(b'$0123456789#')
+    assert parser.next_frame() == '$0123456789#'
+    # head is at 12, frame wraps around the end of the buffer
+    parser.feed(b'$abcdefgh#')
+    assert parser.find(ord('#')) == 9
+    assert parser.next_frame() == '$abcdefgh#'
+
+
+def test_unread_goes_before_buffered_bytes():
+    parser = FrameParser(capacity=16)
+    parser.feed(b'$0123456789#')
+    parser.take(12)
+    parser.feed(b'CD#')
+    # unread across the start of the buffer
+    parser.unread(b'$AB')
+    assert parser.next_frame() == '$ABCD#'
+    assert parser.free() == 16
+
+
+def test_overflow():
+    parser = FrameParser(capacity=8)
+    parser.feed(b'$1234')
+    with pytest.raises(Exception, match="overflow"):
+        parser.feed(b'5678#')
+    with pytest.raises(Exception, match="overflow"):
+        parser.unread(b'5678#')
+
+
+def test_log_stream_termination_split_across_chunks():
+    f = io.BytesIO()
+    writer = LogStreamWriter(f, '$EOF_LOG#')
+    for chunk in (b'$line 1\n', b'line 2\n#$EOF', b'_LOG#'):
+        assert writer.feed(chunk) == len(chunk)
+    assert writer.done
+    assert f.getvalue() == b'line 1\nline 2\n'
+    assert writer.written == len(f.getvalue())
+
+
+def test_log_stream_leaves_next_response():
+    f = io.BytesIO()
+    writer = LogStreamWriter(f, '$EOF_LOG#')
+    chunk = b'$data\n#$EOF_LOG#$1,1,1,51#'
+    assert writer.feed(chunk) == len(chunk) - len(b'$1,1,1,51#')
+    assert f.getvalue() == b'data\n'
+
+
+def test_log_stream_invalid_start():
+    with pytest.raises(Exception, match="Invalid"):
+        LogStreamWriter(io.BytesIO(), '$EOF_LOG#').feed(b'data#$EOF_LOG#')
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+import harvest
+from simulator import DeviceSimulator
+
+
+@pytest.fixture
+def simulators():
+    sims = [DeviceSimulator(log_size=16 * 1024, tag_id="SIM000%d" % (i + 1), erase_time=0.0) for i in range(2)]
+    yield sims
+    for sim in sims:
+        sim.stop()
+
+
+def read(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read()
+
+
+def test_harvest_two_devices(simulators, tmp_path):
+    ports = [sim.start() for sim in simulators]
+    statuses = []
+    results = harvest.harvest(ports, 115200, str(tmp_path), erase=True, status_callback=statuses.append)
+
+    assert [status["state"] for status in results] == ["done", "done"]
+    for sim, status in zip(simulators, results):
+        assert status["tag_id"] == sim.tag_id
+        assert os.path.basename(status["file"]).startswith(sim.tag_id + "_")
+        assert status["bytes"] > 0
+        assert sim.memory == b''
+    assert {"connecting", "downloading", "erasing", "done"} <= {status["state"] for status in statuses}
+
+
+def test_harvest_does_not_overwrite(simulator, tmp_path, monkeypatch):
+    stamps = iter(["20260501_120000", "20260501_120005"])
+    monkeypatch.setattr(harvest.time, "strftime", lambda fmt: next(stamps))
+    port = simulator.start()
+    memory = simulator.memory
+
+    first = harvest.harvest_device(port, 115200, str(tmp_path))
+    simulator.memory = memory[:1000]
+    second = harvest.harvest_device(port, 115200, str(tmp_path))
+
+    assert first["file"] != second["file"]
+    logs = sorted(name for name in os.listdir(tmp_path) if name.endswith(".txt"))
+    assert logs == ["SIM0001_20260501_120000.txt", "SIM0001_20260501_120005.txt"]
+    assert len(read(first["file"])) > len(read(second["file"]))
+
+
+def test_resumable_continues_partial_file(tmp_path):
+    partial = tmp_path / "SIM0001_20260501_120000.txt.part"
+    partial.write_bytes(b'')
+    file_name = harvest.log_file_name(str(tmp_path), "SIM0001", resumable=True)
+    assert file_name == str(tmp_path / "SIM0001_20260501_120000.txt")
+    assert harvest.log_file_name(str(tmp_path), "SIM0002", resumable=True).startswith(str(tmp_path / "SIM0002_"))
+
+
+def test_port_tag_id(simulator, tmp_path):
+    simulator.tag_id = ''
+    port = simulator.start()
+    status = harvest.harvest_device(port, 115200, str(tmp_path))
+
+    assert status["state"] == "done"
+    assert status["tag_id"] == "port-" + os.path.basename(port)
@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+import link_tuning
+from simulator import DeviceSimulator
+from usb import UsbConnection
+
+RATES = [230400, 460800, 921600]
+
+
+@pytest.fixture
+def simulator():
+    # link is garbled above max_baud, device falls back on its own after baud_revert_time
+    sim = DeviceSimulator(log_size=16 * 1024, max_baud=460800, baud_revert_time=0.3)
+    yield sim
+    sim.stop()
+
+
+@pytest.fixture
+def usb_com(simulator):
+    usb_com = UsbConnection(simulator.start(), 115200)
+    usb_com.baud_revert_time = 0.3
+    usb_com.connect()
+    # failed handshake at a garbled rate times out sooner
+    usb_com.ser.timeout = 0.3
+    yield usb_com
+    usb_com.ser.close()
+
+
+def test_change_committed(usb_com, simulator):
+    assert usb_com.change_baud_rate(460800)
+    assert usb_com.get_baud_rate() == usb_com.ser.baudrate == 460800
+    # committed, device does not revert
+    time.sleep(0.5)
+    assert simulator.link_baud == 460800
+    assert usb_com.get_tag_id() == 'SIM0001'
+
+
+def test_failed_handshake_rolls_back(usb_com, simulator):
+    assert not usb_com.change_baud_rate(921600)
+    assert usb_com.get_baud_rate() == usb_com.ser.baudrate == 115200
+    assert simulator.link_baud == 115200
+    assert usb_com.get_tag_id() == 'SIM0001'
+
+
+def test_tune_link_uses_cache(usb_com, simulator, tmp_path):
+    cache_file = str(tmp_path / "link.json")
+    assert link_tuning.tune_link(usb_com, 'SIM0001', RATES, cache_file) == 460800
+    assert link_tuning.read_cache(cache_file)['SIM0001']['baud'] == 460800
+
+    usb_com.change_baud_rate(115200)
+    probes = simulator.commands.count('SET_BAUD')
+    assert link_tuning.tune_link(usb_com, 'SIM0001', RATES, cache_file) == 460800
+    # cached rate switched to directly, set and commit
+    assert simulator.commands.count('SET_BAUD') == probes + 2
+
+
+def test_fast_link_restores_rate(usb_com, simulator, tmp_path):
+    with link_tuning.fast_link(usb_com, 'SIM0001', RATES, str(tmp_path / "link.json")) as baud:
+        assert baud == usb_com.get_baud_rate() == 460800
+    assert usb_com.get_baud_rate() == 115200
+    assert usb_com.get_tag_id() == 'SIM0001'
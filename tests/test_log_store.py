@@ -0,0 +1,107 @@
+import json
+
+import numpy as np
+import pytest
+
+import log_store
+from decoder import decode_bytes
+
+
+def hhmmss(t):
+    t %= 24 * 3600
+    return t // 3600 * 10000 + t // 60 % 60 * 100 + t % 60
+
+
+''' Log of a tag moving north-east, one fix every 2 s from start seconds of day '''
+def track_log(count, start=12 * 3600):
+    return b''.join(b'%d,%.6f,%.6f,%.1f,%06d,%d,%06d\n' % (
+        30000 + i, 17.1 + i * 1e-5, 48.1 + i * 2e-5, 300 + i / 10, hhmmss(start + i * 2), 5, 0)
+        for i in range(count))
+
+
+@pytest.fixture
+def records():
+    records = decode_bytes(track_log(1000) + b'30012,,48.148598,300.1,120005,7,120005\n')
+    assert np.isnan(records["gps_long"][-1])
+    return records
+
+
+def assert_same(loaded, records):
+    assert loaded.dtype == records.dtype
+    for field in records.dtype.names:
+        np.testing.assert_array_equal(loaded[field], records[field])
+
+
+@pytest.mark.parametrize("fmt", ["npy", "npz"])
+def test_round_trip(records, tmp_path, fmt):
+    path = log_store.save(records, str(tmp_path), "SIM0001", fmt)
+    assert path.endswith(log_store.FORMATS[fmt])
+    assert_same(log_store.load(path), records)
+
+
+def test_npz_columns_are_fixed_point_deltas(records):
+    columns = log_store.encode_column("gps_lat", records["gps_lat"])
+    assert int(columns["gps_lat__decimals"]) == 6
+    assert columns["gps_lat"].dtype == np.int64
+    assert "gps_lat__nan" not in columns
+    np.testing.assert_array_equal(log_store.decode_column("gps_lat", columns, np.float64), records["gps_lat"])
+
+
+def test_index(records, tmp_path, monkeypatch):
+    monkeypatch.setattr(log_store.time, "strftime", lambda fmt: "2026-05-04" if fmt == '%Y-%m-%d' else "120000")
+    store_dir = str(tmp_path)
+    log_store.save(records, store_dir, "SIM0001", "npz", recorded="2026-05-01")
+    log_store.save(records[:0], store_dir, "SIM/0002", "npy")
+
+    first, second = log_store.read_index(store_dir)
+    fixes = records[log_store.valid_fixes(records)]
+    assert first["tag_id"] == "SIM0001" and first["format"] == "npz"
+    assert first["count"] == len(records) and first["fixes"] == len(records) - 1
+    assert first["time_of_day"] == [fixes["gps_time"].min(), fixes["gps_time"].max()]
+    assert first["bbox"] == [fixes["gps_long"].min(), fixes["gps_lat"].min(),
+                             fixes["gps_long"].max(), fixes["gps_lat"].max()]
+    assert first["recorded"] == ["2026-05-01", "2026-05-01"]
+    assert first["downloaded"] == "2026-05-04"
+    assert second["fixes"] == 0 and second["bbox"] is None and second["recorded"] is None
+    # tag ID is sanitized in the file name only
+    assert second["tag_id"] == "SIM/0002"
+    assert second["file"] == "SIM_0002_2026-05-04_120000.npy"
+
+
+def test_recorded_days_cross_midnight():
+    # 23:50 to 00:23 next day
+    records = decode_bytes(track_log(1000, 23 * 3600 + 50 * 60))
+    assert log_store.summary(records, "2026-05-01")["recorded"] == ["2026-05-01", "2026-05-02"]
+    # then 23:00 the same day and 05:00 the day after
+    records = decode_bytes(track_log(1000, 23 * 3600 + 50 * 60) + track_log(10, 23 * 3600) + track_log(10, 5 * 3600))
+    assert log_store.summary(records, "2026-05-01")["recorded"] == ["2026-05-01", "2026-05-03"]
+    assert log_store.summary(records)["recorded"] is None
+
+
+def test_old_index_entries(tmp_path):
+    with open(str(tmp_path / log_store.INDEX_NAME), 'w') as f:
+        json.dump([{"file": "SIM0001_2026-05-04_120000.npy", "tag_id": "SIM0001", "date": "2026-05-04",
+                    "time_range": [120000.0, 130000.0], "count": 1, "fixes": 1, "bbox": None, "format": "npy"}], f)
+    entry, = log_store.read_index(str(tmp_path))
+    assert entry["downloaded"] == "2026-05-04"
+    assert entry["time_of_day"] == [120000.0, 130000.0]
+    assert entry["recorded"] is None
+    # download date alone does not match dates
+    assert log_store.query(str(tmp_path), date_from="2026-05-01") == []
+
+
+def test_query(records, tmp_path):
+    store_dir = str(tmp_path)
+    log_store.save(records, store_dir, "SIM0001", "npy", recorded="2026-05-01")
+    log_store.save(records, store_dir, "SIM0002", "npy", recorded="2026-05-03")
+    log_store.save(records, store_dir, "SIM0003", "npy")
+
+    def tags(**filters):
+        return [entry["tag_id"] for entry in log_store.query(store_dir, **filters)]
+    assert tags() == ["SIM0001", "SIM0002", "SIM0003"]
+    assert tags(tag_id="SIM0002") == ["SIM0002"]
+    assert tags(date_from="2026-05-02") == ["SIM0002"]
+    assert tags(date_to="2026-05-02") == ["SIM0001"]
+    assert tags(date_from="2026-05-01", date_to="2026-05-01") == ["SIM0001"]
+    assert tags(area=(17.0, 48.0, 17.2, 48.2)) == ["SIM0001", "SIM0002", "SIM0003"]
+    assert tags(area=(0.0, 0.0, 1.0, 1.0)) == []
@@ -0,0 +1,115 @@
+import multiprocessing
+import os
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+
+import pipeline
+
+GPX = "{http://www.topografix.com/GPX/1/1}"
+
+
+''' Fix every 60 s from 23:50:00 over midnight, moving 0.001 deg north (about 111 m) a minute '''
+def fix_lines(count, start=23 * 3600 + 50 * 60):
+    lines = []
+    for i in range(count):
+        t = (start + 60 * i) % 86400
+        hhmmss = t // 3600 * 10000 + t // 60 % 60 * 100 + t % 60
+        lines.append(b'%d,17.000000,%.6f,%.1f,%06d,5,%06d\n' % (30000 + i, 48 + i * 0.001, 300 + i, hhmmss, hhmmss))
+    return lines
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    lines = fix_lines(20)
+    # jump of 1 deg within a minute, no fix yet
+    lines.insert(5, b'30000,18.000000,48.004500,300.0,235430,5,235430\n')
+    lines.insert(0, b'29000,0.000000,0.000000,0.0,000000,0,000000\n')
+    path = tmp_path / "SIM0001.txt"
+    path.write_bytes(b''.join(lines))
+    return str(path)
+
+
+def read(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read()
+
+
+def test_csv(log_file, tmp_path):
+    status = pipeline.process_file(log_file, str(tmp_path), ["csv"], altitude=250, date="2026-05-01")
+    assert (status["records"], status["fixes"], status["rejected"]) == (22, 20, 1)
+
+    rows = np.loadtxt(status["outputs"][0], delimiter=",", skiprows=1)
+    assert read(status["outputs"][0]).startswith(b'time,gps_long,gps_lat,gps_alt,baro_alt,height,speed\n')
+    # no fix: baro altitude only
+    assert np.isnan(rows[0, [0, 1, 2, 6]]).all() and rows[0, 4] == 290.0
+    # rejected jump keeps its time and baro altitude, loses the position
+    assert rows[6, 0] == 23 * 3600 + 54 * 60 + 30 and np.isnan(rows[6, 1])
+    fixes = np.delete(rows[1:], 5, axis=0)
+    # time continues past midnight
+    np.testing.assert_allclose(fixes[:, 0], 23 * 3600 + 50 * 60 + 60 * np.arange(20))
+    np.testing.assert_allclose(fixes[:, 2], 48 + 0.001 * np.arange(20))
+    np.testing.assert_allclose(fixes[:, 5], fixes[:, 4] - 250)
+    np.testing.assert_allclose(fixes[1:, 6], 111.2 / 60, rtol=1e-2)
+
+
+def test_gpx(log_file, tmp_path):
+    status = pipeline.process_file(log_file, str(tmp_path), ["gpx"], date="2026-05-01")
+    track = ET.parse(status["outputs"][0]).getroot().find(GPX + "trk")
+    assert track.find(GPX + "name").text == "SIM0001"
+    points = track.find(GPX + "trkseg").findall(GPX + "trkpt")
+    assert len(points) == 20
+    assert [points[0].get("lat"), points[0].get("lon")] == ["48.000000", "17.000000"]
+    assert points[0].find(GPX + "time").text == "2026-05-01T23:50:00Z"
+    assert points[-1].find(GPX + "time").text == "2026-05-02T00:09:00Z"
+    assert points[-1].find(GPX + "ele").text == "319.0"
+
+
+def test_output_independent_of_chunk_size(log_file, tmp_path):
+    outputs = []
+    for chunk_bytes in (pipeline.CHUNK_BYTES, 100):
+        out_dir = tmp_path / str(chunk_bytes)
+        out_dir.mkdir()
+        status = pipeline.process_file(log_file, str(out_dir), date="2026-05-01", chunk_bytes=chunk_bytes)
+        assert status["rejected"] == 1
+        outputs.append([read(file_name) for file_name in status["outputs"]])
+    assert outputs[0] == outputs[1]
+
+
+def test_parallel_matches_single_file(log_file, tmp_path):
+    single = pipeline.process_file(log_file, str(tmp_path), date="2026-05-01")
+    expected = [read(file_name) for file_name in single["outputs"]]
+
+    reported = []
+    results = pipeline.process_files([log_file, str(tmp_path / "missing.txt")], str(tmp_path / "parallel"),
+                                     date="2026-05-01", workers=2, status_callback=reported.append)
+    assert [status["state"] for status in results] == ["done", "failed"]
+    assert sorted(status["file"] for status in reported) == sorted(status["file"] for status in results)
+    assert [read(file_name) for file_name in results[0]["outputs"]] == expected
+
+
+def test_export_names(tmp_path):
+    assert pipeline.export_names([str(tmp_path / "a" / "log.txt")]) == ["log"]
+    assert pipeline.export_names([str(tmp_path / "SIM0001" / "log.txt"), str(tmp_path / "SIM0002" / "log.txt"),
+                                  str(tmp_path / "other.txt")]) == ["SIM0001_log", "SIM0002_log", "other"]
+    assert pipeline.tagged_name("/data/log.txt", "SIM/0001") == "SIM_0001_log"
+    assert pipeline.tagged_name("/data/SIM0001_20260501_120000.txt", "SIM0001") == "SIM0001_20260501_120000"
+    assert pipeline.tagged_name("/data/log.txt", "") == "log"
+
+
+def test_same_file_name_in_two_directories(log_file, tmp_path):
+    files = []
+    for tag_id in ("SIM0001", "SIM0002"):
+        (tmp_path / tag_id).mkdir()
+        files.append(str(tmp_path / tag_id / "log.txt"))
+    with open(files[0], 'wb') as f:
+        f.write(read(log_file))
+    with open(files[1], 'wb') as f:
+        f.write(b''.join(fix_lines(3)))
+
+    results = pipeline.process_files(files, str(tmp_path / "out"), ["csv"], date="2026-05-01", workers=2,
+                                     mp_context=multiprocessing.get_context("spawn"))
+    assert [status["state"] for status in results] == ["done", "done"]
+    assert [os.path.basename(status["outputs"][0]) for status in results] == ["SIM0001_log.csv", "SIM0002_log.csv"]
+    assert [status["records"] for status in results] == [22, 3]
@@ -0,0 +1,80 @@
+import os
+import time
+
+import pytest
+
+import provisioning
+from harvest import discover_devices
+from provisioning import Profile
+from simulator import DeviceSimulator
+
+
+@pytest.fixture
+def simulators():
+    sims = [DeviceSimulator(log_size=1024, tag_id="SIM%04d" % i) for i in (1, 2)]
+    for sim in sims:
+        sim.start()
+    yield sims
+    for sim in sims:
+        sim.stop()
+
+
+def test_link_delay():
+    # 12 bytes each way at 10 bits per byte take 1.2 ms of a 5.2 ms round trip
+    assert provisioning.link_delay(0.0052, 4, 8, 8, 100000) == pytest.approx(0.002 + 0.0008)
+    assert provisioning.link_delay(0.004, 4, 8, 8, 0) == pytest.approx(0.002)
+
+
+def test_provision_two_devices(simulators, monkeypatch):
+    ports = discover_devices(115200, [sim.port for sim in simulators] + ["/dev/nonexistent"])
+    assert ports == [sim.port for sim in simulators]
+
+    # 1.5 s before a minute boundary, so that the clock is sent without waiting a minute
+    now = (time.time() // 60 + 1) * 60 - 1.5
+    monkeypatch.setattr(provisioning.time, "time", lambda: now)
+    reported = []
+    results = provisioning.provision(ports, 115200, Profile(5, 30, 120), status_callback=reported.append)
+
+    clock = time.localtime(now + 1.5)
+    for sim, status in zip(simulators, results):
+        assert status["state"] == "done", status["error"]
+        assert status["tag_id"] == sim.tag_id
+        assert status["device_state_name"] == "WAIT_ALT_TRIGGER"
+        assert status["clock"] == "%02d:%02d" % (clock.tm_hour, clock.tm_min)
+        assert abs(status["clock_error_ms"]) < 50
+        assert sim.clock[:2] == (clock.tm_hour, clock.tm_min)
+        assert (sim.wake_time, sim.altitude, sim.state) == ((5, 30), 120, 40)
+    states = [status["state"] for status in reported if status["port"] == ports[0]]
+    assert states == ["connecting", "measuring", "measuring", "clock", "clock", "configuring", "verifying",
+                      "verifying", "done"]
+
+
+def test_device_not_armed(simulators, tmp_path):
+    # SET_TIME and SET_ALTITUDE are ignored in SET_SLEEP_MODE
+    simulators[1].state = 3
+    results = provisioning.provision([sim.port for sim in simulators], 115200, Profile(5, 30, 120, clock=False))
+    assert [status["state"] for status in results] == ["done", "failed"]
+    assert "SET_SLEEP_MODE" in results[1]["error"]
+
+    report = str(tmp_path / "report.csv")
+    provisioning.write_report(results, report)
+    with open(report) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == ",".join(provisioning.REPORT_FIELDS)
+    assert len(lines) == 3
+
+
+@pytest.mark.parametrize("state, name", [(41, "WAKE_UP_GPS"), (42, "WAIT_FOR_GPS_FIX"), (43, "LOG_MEAS_DATA")])
+def test_past_altitude_trigger_is_armed(simulators, state, name):
+    # tag provisioned above the altitude trigger moves on from WAIT_ALT_TRIGGER by itself
+    simulators[0].state = state
+    status = provisioning.provision_device(simulators[0].port, 115200, Profile(5, 30, 120, clock=False))
+    assert status["state"] == "done", status["error"]
+    assert status["device_state_name"] == name
+
+
+def test_port_tag_id(simulators):
+    simulators[0].tag_id = ''
+    status = provisioning.provision_device(simulators[0].port, 115200, Profile(5, 30, 120, clock=False))
+    assert status["state"] == "done", status["error"]
+    assert status["tag_id"] == "port-" + os.path.basename(simulators[0].port)
@@ -0,0 +1,170 @@
+import os
+import zlib
+
+import pytest
+
+from usb import UsbConnection
+
+
+class FakeTag:
+    ''' Port of a tag answering READ_TAG_ID and READ_MEMORY_RANGE from memory. Blocks past fail_after
+        get no answer, corrupt flips a byte of the next corrupt blocks and sends noise after them '''
+    def __init__(self, memory, tag_id="SIM0001"):
+        self.memory = memory
+        self.tag_id = tag_id
+        self.buffer = bytearray()
+        self.timeout = 2
+        self.offsets = []
+        self.fail_after = None
+        self.corrupt = 0
+        self.noise = b''
+
+    def isOpen(self):
+        return True
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer)
+
+    def write(self, data):
+        cmd = data.decode('utf-8')[1:-1]
+        if cmd == '12':
+            self.buffer += b'$%s#' % self.tag_id.encode('utf-8')
+        elif cmd[:2] == '11':
+            offset, length = int(cmd[2:12]), int(cmd[12:17])
+            self.offsets.append(offset)
+            if self.fail_after is not None and len(self.offsets) > self.fail_after:
+                return len(data)
+            block = self.memory[offset:offset + length]
+            self.buffer += b'$%d,%d,%d,%08x#' % (offset, len(block), len(self.memory), zlib.crc32(block))
+            if self.corrupt and block:
+                self.corrupt -= 1
+                block = bytes([block[0] ^ 0x55]) + block[1:] + self.noise
+            self.buffer += block
+        return len(data)
+
+    def read(self, size=1):
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def read_until(self, expected=b'\n', size=None):
+        index = self.buffer.find(expected)
+        return self.read(len(self.buffer) if index == -1 else index + len(expected))
+
+    def reset_input_buffer(self):
+        self.buffer.clear()
+
+    def reset_output_buffer(self):
+        pass
+
+
+@pytest.fixture
+def tag():
+    return FakeTag(bytes(range(256)) * 100)
+
+
+@pytest.fixture
+def usb_com(tag):
+    usb_com = UsbConnection("fake", 115200)
+    usb_com.ser = tag
+    usb_com.block_size = 1000
+    return usb_com
+
+
+def read(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read()
+
+
+def test_download(usb_com, tag, tmp_path):
+    file_name = str(tmp_path / "log.txt")
+    assert usb_com.log_data(file_name, resumable=True) == len(tag.memory)
+    assert read(file_name) == tag.memory
+    assert tag.offsets == list(range(0, len(tag.memory), 1000))
+    assert not os.path.exists(file_name + '.part')
+
+
+def test_corrupt_block_is_read_again(usb_com, tag, tmp_path, monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda t: None)
+    file_name = str(tmp_path / "log.txt")
+    tag.corrupt = 2
+    usb_com.log_data(file_name, resumable=True)
+    assert read(file_name) == tag.memory
+    assert tag.offsets[:3] == [0, 0, 0]
+
+
+def test_retry_drops_rest_of_broken_block(usb_com, tag, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr("time.sleep", lambda t: None)
+    usb_com.instrumentation.enabled = True
+    tag.corrupt = 1
+    tag.noise = b'$1,1,1,51#' * 10
+    data, total = usb_com.read_memory_block_retry(0, 1000)
+    assert data == tag.memory[:1000]
+    assert tag.offsets == [0, 0]
+    summary = usb_com.instrumentation.summary()
+    assert summary["counters"]["retry:READ_MEMORY_RANGE"] == 1
+    assert summary["counters"]["error:READ_MEMORY_RANGE"] == 1
+    # dropped bytes are counted as received
+    assert summary["bytes_in"] == 2 * (len(b'$0,1000,25600,00000000#') + 1000) + len(tag.noise)
+    assert capsys.readouterr().out == ''
+
+
+def test_interrupted_download_continues(usb_com, tag, tmp_path, monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda t: None)
+    file_name = str(tmp_path / "log.txt")
+    usb_com.block_retries = 0
+    tag.fail_after = 3
+    with pytest.raises(Exception, match="not responding"):
+        usb_com.log_data(file_name, resumable=True)
+    assert read(file_name) == tag.memory[:3000]
+    assert os.path.exists(file_name + '.part')
+
+    tag.fail_after = None
+    tag.offsets = []
+    usb_com.log_data(file_name, resumable=True)
+    assert tag.offsets[0] == 3000
+    assert read(file_name) == tag.memory
+
+
+def interrupt(usb_com, tag, file_name, blocks):
+    usb_com.block_retries = 0
+    tag.fail_after = blocks
+    with pytest.raises(Exception, match="not responding"):
+        usb_com.log_data(file_name, resumable=True)
+    tag.fail_after = None
+    tag.offsets = []
+
+
+def test_other_tag_starts_over(usb_com, tag, tmp_path, monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda t: None)
+    file_name = str(tmp_path / "log.txt")
+    interrupt(usb_com, tag, file_name, 3)
+
+    tag.tag_id = "SIM0002"
+    tag.memory = bytes(reversed(tag.memory))
+    usb_com.log_data(file_name, resumable=True)
+    assert tag.offsets[0] == 0
+    assert read(file_name) == tag.memory
+
+
+def test_changed_memory_starts_over(usb_com, tag, tmp_path, monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda t: None)
+    file_name = str(tmp_path / "log.txt")
+    interrupt(usb_com, tag, file_name, 3)
+
+    # erased and logged again, same tag
+    tag.memory = bytes(reversed(tag.memory)) * 2
+    usb_com.log_data(file_name, resumable=True)
+    assert read(file_name) == tag.memory
+
+
+def test_journal_synced_every_interval(usb_com, tag, tmp_path, monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda t: None)
+    journaled = []
+    write_journal = usb_com.write_journal
+    monkeypatch.setattr(usb_com, "write_journal", lambda *args: journaled.append(args[1]) or write_journal(*args))
+    usb_com.journal_interval = 4
+    interrupt(usb_com, tag, str(tmp_path / "log.txt"), 10)
+    # every 4 blocks, then the blocks received before the failure
+    assert journaled == [4000, 8000, 10000]
@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+from scheduler import DeviceScheduler, PRIORITY_BULK, PRIORITY_STATUS, PRIORITY_USER
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = DeviceScheduler()
+    yield scheduler
+    scheduler.stop(timeout=1)
+
+
+''' Occupies the scheduler thread until the returned event is set '''
+def block(scheduler):
+    release = threading.Event()
+    started = threading.Event()
+
+    def wait():
+        started.set()
+        release.wait(1)
+    scheduler.submit(wait)
+    started.wait(1)
+    return release
+
+
+def test_priority_order(scheduler):
+    release = block(scheduler)
+    order = []
+    futures = [scheduler.submit(order.append, name, priority=priority)
+               for name, priority in (("bulk", PRIORITY_BULK), ("status", PRIORITY_STATUS), ("user", PRIORITY_USER))]
+    release.set()
+    for future in futures:
+        future.result(1)
+    assert order == ["user", "status", "bulk"]
+
+
+def test_same_key_coalesced(scheduler):
+    release = block(scheduler)
+    calls = []
+    first = scheduler.submit(calls.append, 1, key="STATUS")
+    second = scheduler.submit(calls.append, 2, key="STATUS")
+    assert first is second
+    release.set()
+    first.result(1)
+    assert calls == [1]
+    # key is free again once the job ran
+    scheduler.call(calls.append, 3, key="STATUS")
+    assert calls == [1, 3]
+
+
+def test_exception_reaches_caller(scheduler):
+    with pytest.raises(ZeroDivisionError):
+        scheduler.call(lambda: 1 / 0)
+    assert scheduler.call(lambda: 1) == 1
+
+
+def test_call_timeout_cancels_waiting_job(scheduler):
+    release = block(scheduler)
+    calls = []
+    with pytest.raises(TimeoutError):
+        scheduler.call(calls.append, 1, key="SENSOR", timeout=0.05)
+    # cancelled job is not joined by the next submit with its key
+    future = scheduler.submit(calls.append, 2, key="SENSOR")
+    release.set()
+    future.result(1)
+    scheduler.call(lambda: None)
+    assert calls == [2]
+
+
+def test_stop_cancels_waiting(scheduler):
+    release = block(scheduler)
+    future = scheduler.submit(lambda: 1)
+    scheduler.stop(timeout=0)
+    assert future.cancelled()
+    release.set()
+    with pytest.raises(Exception, match="stopped"):
+        scheduler.submit(lambda: 1)
@@ -0,0 +1,62 @@
+import pytest
+
+from session import SessionRecorder, read_session, session_samples, TX
+from usb import REPLAY_PREFIX, UsbConnection
+
+
+@pytest.fixture
+def session(simulator, tmp_path):
+    file_name = str(tmp_path / "session.bin")
+    usb_com = UsbConnection(simulator.start(), 115200)
+    usb_com.recorder = SessionRecorder(file_name, {"port": usb_com.port}, flush_interval=0.05)
+    usb_com.connect()
+    recorded = (usb_com.get_device_status(), usb_com.get_sensor_data(), usb_com.get_tag_id())
+    usb_com.ser.close()
+    usb_com.recorder.stop()
+    return file_name, recorded
+
+
+def test_recording(session, simulator):
+    file_name, recorded = session
+    metadata, records = read_session(file_name)
+    assert metadata["port"] == simulator.port
+    assert [data for t, kind, data in records if kind == TX] == [b'$01#', b'$04#$07#', b'$10#', b'$12#']
+    samples = session_samples(records)
+    assert len(samples) == 1
+    assert samples["gps_lat"][0] == float(recorded[1][2])
+    times = [t for t, kind, data in records]
+    assert times == sorted(times)
+
+
+def test_replay_answers_recorded_commands(session):
+    file_name, recorded = session
+    replay = UsbConnection(REPLAY_PREFIX + file_name)
+    replay.replay_speed = 0
+    replay.connect()
+    assert (replay.get_device_status(), replay.get_sensor_data(), replay.get_tag_id()) == recorded
+    replay.ser.timeout = 0.1
+    # nothing recorded for it, times out like a silent device
+    with pytest.raises(Exception, match="not responding"):
+        replay.get_tag_id()
+
+
+def test_status_is_recorded(simulator, tmp_path):
+    file_name = str(tmp_path / "session.bin")
+    usb_com = UsbConnection(simulator.start(), 115200)
+    usb_com.recorder = SessionRecorder(file_name, {"port": usb_com.port}, flush_interval=0.05)
+    usb_com.connect()
+    status, sensor_data = usb_com.get_status()
+    usb_com.ser.close()
+    usb_com.recorder.stop()
+
+    metadata, records = read_session(file_name)
+    # one pipelined request
+    assert [data for t, kind, data in records if kind == TX] == [b'$01#', b'$04#$07#$10#']
+    samples = session_samples(records)
+    assert len(samples) == 1
+    assert samples["gps_lat"][0] == float(sensor_data[2])
+
+    replay = UsbConnection(REPLAY_PREFIX + file_name)
+    replay.replay_speed = 0
+    replay.connect()
+    assert replay.get_status() == (status, sensor_data)
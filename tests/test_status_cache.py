@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+from scheduler import DeviceScheduler
+from status_cache import StatusCache
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = DeviceScheduler()
+    yield scheduler
+    scheduler.stop(timeout=1)
+
+
+''' Occupies the scheduler thread until the returned event is set '''
+def block(scheduler):
+    release = threading.Event()
+    started = threading.Event()
+
+    def wait():
+        started.set()
+        release.wait(1)
+    scheduler.submit(wait)
+    started.wait(1)
+    return release
+
+
+def test_ttl():
+    calls = []
+    cache = StatusCache(lambda: calls.append(1) or len(calls), ttl=60)
+    assert cache.get() == 1
+    assert cache.get() == 1
+    assert cache.get(max_age=0) == 2
+    cache.invalidate()
+    assert cache.get() == 3
+    cache.store(10)
+    assert cache.get() == 10
+    assert (cache.hits, cache.misses) == (2, 3)
+
+
+def test_shares_query_in_flight(scheduler):
+    calls = []
+    cache = StatusCache(lambda: calls.append(1) or "status", submit=scheduler.submit)
+    release = block(scheduler)
+    first = cache.request()
+    second = cache.request()
+    release.set()
+    assert first.result(1) == second.result(1) == "status"
+    assert len(calls) == 1
+
+
+def test_invalidated_in_flight(scheduler):
+    cache = StatusCache(lambda: "old", submit=scheduler.submit)
+    release = block(scheduler)
+    future = cache.request()
+    cache.invalidate()
+    release.set()
+    assert future.result(1) == "old"
+    # result of a query started before invalidate() is not cached
+    assert cache.value is None
+
+
+def test_device_status(usb_com, simulator):
+    cache = StatusCache(usb_com.get_device_status, ttl=60)
+    status = cache.get()
+    assert status.state_name == 'WAIT_TIME_SETUP'
+    assert status.memory_used == len(simulator.memory) * 10000 // simulator.capacity
+    queries = simulator.commands.count('STATE_DEVICE')
+    cache.get()
+    assert simulator.commands.count('STATE_DEVICE') == queries
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+import sync
+from simulator import synthetic_log
+
+
+def read(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read()
+
+
+def test_sync_appends_new_memory(usb_com, simulator, tmp_path):
+    archive_dir = str(tmp_path)
+    result = sync.sync_device(usb_com, archive_dir, "SIM0001")
+    assert result["complete"] and result["new_bytes"] == len(simulator.memory)
+
+    old = simulator.memory
+    simulator.memory = old + synthetic_log(5000, seed=1)
+    result = sync.sync_device(usb_com, archive_dir, "SIM0001")
+    assert result["new_bytes"] == len(simulator.memory) - len(old)
+    assert read(result["file"]) == simulator.memory
+
+    assert sync.sync_device(usb_com, archive_dir, "SIM0001")["new_bytes"] == 0
+
+
+def test_sync_rewritten_memory(usb_com, simulator, tmp_path):
+    archive_dir = str(tmp_path)
+    old = simulator.memory
+    sync.sync_device(usb_com, archive_dir, "SIM0001")
+
+    # erased and logged again, tail CRC no longer matches
+    simulator.memory = synthetic_log(2 * len(old), seed=1)
+    result = sync.sync_device(usb_com, archive_dir, "SIM0001")
+    assert result["new_bytes"] == len(simulator.memory)
+    assert read(result["file"]) == old + simulator.memory
+
+
+def test_state_written_every_interval(usb_com, simulator, tmp_path, monkeypatch):
+    usb_com.block_size = 1000
+    usb_com.journal_interval = 4
+    saved = []
+    update_state = sync.update_state
+    monkeypatch.setattr(sync, "update_state", lambda *args: saved.append(args[2]["offset"]) or update_state(*args))
+    result = sync.sync_device(usb_com, str(tmp_path), "SIM0001")
+    # 33 blocks, state after every 4th and after the last
+    assert saved == list(range(4000, 33000, 4000)) + [len(simulator.memory)]
+    assert sync.read_state(str(tmp_path))["SIM0001"]["offset"] == result["offset"] == len(simulator.memory)
+
+
+def test_interrupted_sync_continues(usb_com, simulator, tmp_path, monkeypatch):
+    archive_dir = str(tmp_path)
+    usb_com.block_size = 1000
+    read_block = usb_com.read_memory_block_retry
+
+    def fail_at_10000(offset, length):
+        if offset >= 10000:
+            raise Exception("Device is not responding!")
+        return read_block(offset, length)
+    monkeypatch.setattr(usb_com, "read_memory_block_retry", fail_at_10000)
+    with pytest.raises(Exception, match="not responding"):
+        sync.sync_device(usb_com, archive_dir, "SIM0001")
+    assert sync.read_state(archive_dir)["SIM0001"]["offset"] == 10000
+
+    monkeypatch.setattr(usb_com, "read_memory_block_retry", read_block)
+    result = sync.sync_device(usb_com, archive_dir, "SIM0001")
+    assert result["new_bytes"] == len(simulator.memory) - 10000
+    assert read(result["file"]) == simulator.memory
+
+
+def test_lost_state_continues_after_archive(usb_com, simulator, tmp_path):
+    archive_dir = str(tmp_path)
+    sync.sync_device(usb_com, archive_dir, "SIM0001")
+    os.remove(os.path.join(archive_dir, sync.STATE_NAME))
+
+    old = simulator.memory
+    simulator.memory = old + synthetic_log(5000, seed=1)
+    result = sync.sync_device(usb_com, archive_dir, "SIM0001")
+    assert result["new_bytes"] == len(simulator.memory) - len(old)
+    assert read(result["file"]) == simulator.memory
+
+
+def test_lost_state_of_other_memory_is_refused(usb_com, simulator, tmp_path):
+    archive_dir = str(tmp_path)
+    sync.sync_device(usb_com, archive_dir, "SIM0001")
+    os.remove(os.path.join(archive_dir, sync.STATE_NAME))
+
+    simulator.memory = synthetic_log(len(simulator.memory), seed=1)
+    with pytest.raises(Exception, match="no sync state"):
+        sync.sync_device(usb_com, archive_dir, "SIM0001")
+    assert sync.read_state(archive_dir) == {}
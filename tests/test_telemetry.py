@@ -0,0 +1,97 @@
+import threading
+import time
+
+import numpy as np
+
+from telemetry import LiveSampler, TelemetryBuffer, decimate_minmax, sensor_sample
+
+SENSOR_DATA = ['30012', '17.107748', '48.148598', '300.1', '120005', '7', '120005']
+
+
+def test_buffer_keeps_latest_samples():
+    buffer = TelemetryBuffer(4)
+    for i in range(6):
+        buffer.append(sensor_sample(SENSOR_DATA, t=i))
+    assert list(buffer.snapshot()["t"]) == [2, 3, 4, 5]
+    # total keeps counting when the buffer is full
+    assert buffer.count == 4 and buffer.total == 6
+    buffer.clear()
+    assert len(buffer.snapshot()) == 0 and buffer.total == 0
+
+
+def test_sensor_sample():
+    sample = sensor_sample(['', '17.1', '48.1', 'x'] + SENSOR_DATA[4:], t=1.0)
+    assert sample[0] == 1.0 and np.isnan(sample[1]) and np.isnan(sample[4])
+    assert sensor_sample(SENSOR_DATA, t=1.0)[1] == 300.12
+
+
+def test_decimate_keeps_peaks():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.zeros(1000)
+    y[500] = 10.0
+    y[700] = -10.0
+    x_out, y_out = decimate_minmax(x, y, 50)
+    assert len(x_out) == 100
+    assert y_out.max() == 10.0 and y_out.min() == -10.0
+
+
+def test_sampler():
+    buffer = TelemetryBuffer(100)
+    sampler = LiveSampler(lambda: SENSOR_DATA, buffer, rate=100.0)
+    sampler.start()
+    time.sleep(0.1)
+    sampler.stop()
+    total = buffer.total
+    assert total > 0 and sampler.latest == SENSOR_DATA
+    time.sleep(0.05)
+    assert buffer.total == total
+
+
+def test_stop_does_not_wait_for_stuck_read():
+    release = threading.Event()
+    reading = threading.Event()
+
+    def read_sample():
+        reading.set()
+        release.wait(5)
+        return SENSOR_DATA
+
+    buffer = TelemetryBuffer(100)
+    sampler = LiveSampler(read_sample, buffer, rate=100.0)
+    sampler.start()
+    reading.wait(1)
+    thread = sampler.thread
+
+    start = time.monotonic()
+    sampler.stop(timeout=0.1)
+    assert time.monotonic() - start < 1
+    assert thread.daemon and thread.is_alive()
+
+    # stopped thread exits once the read returns, its sample is dropped
+    release.set()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert buffer.total == 0
+
+
+def test_restart_while_stopped_thread_still_reads():
+    release = threading.Event()
+    reads = []
+
+    def read_sample():
+        reads.append(threading.current_thread())
+        release.wait(5)
+        return SENSOR_DATA
+
+    sampler = LiveSampler(read_sample, TelemetryBuffer(100), rate=100.0)
+    sampler.start()
+    old = sampler.thread
+    time.sleep(0.05)
+    sampler.stop(timeout=0)
+    sampler.start()
+    release.set()
+    old.join(1)
+    time.sleep(0.05)
+    sampler.stop()
+    # old thread does not pick up the new run
+    assert reads.count(old) == 1
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+import track_lod
+from track_lod import Track, dp_significance
+
+
+''' Textbook recursive Douglas-Peucker, indices of points kept at tolerance '''
+def douglas_peucker(x, y, tolerance, start=0, end=None):
+    end = len(x) - 1 if end is None else end
+    if end - start < 2:
+        return [start, end]
+    dx, dy = x[end] - x[start], y[end] - y[start]
+    px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+    norm = np.hypot(dx, dy)
+    distance = np.abs(dx * py - dy * px) / norm if norm > 0 else np.hypot(px, py)
+    split = start + 1 + int(np.argmax(distance))
+    if distance.max() <= tolerance:
+        return [start, end]
+    return douglas_peucker(x, y, tolerance, start, split)[:-1] + douglas_peucker(x, y, tolerance, split, end)
+
+
+@pytest.fixture
+def walk():
+    rng = np.random.default_rng(0)
+    return np.cumsum(rng.normal(size=2000)), np.cumsum(rng.normal(size=2000))
+
+
+@pytest.mark.parametrize("tolerance", [0.5, 2.0, 10.0, 50.0])
+def test_significance_matches_douglas_peucker(walk, tolerance):
+    x, y = walk
+    kept = np.flatnonzero(dp_significance(x, y) > tolerance)
+    assert list(kept) == douglas_peucker(x, y, tolerance)
+
+
+def test_straight_line_keeps_end_points():
+    x = np.linspace(0, 1, 100)
+    significance = dp_significance(x, 2 * x)
+    assert np.isinf(significance[[0, -1]]).all()
+    assert np.allclose(significance[1:-1], 0)
+    assert len(dp_significance(np.array([]), np.array([]))) == 0
+
+
+def test_projection_round_trip():
+    long, lat = np.array([-180.0, 0.0, 17.107748]), np.array([-60.0, 0.0, 48.148598])
+    x, y = track_lod.project(long, lat)
+    assert x[1] == y[1] == 0.5
+    back_long, back_lat = track_lod.unproject(x, y)
+    np.testing.assert_allclose(back_long, long)
+    np.testing.assert_allclose(back_lat, lat)
+
+
+@pytest.fixture
+def track():
+    # 0.02 deg east-west zigzag over 5000 points
+    t = np.arange(5000)
+    return Track("tag", 17.0 + t * 4e-6, 48.0 + 1e-4 * np.sin(t / 20), "cyan")
+
+
+def test_levels_coarser_at_low_zoom(track):
+    counts = [len(track.level(zoom)[0]) for zoom in (0, 10, 15, track_lod.MAX_LOD_ZOOM + 1)]
+    assert counts == sorted(counts)
+    assert counts[0] == 2
+    assert counts[-1] == len(track)
+
+
+def test_view_culling(track):
+    x0, y0, x1, y1 = track.bounds()
+    zoom = track_lod.MAX_LOD_ZOOM + 1
+    (x, y), = track.visible(zoom, (x0, y0, x1, y1))
+    assert len(x) == len(track)
+
+    # left tenth of the track, only runs touching the view are drawn
+    view = (x0, y0, x0 + (x1 - x0) / 10, y1)
+    parts = track.visible(zoom, view)
+    drawn = sum(len(x) for x, y in parts)
+    assert len(track) // 10 <= drawn <= len(track) // 10 + 2 * track_lod.CHUNK
+    assert all(x.min() <= view[2] for x, y in parts)
+
+    assert track.visible(zoom, (x1 + 1, y0, x1 + 2, y1)) == []
+
+
+def test_max_points_falls_back_to_coarser_level(track):
+    view = track.bounds()
+    zoom = track_lod.MAX_LOD_ZOOM + 1
+    drawn = sum(len(x) for x, y in track.visible(zoom, view, max_points=500))
+    assert 2 <= drawn <= 501
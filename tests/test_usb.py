@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from simulator import Faults
+from usb import UsbConnection
+
+
+def test_status(usb_com, simulator):
+    status, sensor_data = usb_com.get_status()
+    assert status.state_name == 'WAIT_TIME_SETUP'
+    assert status.gps_fix
+    assert len(sensor_data) == 7
+    # one write carries all three queries
+    assert simulator.commands[-3:] == ['STATE_MEMORY', 'STATE_DEVICE', 'READ_SENSOR_DATA']
+
+
+def test_pipeline_keeps_order(usb_com):
+    responses = usb_com.pipeline(["READ_TAG_ID", "STATE_DEVICE", "READ_TAG_ID"])
+    assert responses[0] == responses[2] == '$SIM0001#'
+    assert responses[1] == '$1,1,1,51#'
+
+
+def test_tag_id(usb_com, simulator):
+    assert usb_com.read_tag_id() == 'SIM0001'
+    simulator.tag_id = ''
+    assert usb_com.read_tag_id() == 'port-' + os.path.basename(simulator.port)
+
+
+def test_not_connected():
+    usb_com = UsbConnection("/dev/null", 115200)
+    with pytest.raises(Exception, match="not connected"):
+        usb_com.get_status()
+    with pytest.raises(Exception, match="not connected"):
+        usb_com.set_altitude(100)
+
+
+def test_response_after_log_is_pushed_back(usb_com, tmp_path):
+    # next response arrived in the same chunk as the end of the log
+    usb_com.rx_frames.feed(b'$line\n#$EOF_LOG#$1,1,1,51#')
+    with open(str(tmp_path / "log.txt"), 'wb') as f:
+        assert usb_com.stream_data(f, '$EOF_LOG#') == len(b'line\n')
+    assert usb_com.receive_data('#') == '$1,1,1,51#'
+
+
+def test_check_received_str(usb_com):
+    assert usb_com.check_received_str('$1,1,1,51#')
+    assert not usb_com.check_received_str('')
+    # both ends are checked
+    assert not usb_com.check_received_str('$1,1,1,51')
+    assert not usb_com.check_received_str('1,1,1,51#')
+
+
+def test_setup_moves_device_state(usb_com, simulator):
+    usb_com.set_time(12, 30)
+    usb_com.set_altitude(150)
+    assert usb_com.get_device_state()[2] == 40
+    assert simulator.wake_time == (12, 30)
+    assert simulator.altitude == 150
+
+
+def test_log_data(usb_com, simulator, tmp_path):
+    usb_com.dump_mode = 0
+    file_name = str(tmp_path / "log.txt")
+    usb_com.log_data(file_name)
+    with open(file_name, 'rb') as f:
+        assert f.read() == simulator.memory
+    # link is still in step after the dump
+    assert usb_com.get_tag_id() == 'SIM0001'
+
+
+def test_log_data_resumable(usb_com, simulator, tmp_path):
+    file_name = str(tmp_path / "log.txt")
+    assert usb_com.log_data(file_name, resumable=True) == len(simulator.memory)
+    with open(file_name, 'rb') as f:
+        assert f.read() == simulator.memory
+
+
+def test_stalled_dump(simulator, usb_com, tmp_path):
+    simulator.faults = Faults(stall_at=1000)
+    usb_com.dump_mode = 0
+    usb_com.log_timeout = 0.2
+    with pytest.raises(Exception, match="not responding"):
+        usb_com.log_data(str(tmp_path / "log.txt"))
+
+
+def test_erase(usb_com, simulator):
+    usb_com.erase_flash_memory()
+    assert simulator.memory == b''
+    assert usb_com.get_memory_state()[0] == 0
@@ -0,0 +1,135 @@
+import numpy as np
+
+''' Level of detail for GPS tracks. Positions are projected to Web Mercator world coordinates
+    (0..1, same as map tiles, 256 * 2**zoom pixels per world). Douglas-Peucker is run once
+    for the whole track and gives every point the tolerance up to which it stays in the
+    simplified line, a level of the pyramid is then just a threshold of it. Every level is
+    split into short runs with bounding boxes, so only runs inside the view are drawn '''
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.05112878
+# above this zoom all points are drawn, view culling alone keeps it cheap
+MAX_LOD_ZOOM = 18
+CHUNK = 256
+
+
+def project(long, lat):
+    lat = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(long, dtype=np.float64) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+    return x, y
+
+
+def unproject(x, y):
+    long = np.asarray(x) * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * np.asarray(y)))))
+    return long, lat
+
+
+''' Douglas-Peucker significance of every point - largest tolerance at which the point is kept.
+    All segments of one recursion depth are split together with vectorized NumPy, loop count
+    is the recursion depth, not the number of points '''
+def dp_significance(x, y):
+    n = len(x)
+    significance = np.zeros(n)
+    if n == 0:
+        return significance
+    significance[[0, -1]] = np.inf
+
+    starts = np.array([0])
+    ends = np.array([n - 1])
+    parent = np.array([np.inf])
+    while len(starts):
+        lengths = ends - starts - 1
+        keep = lengths > 0
+        starts, ends, parent, lengths = starts[keep], ends[keep], parent[keep], lengths[keep]
+        if not len(starts):
+            break
+
+        first = np.cumsum(lengths) - lengths
+        segment = np.repeat(np.arange(len(starts)), lengths)
+        index = np.repeat(starts + 1 - first, lengths) + np.arange(lengths.sum())
+
+        x0, y0 = x[starts][segment], y[starts][segment]
+        dx, dy = x[ends][segment] - x0, y[ends][segment] - y0
+        px, py = x[index] - x0, y[index] - y0
+        norm = np.hypot(dx, dy)
+        # distance to chord, distance to start point when the chord is a point
+        distance = np.where(norm > 0, np.abs(dx * py - dy * px) / np.where(norm > 0, norm, 1.0), np.hypot(px, py))
+
+        largest = np.maximum.reduceat(distance, first)
+        candidates = np.flatnonzero(distance == largest[segment])
+        split = index[candidates[np.unique(segment[candidates], return_index=True)[1]]]
+
+        # child is never kept at a larger tolerance than its parent
+        value = np.minimum(largest, parent)
+        significance[split] = value
+        starts, ends = np.concatenate((starts, split)), np.concatenate((split, ends))
+        parent = np.concatenate((value, value))
+
+    return significance
+
+
+class Track:
+    ''' Projected track with lazily built levels, each level holds point indices and bounding
+        boxes of runs of CHUNK points, neighbouring runs share their end point '''
+    def __init__(self, name, long, lat, color="cyan"):
+        self.name = name
+        self.color = color
+        self.x, self.y = project(long, lat)
+        self.significance = dp_significance(self.x, self.y)
+        self.levels = {}
+
+    def __len__(self):
+        return len(self.x)
+
+    def bounds(self):
+        return self.x.min(), self.y.min(), self.x.max(), self.y.max()
+
+    def level(self, zoom):
+        level = min(max(0, int(np.ceil(zoom))), MAX_LOD_ZOOM + 1)
+        if level not in self.levels:
+            if level > MAX_LOD_ZOOM:
+                indices = np.arange(len(self.x))
+            else:
+                # half a pixel at this zoom
+                tolerance = 0.5 / (TILE_SIZE * 2.0 ** level)
+                indices = np.flatnonzero(self.significance > tolerance)
+            starts = np.arange(0, max(1, len(indices) - 1), CHUNK)
+            ends = np.minimum(starts + CHUNK, len(indices) - 1)
+            x, y = self.x[indices], self.y[indices]
+            boxes = np.empty((len(starts), 4))
+            # inclusive end, so that runs connect
+            boxes[:, 0] = np.minimum.reduceat(x, starts)
+            boxes[:, 1] = np.minimum.reduceat(y, starts)
+            boxes[:, 2] = np.maximum.reduceat(x, starts)
+            boxes[:, 3] = np.maximum.reduceat(y, starts)
+            boxes[:, 0] = np.minimum(boxes[:, 0], x[ends])
+            boxes[:, 1] = np.minimum(boxes[:, 1], y[ends])
+            boxes[:, 2] = np.maximum(boxes[:, 2], x[ends])
+            boxes[:, 3] = np.maximum(boxes[:, 3], y[ends])
+            self.levels[level] = (indices, starts, ends, boxes)
+        return self.levels[level]
+
+    ''' Lists of x, y arrays of continuous visible parts of the track at zoom. When more than
+        max_points would be drawn, coarser levels are used '''
+    def visible(self, zoom, view, max_points=None):
+        level = min(max(0, int(np.ceil(zoom))), MAX_LOD_ZOOM + 1)
+        while True:
+            indices, starts, ends, boxes = self.level(level)
+            inside = (boxes[:, 0] <= view[2]) & (boxes[:, 2] >= view[0]) & (boxes[:, 1] <= view[3]) & \
+                (boxes[:, 3] >= view[1])
+            chunks = np.flatnonzero(inside)
+            if max_points is None or level == 0 or (ends[chunks] - starts[chunks]).sum() <= max_points:
+                break
+            level -= 1
+        if not len(chunks):
+            return []
+
+        # neighbouring visible runs are joined into one polyline
+        breaks = np.flatnonzero(np.diff(chunks) > 1) + 1
+        parts = []
+        for run in np.split(chunks, breaks):
+            selected = indices[starts[run[0]]:ends[run[-1]] + 1]
+            parts.append((self.x[selected], self.y[selected]))
+        return parts
@@ -1,181 +1,828 @@
 import time
 import serial
 import os
+import re
+import json
+import zlib
+import functools
 from contextlib import contextmanager
 import enum
+from typing import NamedTuple
+
+import binary_dump
+import link_tuning
+from instrumentation import Instrumentation
+
+COMMANDS = {
+    "CONNECTION_RESPONSE": '01',
+    "ERASE_MEMORY": '02',
+    "READ_MEMORY": '03',
+    "STATE_MEMORY": '04',
+    "SET_TIME": '05',
+    "SET_ALTITUDE": '06',
+    "STATE_DEVICE": '07',
+    "DISCONNECT": '08',
+    "SET_CLOCK": '09',
+    "READ_SENSOR_DATA": '10',
+    "READ_MEMORY_RANGE": '11',
+    "READ_TAG_ID": '12',
+    "SET_BAUD": '13',
+    "READ_MEMORY_BINARY": '14',
+}
+
+# port name of a recorded session replayed by session.ReplaySerial
+REPLAY_PREFIX = "replay:"
+# tag ID made from the port name when firmware does not report one
+PORT_TAG_PREFIX = "port-"
+
+
+DEVICE_STATES = {
+    "0": 'WAIT_FIRST_FIX',
+    "1": 'WAIT_TIME_SETUP',
+    "2": 'WAIT_ALT_SETUP',
+    "3": 'SET_SLEEP_MODE',
+    "40": 'WAIT_ALT_TRIGGER',
+    "41": 'WAKE_UP_GPS',
+    "42": 'WAIT_FOR_GPS_FIX',
+    "43": 'LOG_MEAS_DATA',
+}
+
+
+def device_state_name(state):
+    state_str = str(state)
+    # states of logging loop are two digits 4x
+    key = state_str[:2] if state_str[0] == "4" else state_str[0]
+    return DEVICE_STATES.get(key, '')
+
+
+''' Records latency and errors of the decorated command when instrumentation of the connection is enabled '''
+def instrumented(name):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.instrumentation.enabled:
+                return method(self, *args, **kwargs)
+            with self.instrumentation.command(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def port_tag_id(port):
+    return PORT_TAG_PREFIX + os.path.basename(port)
+
+
+''' Tag ID usable as part of a file name '''
+def file_tag_id(tag_id):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', tag_id)
+
+
+def time_arg(hh, mm):
+    return '%02d%02d' % (hh, mm)
+
+
+def altitude_arg(alt):
+    alt = int(alt)
+    if alt < 1000:
+        return '%04d' % alt
+    else:
+        return '0' + str(alt)
+
+
+def parse_memory_state(frame):
+    used_mem, state = frame[1:-1].split(',')
+    return int(used_mem), int(state)
+
+
+def parse_device_state(frame):
+    baro, gps, state, gps_fix = frame[1:-1].split(',')
+    return int(gps), int(baro), int(state), int(gps_fix)
+
+
+def parse_sensor_data(frame):
+    baro_alt, gps_long, gps_lat, gps_alt, gps_time, gps_fix_time, gps_time_time = frame[1:-1].split(',')
+    return baro_alt, gps_long, gps_lat, gps_alt, gps_time, gps_fix_time, gps_time_time
+
+
+class DeviceStatus(NamedTuple):
+    ''' STATE_MEMORY and STATE_DEVICE decoded together, flags are 1 ok, 2 unknown, other bad '''
+    memory_used: int
+    memory_state: int
+    gps: int
+    baro: int
+    state: int
+    gps_fix: bool
+
+    @property
+    def memory_percent(self):
+        return self.memory_used / 100
+
+    @property
+    def state_name(self):
+        return device_state_name(self.state)
+
+
+def parse_device_status(memory_frame, device_frame):
+    used_mem, state_mem = parse_memory_state(memory_frame)
+    gps, baro, state, gps_fix = parse_device_state(device_frame)
+    return DeviceStatus(used_mem, state_mem, gps, baro, state, gps_fix == ord('3'))
+
+
+def parse_block_header(frame):
+    offset, length, total, crc = frame[1:-1].split(',')
+    return int(offset), int(length), int(total), int(crc, 16)
+
+
+class FrameParser:
+    ''' Ring buffer of received bytes, splits them into $...# frames in order of arrival '''
+    def __init__(self, capacity=65536, termination='#'):
+        self.buffer = bytearray(capacity)
+        self.capacity = capacity
+        self.termination = ord(termination)
+        self.head = 0
+        self.size = 0
+
+    def feed(self, data):
+        if self.size + len(data) > self.capacity:
+            raise Exception("Receive buffer overflow!")
+        tail = (self.head + self.size) % self.capacity
+        first = min(len(data), self.capacity - tail)
+        self.buffer[tail:tail + first] = data[:first]
+        self.buffer[:len(data) - first] = data[first:]
+        self.size += len(data)
+
+    ''' Puts data back in front of the buffered bytes, for bytes taken but not consumed '''
+    def unread(self, data):
+        if self.size + len(data) > self.capacity:
+            raise Exception("Receive buffer overflow!")
+        self.head = (self.head - len(data)) % self.capacity
+        first = min(len(data), self.capacity - self.head)
+        self.buffer[self.head:self.head + first] = data[:first]
+        self.buffer[:len(data) - first] = data[first:]
+        self.size += len(data)
+
+    def free(self):
+        return self.capacity - self.size
+
+    def find(self, value):
+        end = min(self.head + self.size, self.capacity)
+        index = self.buffer.find(value, self.head, end)
+        if index != -1:
+            return index - self.head
+        wrapped = self.size - (end - self.head)
+        index = self.buffer.find(value, 0, wrapped)
+        if index != -1:
+            return end - self.head + index
+        return -1
+
+    def take(self, n):
+        n = min(n, self.size)
+        first = min(n, self.capacity - self.head)
+        data = bytes(self.buffer[self.head:self.head + first]) + bytes(self.buffer[:n - first])
+        self.head = (self.head + n) % self.capacity
+        self.size -= n
+        return data
+
+    ''' Returns next complete frame or None '''
+    def next_frame(self):
+        index = self.find(self.termination)
+        if index == -1:
+            return None
+        return self.take(index + 1).decode('utf-8')
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
+
+
+class LogStreamWriter:
+    ''' Writes memory dump fed chunk by chunk into file until termination is found, memory use is
+        bounded by chunk size. Strips starting char and the byte before termination, same as [1:-10] '''
+    def __init__(self, f, termination, starting_char='$'):
+        self.f = f
+        self.sentinel = bytes(termination, 'utf-8')
+        self.starting_char = bytes(starting_char, 'utf-8')
+        # bytes kept back, so that termination split across two chunks is still found
+        self.hold_back = len(self.sentinel) + 1
+        self.pending = bytearray()
+        self.received = 0
+        self.written = 0
+        self.first_chunk = True
+        self.done = False
+
+    ''' Returns number of bytes of chunk consumed, which is less than len(chunk) only when done '''
+    def feed(self, chunk):
+        consumed = len(chunk)
+        if self.first_chunk and chunk:
+            if chunk[:1] != self.starting_char:
+                raise Exception("Invalid string received!")
+            chunk = chunk[1:]
+            self.first_chunk = False
+
+        search_from = max(0, len(self.pending) - len(self.sentinel) + 1)
+        self.pending += chunk
+        end = self.pending.find(self.sentinel, search_from)
+        if end != -1:
+            self.f.write(self.pending[:max(0, end - 1)])
+            self.written += max(0, end - 1)
+            # bytes after termination belong to the next response
+            consumed -= len(self.pending) - end - len(self.sentinel)
+            self.received += consumed
+            self.pending = bytearray()
+            self.done = True
+            return consumed
+
+        if len(self.pending) > self.hold_back:
+            self.f.write(self.pending[:-self.hold_back])
+            self.written += len(self.pending) - self.hold_back
+            del self.pending[:-self.hold_back]
+
+        self.received += consumed
+        return consumed
 
 
 class UsbConnection:
     def __init__(self, port="", baud_rate=0):
-        self.ser = serial.Serial()
+        # port is opened in connect()
+        self.ser = None
         self.port = port
         self.baud_rate = baud_rate
         self.rx_data = bytearray()
+        self.rx_frames = FrameParser()
         self.termination_char = '#'
         self.starting_char = '$'
-        self.command = {
-            "CONNECTION_RESPONSE": '01',
-            "ERASE_MEMORY": '02',
-            "READ_MEMORY": '03',
-            "STATE_MEMORY": '04',
-            "SET_TIME": '05',
-            "SET_ALTITUDE": '06',
-            "STATE_DEVICE": '07',
-            "DISCONNECT": '08',
-            "SET_CLOCK": '09',
-            "READ_SENSOR_DATA": '10',
-        }
-
+        # log download - chunk size [B], inactivity timeout [s], progress report period [s]
+        self.chunk_size = 4096
+        self.log_timeout = 500
+        self.progress_interval = 0.2
+        self.command = dict(COMMANDS)
+        # resumable download - block size [B], retries of a single block, blocks between journal syncs
+        self.block_size = 4096
+        self.block_retries = 3
+        self.journal_interval = 16
+        # baud switch - pause before following device [s], device fallback to previous rate [s]
+        self.baud_switch_delay = 0.05
+        self.baud_revert_time = 3.0
+        # binary dump - mode asked for (0 = text only), answer timeout of old firmware [s],
+        # None until first download tells whether firmware supports it. Result is cached per
+        # tag in link_cache, so only the first download of a tag with old firmware waits
+        self.dump_mode = binary_dump.MODE_DELTA
+        self.dump_probe_timeout = 0.3
+        self.binary_dump = None
+        self.link_cache = link_tuning.CACHE_FILE
+        # reported by READ_TAG_ID on this connection, None until asked
+        self.tag_id = None
+        # disabled by default, see instrumentation.py
+        self.instrumentation = Instrumentation()
+        # session.SessionRecorder getting all port traffic and sensor samples, replay speed of
+        # replay:<file> ports (0 = recorded order without delays)
+        self.recorder = None
+        self.replay_speed = 1.0
+
+    @instrumented("CONNECTION_RESPONSE")
     def connect(self):
         try:
-            self.ser = serial.Serial(
-                port=self.port,
-                baudrate=self.baud_rate,
-                parity=serial.PARITY_NONE,
-                stopbits=serial.STOPBITS_ONE,
-                bytesize=serial.EIGHTBITS,
-                timeout=2
-            )
-        except serial.SerialException as e:
+            if self.port.startswith(REPLAY_PREFIX):
+                from session import ReplaySerial
+                self.ser = ReplaySerial(self.port[len(REPLAY_PREFIX):], self.replay_speed, timeout=2)
+            else:
+                self.ser = serial.Serial(
+                    port=self.port,
+                    baudrate=self.baud_rate,
+                    parity=serial.PARITY_NONE,
+                    stopbits=serial.STOPBITS_ONE,
+                    bytesize=serial.EIGHTBITS,
+                    timeout=2
+                )
+        except (serial.SerialException, OSError) as e:
             print(e)
             raise Exception("Bad port!")
 
+        self.rx_frames.clear()
+        self.binary_dump = None
+        self.tag_id = None
         try:
-            self.ser.write(bytes('$01#', 'utf-8'))
-            self.rx_data = self.ser.read_until(expected=bytes('$BAT_GPS#', 'utf-8'))
-
-            if '$BAT_GPS#' not in self.rx_data.decode('utf-8'):
-                raise Exception("Device is not responding!")
-
+            self.handshake()
         except Exception as e:
             self.ser.close()
             raise e
 
-    def log_data(self, file_name):
-        if self.ser.isOpen():
+    def handshake(self):
+        self.ser.write(bytes('$01#', 'utf-8'))
+        if self.instrumentation.enabled:
+            self.instrumentation.add_bytes_out(4)
+        if self.recorder is not None:
+            self.recorder.sent(b'$01#')
+        self.rx_data = self.count_received(self.ser.read_until(expected=bytes('$BAT_GPS#', 'utf-8')))
+
+        if '$BAT_GPS#' not in self.rx_data.decode('utf-8', 'replace'):
+            raise Exception("Device is not responding!")
+
+    @instrumented("LOG_DATA")
+    def log_data(self, file_name, progress_callback=None, resumable=False):
+        if resumable:
+            return self.log_data_resumable(file_name, progress_callback)
+
+        if self.binary_dump is None and self.tag_id:
+            self.binary_dump = link_tuning.cached_binary_dump(self.tag_id, self.link_cache)
+        if self.is_open() and self.dump_mode and self.binary_dump is not False:
+            if self.log_data_binary(file_name, progress_callback):
+                return
+
+        if self.is_open():
             try:
-                with open(file_name, 'w') as f:
+                with open(file_name, 'wb') as f:
                     cmd = self.starting_char + self.command["READ_MEMORY"] + self.termination_char
                     self.send_cmd(cmd)
-                    self.ser.timeout = 500
-                    preprocessed_data = self.receive_data('$EOF_LOG#')
-                    preprocessed_data = preprocessed_data[1:-10]
-                    f.write(preprocessed_data)
+                    self.ser.timeout = self.log_timeout
+                    self.stream_data(f, '$EOF_LOG#', progress_callback)
+            except Exception as e:
+                raise e
+            finally:
+                self.ser.timeout = 2
+
+    ''' Downloads memory in binary dump mode, output file is the same as from text mode.
+        Returns False without touching the file when firmware does not support it '''
+    def log_data_binary(self, file_name, progress_callback=None):
+        cmd = self.starting_char + self.command["READ_MEMORY_BINARY"] + str(self.dump_mode) + self.termination_char
+        if self.send_cmd(cmd) is not True:
+            raise Exception("Device is not responding!")
+        try:
+            self.ser.timeout = self.dump_probe_timeout
+            header = self.receive_data(self.termination_char)
+        except Exception:
+            # old firmware ignores unknown commands
+            header = ''
+        finally:
+            self.ser.timeout = 2
+        self.binary_dump = header == '$BIN%d#' % self.dump_mode
+        if self.tag_id:
+            link_tuning.update_binary_dump(self.tag_id, self.binary_dump, self.link_cache)
+        if not self.binary_dump:
+            self.rx_frames.clear()
+            return False
+
+        try:
+            with open(file_name, 'wb') as f:
+                self.ser.timeout = self.log_timeout
+                self.stream_binary(f, progress_callback)
+        finally:
+            self.ser.timeout = 2
+        return True
+
+    def stream_binary(self, f, progress_callback=None):
+        received = 0
+        written = 0
+        start_time = time.monotonic()
+        last_report = start_time
+
+        while True:
+            header = self.read_bytes(binary_dump.FRAME_HEADER.size)
+            if len(header) != binary_dump.FRAME_HEADER.size:
+                raise Exception("Device is not responding!")
+            length, crc = binary_dump.FRAME_HEADER.unpack(header)
+            payload = self.read_bytes(length)
+            if len(payload) != length:
+                raise Exception("Device is not responding!")
+            if zlib.crc32(payload) != crc:
+                raise Exception("Memory block CRC mismatch!")
+            received += len(header) + length
+            if not length:
+                break
+            text = binary_dump.decode_payload(payload)
+            f.write(text)
+            written += len(text)
+
+            now = time.monotonic()
+            if progress_callback is not None and now - last_report >= self.progress_interval:
+                last_report = now
+                progress_callback(received, received / (now - start_time))
+
+        if progress_callback is not None:
+            elapsed = time.monotonic() - start_time
+            progress_callback(received, received / elapsed if elapsed > 0 else 0.0)
+
+        return written
+
+    def stream_data(self, f, termination, progress_callback=None):
+        writer = LogStreamWriter(f, termination, self.starting_char)
+        start_time = time.monotonic()
+        last_report = start_time
+
+        while not writer.done:
+            chunk = self.read_chunk(self.chunk_size)
+            if not chunk:
+                raise Exception("Device is not responding!")
+            consumed = writer.feed(chunk)
+            if consumed < len(chunk):
+                # start of the next response
+                self.rx_frames.unread(chunk[consumed:])
+
+            now = time.monotonic()
+            if progress_callback is not None and now - last_report >= self.progress_interval:
+                last_report = now
+                progress_callback(writer.received, writer.received / (now - start_time))
+
+        if progress_callback is not None:
+            elapsed = time.monotonic() - start_time
+            progress_callback(writer.received, writer.received / elapsed if elapsed > 0 else 0.0)
+
+        return writer.written
+
+    ''' Downloads memory block by block with READ_MEMORY_RANGE, every block is CRC checked.
+        Verified offset is journaled to <file_name>.part together with tag ID and memory size,
+        so an interrupted download of the same tag continues where it stopped when called
+        again. Another tag or changed memory starts the download over. Data and journal are
+        synced every journal_interval blocks. Journal is removed when download is complete '''
+    def log_data_resumable(self, file_name, progress_callback=None):
+        if not self.is_open():
+            return
+
+        try:
+            tag_id = self.get_tag_id()
+        except Exception:
+            # old firmware does not know READ_TAG_ID
+            tag_id = ''
+
+        journal_name = file_name + '.part'
+        offset = 0
+        expected_total = None
+        if os.path.exists(journal_name) and os.path.exists(file_name):
+            with open(journal_name, 'r') as j:
+                journal = json.load(j)
+            if journal.get("tag_id") == tag_id:
+                offset = min(int(journal["offset"]), os.path.getsize(file_name))
+                expected_total = int(journal["total"])
+
+        received = 0
+        total = expected_total or 0
+        blocks = 0
+        start_time = time.monotonic()
+        last_report = start_time
+
+        with open(file_name, 'r+b' if offset > 0 else 'wb') as f:
+            f.truncate(offset)
+            f.seek(offset)
+            try:
+                while True:
+                    data, total = self.read_memory_block_retry(offset, self.block_size)
+                    if expected_total is not None and total != expected_total:
+                        # memory changed since the interrupted download
+                        offset = 0
+                        f.seek(0)
+                        f.truncate(0)
+                        data, total = self.read_memory_block_retry(offset, self.block_size)
+                    expected_total = None
+                    if not data:
+                        break
+
+                    f.write(data)
+                    offset += len(data)
+                    received += len(data)
+                    blocks += 1
+                    if blocks % self.journal_interval == 0:
+                        self.sync_journal(f, journal_name, offset, total, tag_id)
+
+                    now = time.monotonic()
+                    if progress_callback is not None and now - last_report >= self.progress_interval:
+                        last_report = now
+                        progress_callback(offset, received / (now - start_time))
+
+                    if offset >= total:
+                        break
             except Exception as e:
+                # blocks written so far are verified, keep them for the next attempt
+                if total:
+                    self.sync_journal(f, journal_name, offset, total, tag_id)
                 raise e
+            finally:
+                self.ser.timeout = 2
+
+        if os.path.exists(journal_name):
+            os.remove(journal_name)
+
+        if progress_callback is not None:
+            elapsed = time.monotonic() - start_time
+            progress_callback(offset, received / elapsed if elapsed > 0 else 0.0)
+
+        return offset
+
+    def read_memory_block_retry(self, offset, length):
+        for attempt in range(self.block_retries + 1):
+            try:
+                return self.read_memory_block(offset, length)
+            except Exception as e:
+                # failed attempt and its error are in the READ_MEMORY_RANGE counters and trace
+                if attempt == self.block_retries:
+                    raise e
+                if self.instrumentation.enabled:
+                    self.instrumentation.count("retry:READ_MEMORY_RANGE")
+                self.drain_input()
+
+    ''' Drops the rest of a broken response before asking again. Frame buffer is emptied and bytes
+        still arriving are read and dropped until the line is quiet for quiet seconds, at most
+        for the port timeout. Dropped bytes are counted and recorded like any received bytes '''
+    def drain_input(self, quiet=0.1):
+        self.rx_frames.clear()
+        deadline = time.monotonic() + (self.ser.timeout or quiet)
+        while True:
+            time.sleep(quiet)
+            pending = self.ser.in_waiting
+            if not pending or time.monotonic() > deadline:
+                break
+            self.count_received(self.ser.read(pending))
+        self.rx_frames.clear()
+
+    ''' Reads one memory block, device answers with header $<offset>,<length>,<total>,<crc32>#
+        followed by <length> raw bytes. Zero length means end of memory '''
+    @instrumented("READ_MEMORY_RANGE")
+    def read_memory_block(self, offset, length):
+        self.check_connected()
+        cmd = self.starting_char + self.command["READ_MEMORY_RANGE"] + \
+            '%010d' % offset + '%05d' % length + self.termination_char
+        if self.send_cmd(cmd) is not True:
+            raise Exception("Device is not responding!")
+
+        self.ser.timeout = 2
+        header = self.receive_data(self.termination_char)
+
+        block_offset, block_length, total, crc = parse_block_header(header)
+        if block_offset != offset or block_length > length:
+            raise Exception("Invalid memory block received!")
+
+        data = self.read_bytes(block_length)
+        if len(data) != block_length:
+            raise Exception("Device is not responding!")
+        if zlib.crc32(data) != crc:
+            raise Exception("Memory block CRC mismatch!")
+
+        return data, total
+
+    ''' Syncs data written to f, then journals offset, the journal never points past synced data '''
+    def sync_journal(self, f, journal_name, offset, total, tag_id):
+        f.flush()
+        os.fsync(f.fileno())
+        self.write_journal(journal_name, offset, total, tag_id)
+
+    def write_journal(self, journal_name, offset, total, tag_id=''):
+        tmp_name = journal_name + '.tmp'
+        with open(tmp_name, 'w') as j:
+            json.dump({"offset": offset, "total": total, "tag_id": tag_id}, j)
+            j.flush()
+            os.fsync(j.fileno())
+        os.replace(tmp_name, journal_name)
 
     def send_cmd(self, cmd):
-        if self.ser.isOpen():
+        if self.is_open():
             try:
                 self.ser.write(bytes(cmd, 'utf-8'))
             except Exception as e:
                 print(e)
-                self.ser.reset_output_buffer()
+                if self.instrumentation.enabled:
+                    self.instrumentation.count("send_error")
                 return False
             else:
-                self.ser.reset_output_buffer()
+                if self.instrumentation.enabled:
+                    self.instrumentation.add_bytes_out(len(cmd))
+                if self.recorder is not None:
+                    self.recorder.sent(bytes(cmd, 'utf-8'))
                 return True
 
     def receive_data(self, termination):
-        if self.ser.isOpen():
-            try:
-                self.rx_data = self.ser.read_until(expected=bytes(termination, 'utf-8'))
-                if termination not in self.rx_data.decode('utf-8'):
+        if self.is_open():
+            if termination != self.termination_char:
+                return self.receive_until(termination)
+
+            frame = self.rx_frames.next_frame()
+            while frame is None:
+                if not self.rx_frames.free():
+                    self.rx_frames.clear()
+                    raise Exception("Receive buffer overflow!")
+                # bytes past the frame, e.g. a binary dump, stay in the port buffer
+                data = self.count_received(self.ser.read(max(1, min(self.ser.in_waiting, self.rx_frames.free()))))
+                if not data:
+                    # partial frame would break matching of the next response
+                    self.rx_frames.clear()
                     raise Exception("Device is not responding!")
-            except Exception as e:
-                self.ser.reset_input_buffer()
-                raise e
-            else:
-                if self.check_received_str(self.rx_data.decode('utf-8')):
-                    self.ser.reset_input_buffer()
-                    return self.rx_data.decode('utf-8')
-                else:
-                    self.ser.reset_input_buffer()
-                    raise Exception("Invalid string received!")
+                self.rx_frames.feed(data)
+                frame = self.rx_frames.next_frame()
 
+            if self.check_received_str(frame):
+                return frame
+            else:
+                raise Exception("Invalid string received!")
+
+    def receive_until(self, termination):
+        self.rx_data = self.rx_frames.take(self.rx_frames.size) + \
+            self.count_received(self.ser.read_until(expected=bytes(termination, 'utf-8')))
+        if not self.rx_data.endswith(bytes(termination, 'utf-8')):
+            raise Exception("Device is not responding!")
+        if self.check_received_str(self.rx_data.decode('utf-8')):
+            return self.rx_data.decode('utf-8')
+        else:
+            raise Exception("Invalid string received!")
+
+    ''' Returns bytes already buffered by frame parser first, then reads from port '''
+    def read_chunk(self, size):
+        if self.rx_frames.size:
+            return self.rx_frames.take(size)
+        return self.count_received(self.ser.read(max(1, min(self.ser.in_waiting, size))))
+
+    def read_bytes(self, size):
+        data = self.rx_frames.take(size)
+        if len(data) < size:
+            data += self.count_received(self.ser.read(size - len(data)))
+        return data
+
+    def count_received(self, data):
+        if self.instrumentation.enabled:
+            self.instrumentation.add_bytes_in(len(data))
+        if self.recorder is not None and data:
+            self.recorder.received(data)
+        return data
+
+    ''' Sends all commands at once and returns their responses in the same order, so that
+        N queries cost about one link latency instead of N '''
+    def pipeline(self, names):
+        self.check_connected()
+        cmd = ''.join(self.starting_char + self.command[name] + self.termination_char for name in names)
+        if self.send_cmd(cmd) is not True:
+            raise Exception("Device is not responding!")
+        return [self.receive_data(self.termination_char) for name in names]
+
+    ''' DeviceStatus and sensor data in one pipelined round trip '''
+    @instrumented("STATUS")
+    def get_status(self):
+        memory, device, sensor = self.pipeline(["STATE_MEMORY", "STATE_DEVICE", "READ_SENSOR_DATA"])
+        sensor_data = parse_sensor_data(sensor)
+        if self.recorder is not None:
+            self.recorder.sample(sensor_data)
+        return parse_device_status(memory, device), sensor_data
+
+    ''' Memory and device state in one pipelined round trip '''
+    @instrumented("DEVICE_STATUS")
+    def get_device_status(self):
+        memory, device = self.pipeline(["STATE_MEMORY", "STATE_DEVICE"])
+        return parse_device_status(memory, device)
+
+    @instrumented("STATE_MEMORY")
     def get_memory_state(self):
         cmd = self.starting_char + self.command["STATE_MEMORY"] + self.termination_char
 
         if self.send_cmd(cmd) is True:
             preprocessed_data = self.receive_data(self.termination_char)
-            preprocessed_data = preprocessed_data[1:-1]
-            used_mem, state = preprocessed_data.split(',')
-            used_mem = int(used_mem)
-            state = int(state)
-            return used_mem, state
+            return parse_memory_state(preprocessed_data)
         else:
             return [0, 0]
 
+    @instrumented("STATE_DEVICE")
     def get_device_state(self):
         cmd = self.starting_char + self.command["STATE_DEVICE"] + self.termination_char
 
         if self.send_cmd(cmd) is True:
             preprocessed_data = self.receive_data(self.termination_char)
-            preprocessed_data = preprocessed_data[1:-1]
-            baro, gps, state, gps_fix = preprocessed_data.split(',')
-            return int(gps), int(baro), int(state), int(gps_fix)
+            return parse_device_state(preprocessed_data)
         else:
             return [0, 0, 0, 0]
 
+    @instrumented("READ_SENSOR_DATA")
     def get_sensor_data(self):
         cmd = self.starting_char + self.command["READ_SENSOR_DATA"] + self.termination_char
 
         if self.send_cmd(cmd) is True:
             try:
                 preprocessed_data = self.receive_data(self.termination_char)
-                preprocessed_data = preprocessed_data[1:-1]
-                print(preprocessed_data)
-                baro_alt, gps_long, gps_lat, gps_alt, gps_time, gps_fix_time, gps_time_time = preprocessed_data.split(',')
+                sensor_data = parse_sensor_data(preprocessed_data)
             except Exception:
                 raise Exception
             else:
-                return baro_alt, gps_long, gps_lat, gps_alt, gps_time, gps_fix_time, gps_time_time
+                if self.recorder is not None:
+                    self.recorder.sample(sensor_data)
+                return sensor_data
         else:
             return []
 
-    def set_altitude(self, alt):
-        alt = int(alt)
-
-        if alt < 10:
-            cmd = self.starting_char + self.command["SET_ALTITUDE"] + '000' + str(alt) + self.termination_char
-        elif alt < 100:
-            cmd = self.starting_char + self.command["SET_ALTITUDE"] + '00' + str(alt) + self.termination_char
-        elif alt < 1000:
-            cmd = self.starting_char + self.command["SET_ALTITUDE"] + '0' + str(alt) + self.termination_char
+    @instrumented("READ_TAG_ID")
+    def get_tag_id(self):
+        cmd = self.starting_char + self.command["READ_TAG_ID"] + self.termination_char
+
+        if self.send_cmd(cmd) is True:
+            preprocessed_data = self.receive_data(self.termination_char)
+            self.tag_id = preprocessed_data[1:-1]
+            return self.tag_id
         else:
-            cmd = self.starting_char + self.command["SET_ALTITUDE"] + '0' + str(alt) + self.termination_char
+            return ''
 
+    ''' Tag ID, port-<port name> when firmware does not know READ_TAG_ID or reports none '''
+    def read_tag_id(self):
+        try:
+            tag_id = self.get_tag_id()
+        except Exception:
+            tag_id = ''
+        return tag_id or port_tag_id(self.port)
+
+    @instrumented("SET_ALTITUDE")
+    def set_altitude(self, alt):
+        self.check_connected()
+        cmd = self.starting_char + self.command["SET_ALTITUDE"] + altitude_arg(alt) + self.termination_char
         return self.send_cmd(cmd)
 
+    @instrumented("SET_TIME")
     def set_time(self, hh, mm):
-        if hh < 10:
-            hour = '0' + str(hh)
-        else:
-            hour = str(hh)
-
-        if mm < 10:
-            minute = '0' + str(mm)
-        else:
-            minute = str(mm)
-
-        cmd = self.starting_char + self.command["SET_TIME"] + hour + minute + self.termination_char
+        self.check_connected()
+        cmd = self.starting_char + self.command["SET_TIME"] + time_arg(hh, mm) + self.termination_char
         self.send_cmd(cmd)
 
+    @instrumented("SET_CLOCK")
     def set_clock(self, hh, mm):
-        if hh < 10:
-            hour = '0' + str(hh)
-        else:
-            hour = str(hh)
+        self.check_connected()
+        cmd = self.starting_char + self.command["SET_CLOCK"] + time_arg(hh, mm) + self.termination_char
+        self.send_cmd(cmd)
 
-        if mm < 10:
-            minute = '0' + str(mm)
-        else:
-            minute = str(mm)
+    ''' Round trip times [s] of STATE_DEVICE with lengths of its request and response. The shortest
+        round trip is the one least disturbed by host scheduling '''
+    def measure_rtt(self, samples=5):
+        self.check_connected()
+        cmd = self.starting_char + self.command["STATE_DEVICE"] + self.termination_char
+        rtts = []
+        response = ''
+        for i in range(samples):
+            start = time.perf_counter()
+            if self.send_cmd(cmd) is not True:
+                raise Exception("Device is not responding!")
+            response = self.receive_data(self.termination_char)
+            rtts.append(time.perf_counter() - start)
+        return rtts, len(cmd), len(response)
+
+    ''' Asks device to switch its UART to baud and follows it. Device answers $OK# at the old rate
+        and switches. It goes back to the old rate by itself unless the same command is repeated
+        at the new rate within baud_revert_time, which commits the rate. Returns False when device
+        refused the rate or old firmware did not answer '''
+    @instrumented("SET_BAUD")
+    def set_link_baud(self, baud):
+        self.check_connected()
+        cmd = self.starting_char + self.command["SET_BAUD"] + '%07d' % baud + self.termination_char
+        if self.send_cmd(cmd) is not True:
+            raise Exception("Device is not responding!")
+        try:
+            preprocessed_data = self.receive_data(self.termination_char)
+        except Exception:
+            return False
+        if preprocessed_data[1:-1] != 'OK':
+            return False
 
-        cmd = self.starting_char + self.command["SET_CLOCK"] + hour + minute + self.termination_char
-        self.send_cmd(cmd)
+        if baud != self.baud_rate:
+            self.ser.flush()
+            time.sleep(self.baud_switch_delay)
+            self.ser.baudrate = baud
+            self.baud_rate = baud
+            self.ser.reset_input_buffer()
+            self.rx_frames.clear()
+        return True
+
+    ''' Handshake and CRC checked test blocks at current rate, False on any error. Status queries
+        are used instead of blocks when memory is empty '''
+    def verify_link(self, blocks=2):
+        try:
+            self.handshake()
+            offset = 0
+            for i in range(blocks):
+                data, total = self.read_memory_block(offset, self.block_size)
+                if not data:
+                    self.get_device_state()
+                offset = offset + len(data) if offset + len(data) < total else 0
+        except Exception as e:
+            print(e)
+            return False
+        return True
+
+    ''' Switches link to baud, verifies and commits it. When anything fails, waits for the device
+        to revert and continues at the current rate '''
+    def change_baud_rate(self, baud, blocks=2):
+        self.check_connected()
+        previous = self.baud_rate
+        if baud == previous:
+            return True
+        switch_time = time.monotonic()
+        if not self.set_link_baud(baud):
+            return False
+        try:
+            if self.verify_link(blocks) and self.set_link_baud(baud):
+                return True
+        except Exception as e:
+            print(e)
+
+        self.ser.baudrate = previous
+        self.baud_rate = previous
+        time.sleep(max(0.0, switch_time + self.baud_revert_time - time.monotonic()) + self.baud_switch_delay)
+        self.ser.reset_input_buffer()
+        self.rx_frames.clear()
+        self.handshake()
+        return False
 
+    @instrumented("ERASE_MEMORY")
     def erase_flash_memory(self):
+        self.check_connected()
         try:
             cmd = self.starting_char + self.command["ERASE_MEMORY"] + self.termination_char
             self.send_cmd(cmd)
@@ -190,8 +837,9 @@ class UsbConnection:
         except Exception as e:
             raise e
 
+    @instrumented("DISCONNECT")
     def disconnect(self):
-        if self.ser.isOpen():
+        if self.is_open():
             try:
                 cmd = self.starting_char + self.command["DISCONNECT"] + self.termination_char
                 self.send_cmd(cmd)
@@ -205,6 +853,13 @@ class UsbConnection:
             else:
                 self.ser.close()
 
+    def is_open(self):
+        return self.ser is not None and self.ser.isOpen()
+
+    def check_connected(self):
+        if not self.is_open():
+            raise Exception("Device is not connected!")
+
     def set_port(self, port):
         self.port = port
 
@@ -219,7 +874,7 @@ class UsbConnection:
 
     ''' Checks if received string has proper starting and termination  '''
     def check_received_str(self, string):
-        if string[0] != self.starting_char and string[-1] != self.termination_char:
+        if not string or string[0] != self.starting_char or string[-1] != self.termination_char:
             return False
         else:
             return True